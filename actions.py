@@ -0,0 +1,211 @@
+# actions.py
+# 模型回复 -> 操作对象：宽松地找出回复中的操作数组，严格按格式校验，编译为不可变的 Action。
+#   - 容忍数组前后的推理文字、```json 代码块、<think> 标签，推理文字中零散的括号不会被误当成数组
+#   - 每个字段按操作类型校验，错误逐条给出位置与原因（"第 2 个操作（type）缺少 text"），
+#     可以直接发回给模型只修正格式（见 ai_handler 的修正重问），不必浪费一整步
+#   - 坐标在编译时统一为视口归一化浮点数，执行时不再判断类型；模型若给出编码后图像上的像素坐标，按图像尺寸换算
+#   - 模型可为操作附带 confidence（0~1 的自评置信度），模型级联据此决定是否改用推理模型（见 ai_handler）
+# 缓存、录制回放与对话历史以 JSON 保存操作，用 to_dict / result_to_json / result_from_json 在两种形式之间转换。
+import json
+import re
+from collections import namedtuple
+
+DONE_MARKER = "目标完成"
+
+# 以坐标点为目标的操作（一个点）
+POINT_ACTIONS = ("click", "double_click", "right_click", "hover", "type", "scroll_to")
+ACTION_KINDS = POINT_ACTIONS + ("swipe", "press_key", "wait")
+DEFAULT_WAIT_MS = 1000
+
+_THINK = re.compile(r"<think>.*?</think>", re.S)
+_ARRAY_START = re.compile(r"\[\s*\{")
+_OBJECT_START = re.compile(r"\{\s*\"action\"")
+
+
+class ActionParseError(ValueError):
+    """模型回复不符合操作格式；errors 为逐条的具体问题"""
+
+    def __init__(self, errors):
+        self.errors = [errors] if isinstance(errors, str) else list(errors)
+        super().__init__("；".join(self.errors))
+
+
+class Action(namedtuple("Action", ["kind", "points", "text", "key", "duration", "element", "confidence"])):
+    """编译后的操作（不可变，无实例字典）。
+
+    points 为视口归一化坐标 ((x, y), ...)：swipe 为起点和终点两个点，press_key / wait 没有点；
+    element 为模型引用的元素编号（见 dom_grounding），没有时为 None；
+    confidence 为模型给出的置信度（0~1），没有给出时为 None。
+    """
+
+    __slots__ = ()
+
+    def to_dict(self):
+        """还原为模型格式的字典（坐标保留 4 位小数），用于缓存、录制与对话历史"""
+        data = {"action": self.kind}
+        if self.kind == "swipe":
+            (x1, y1), (x2, y2) = self.points
+            data["coordinate"] = {"x1": round(x1, 4), "y1": round(y1, 4), "x2": round(x2, 4), "y2": round(y2, 4)}
+        elif self.points:
+            x, y = self.points[0]
+            data["coordinate"] = {"x": round(x, 4), "y": round(y, 4)}
+        if self.text is not None:
+            data["text"] = self.text
+        if self.key is not None:
+            data["key"] = self.key
+        if self.duration is not None:
+            data["duration"] = self.duration
+        if self.element is not None:
+            data["element"] = self.element
+        if self.confidence is not None:
+            data["confidence"] = round(self.confidence, 2)
+        return data
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _normalize(value, extent, size):
+    """0~1 之间的值为归一化坐标；大于 1 的视为 size（编码后图像尺寸）上的像素，取像素中心换算"""
+    if 0 <= value <= 1:
+        return float(value)
+    if size is not None and value > 1:
+        return min((value + 0.5) / extent, 1.0)
+    return None
+
+
+def _point(coordinate, keys, size, where):
+    """从坐标字典中取出一个归一化的点"""
+    values = []
+    for key, extent in zip(keys, size or (None, None)):
+        value = coordinate.get(key)
+        if not _is_number(value):
+            raise ActionParseError(f"{where}的坐标缺少数值字段 {key}")
+        normalized = _normalize(value, extent, size)
+        if normalized is None:
+            raise ActionParseError(f"{where}的坐标 {key}={value} 超出范围，应为 0~1 的归一化坐标")
+        values.append(normalized)
+    return tuple(values)
+
+
+def compile_action(data, index=0, size=None):
+    """按格式校验一个操作字典并编译为 Action；size 为模型所见图像的 (宽, 高)，用于换算像素坐标"""
+    where = f"第 {index + 1} 个操作"
+    if not isinstance(data, dict):
+        raise ActionParseError(f"{where}不是 JSON 对象")
+    kind = data.get("action")
+    if kind not in ACTION_KINDS:
+        raise ActionParseError(f"{where}的 action 无效: {kind!r}，应为 {' / '.join(ACTION_KINDS)} 之一")
+    where = f"{where}（{kind}）"
+    coordinate = data.get("coordinate")
+    points = ()
+    text = key = duration = element = confidence = None
+
+    if kind in POINT_ACTIONS:
+        if not isinstance(coordinate, dict):
+            raise ActionParseError(f"{where}缺少 coordinate 对象")
+        # 兼容 {"coordinate": {"click": {"x": .., "y": ..}}} 的写法
+        if "x" not in coordinate and isinstance(coordinate.get(kind), dict):
+            coordinate = coordinate[kind]
+        points = (_point(coordinate, ("x", "y"), size, where),)
+    elif kind == "swipe":
+        if not isinstance(coordinate, dict):
+            raise ActionParseError(f"{where}缺少 coordinate 对象")
+        if "x1" not in coordinate and isinstance(coordinate.get("swipe"), dict):
+            coordinate = coordinate["swipe"]
+        points = (_point(coordinate, ("x1", "y1"), size, where), _point(coordinate, ("x2", "y2"), size, where))
+
+    if kind == "type":
+        text = data.get("text")
+        if _is_number(text):
+            text = str(text)
+        if not isinstance(text, str) or not text:
+            raise ActionParseError(f"{where}缺少非空的 text 字段")
+    elif kind == "press_key":
+        key = data.get("key")
+        if not isinstance(key, str) or not key.strip():
+            raise ActionParseError(f"{where}缺少 key 字段（如 \"Enter\"）")
+        key = key.strip()
+    elif kind == "wait":
+        duration = data.get("duration", DEFAULT_WAIT_MS)
+        if not _is_number(duration) or duration < 0:
+            raise ActionParseError(f"{where}的 duration 应为非负的毫秒数，实际为 {duration!r}")
+        duration = int(duration)
+
+    if data.get("element") is not None:
+        element = data["element"]
+        if isinstance(element, str) and element.strip().isdigit():
+            element = int(element)
+        if not isinstance(element, int) or isinstance(element, bool):
+            raise ActionParseError(f"{where}的 element 应为元素编号（整数），实际为 {element!r}")
+
+    if data.get("confidence") is not None:
+        confidence = data["confidence"]
+        if not _is_number(confidence) or not 0 <= confidence <= 1:
+            raise ActionParseError(f"{where}的 confidence 应为 0~1 之间的数值，实际为 {confidence!r}")
+        confidence = float(confidence)
+
+    return Action(kind, points, text, key, duration, element, confidence)
+
+
+def compile_actions(items, size=None):
+    """编译一组操作，返回 Action 元组；任何一个不符合格式时抛出 ActionParseError（包含全部问题）"""
+    if isinstance(items, dict):
+        items = [items]
+    if not isinstance(items, (list, tuple)) or not items:
+        raise ActionParseError("操作数组为空")
+    actions, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            actions.append(compile_action(item, index, size))
+        except ActionParseError as e:
+            errors.extend(e.errors)
+    if errors:
+        raise ActionParseError(errors)
+    return tuple(actions)
+
+
+def strip_thinking(text):
+    return _THINK.sub("", text)
+
+
+def find_action_array(text):
+    """在回复中找出操作数组（或单个操作对象），返回解析出的 JSON 值；找不到时抛出 ActionParseError。
+
+    依次尝试每个 "[{" 开头的位置，取第一个能完整解析为对象数组的；推理文字里的 "[步骤1]" 等不会被误用。
+    """
+    decoder = json.JSONDecoder()
+    first_error = None
+    for pattern in (_ARRAY_START, _OBJECT_START):
+        for match in pattern.finditer(text):
+            try:
+                value, _ = decoder.raw_decode(text, match.start())
+            except json.JSONDecodeError as e:
+                first_error = first_error or f"第 {e.lineno} 行第 {e.colno} 列 JSON 语法错误: {e.msg}"
+                continue
+            if isinstance(value, dict) or (isinstance(value, list) and all(isinstance(v, dict) for v in value)):
+                return value
+    raise ActionParseError(first_error or "回复中没有找到操作的 JSON 数组")
+
+
+def parse_reply(text, size=None, done_marker=DONE_MARKER):
+    """解析模型的完整回复：目标完成时返回 None，否则返回 Action 元组；无法使用时抛出 ActionParseError"""
+    visible = strip_thinking(text or "")
+    if done_marker and done_marker in visible:
+        return None
+    return compile_actions(find_action_array(visible), size)
+
+
+def result_to_json(result):
+    """call_ai 结果转为可 JSON 序列化的形式（操作还原为字典）"""
+    if result.get("status") != "action":
+        return result
+    return {**result, "data": [action.to_dict() for action in result["data"]]}
+
+
+def result_from_json(result):
+    """result_to_json 的逆操作；保存的操作已不符合格式时抛出 ActionParseError"""
+    if result.get("status") != "action":
+        return result
+    return {**result, "data": compile_actions(result.get("data"))}
@@ -0,0 +1,179 @@
+# ai_cache.py
+# call_ai 的响应缓存：同一任务、同一提示词、同一对话历史下画面相同的截图直接复用上次的模型结果。
+# 对话历史计入缓存键：上一次尝试失败（历史中记录了失败说明）后不会再复用同一个结果。
+# 内存层为 LRU + TTL，可选磁盘层（每个键一个 JSON 文件）使结果在重启后仍然可用。
+import copy
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from config import AI_CACHE_MAX_ENTRIES, AI_CACHE_TTL, AI_CACHE_DIR
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow 为可选依赖，缺失时退化为精确字节哈希
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+
+def image_hash(img_bytes, hash_size=8):
+    """计算截图的感知哈希（dHash，hash_size*hash_size 位，十六进制字符串）。
+
+    像素完全相同或仅有极小差异的截图得到相同的哈希；hash_size 越大越能区分细小变化
+    （例如输入框中多了几个字符）。未安装 Pillow 时退化为 sha256 精确哈希。
+    """
+    if Image is None:
+        return "sha256:" + hashlib.sha256(img_bytes).hexdigest()
+    with Image.open(io.BytesIO(img_bytes)) as img:
+        small = img.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+        pixels = list(small.getdata())
+    bits = 0
+    width = hash_size + 1
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * width + col]
+            right = pixels[row * width + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{hash_size * hash_size // 4}x}"
+
+
+def hash_distance(hash_a, hash_b):
+    """两个 dHash 之间的汉明距离；无法比较（长度不同或 sha256）时只区分相同/不同"""
+    if hash_a == hash_b:
+        return 0
+    if len(hash_a) != len(hash_b) or hash_a.startswith("sha256:") or hash_b.startswith("sha256:"):
+        return len(hash_a) * 4
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count("1")
+
+
+def normalize_prompt(prompt):
+    """去掉首尾及连续空白，避免格式差异导致缓存未命中"""
+    return re.sub(r"\s+", " ", prompt).strip()
+
+
+def history_digest(history_messages):
+    """对话历史（含执行失败等说明）的摘要：历史不同时，即使画面相同也不复用之前的结果"""
+    if not history_messages:
+        return ""
+    data = json.dumps(history_messages, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def make_cache_key(task_desc, prompt, img_hash, history="", model=""):
+    """history 为 history_digest 的结果；model 为给出结果的模型，不同模型的结果分别缓存"""
+    raw = "\0".join([task_desc.strip(), normalize_prompt(prompt), img_hash, history, model])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries=AI_CACHE_MAX_ENTRIES, ttl=AI_CACHE_TTL, disk_dir=AI_CACHE_DIR):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()  # key -> (created_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _expired(self, created_at, now):
+        return bool(self.ttl) and now - created_at > self.ttl
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key, now):
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._expired(record["created_at"], now):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return record["created_at"], record["value"]
+
+    def _write_disk(self, key, created_at, value):
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"created_at": created_at, "value": value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError) as e:
+            logger.warning(f"Failed to persist AI cache entry {key}: {e}")
+
+    def _store(self, key, created_at, value):
+        """写入内存层并按 LRU 淘汰，调用方需持有锁"""
+        self._entries[key] = (created_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        """命中时返回结果的副本，否则返回 None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[0], now):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+
+            if self.disk_dir:
+                entry = self._read_disk(key, now)
+                if entry is not None:
+                    self._store(key, *entry)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return copy.deepcopy(entry[1])
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        created_at = time.time()
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._store(key, created_at, value)
+        if self.disk_dir:
+            self._write_disk(key, created_at, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# 全局响应缓存
+response_cache = ResponseCache()
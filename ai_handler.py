@@ -1,36 +1,22 @@
-import base64
-import json
-from zhipuai import ZhipuAI
-from config import API_KEY, MODEL_NAME
-import re
+from config import (MODEL_NAME, AI_CACHE_ENABLED, AI_CACHE_HASH_SIZE, AI_IMAGE_TIER, DOM_GROUNDING_MARKS,
+                    AI_REPAIR_RETRIES, MODEL_CASCADE_ENABLED, FAST_MODEL_NAME, MODEL_CASCADE_MIN_CONFIDENCE)
+from image_encoding import get_tier, encode_image, encoded_size, png_size, to_data_url
+from llm_client import get_llm_client, LLMError
+from ai_cache import response_cache, image_hash, make_cache_key, history_digest
+from stream_parser import IncrementalActionParser
+from actions import ActionParseError, compile_action, parse_reply, result_to_json, result_from_json
+from dom_grounding import format_element_map, draw_marks
+from tracing import span, record_span, metrics
+import time
 
-def extract_json_simple(text):
-    """
-    从文本中提取第一个 { 到最后一个 } 之间的内容，并尝试解析成 JSON。
-    如果失败则返回 None。
-    """
-    start = text.find('[')
-    end = text.rfind(']')
-    if start != -1 and end != -1 and end > start:
-        json_str = text[start:end + 1]
-        try:
-            return json.loads(json_str)
-        except json.JSONDecodeError:
-            return None
-    return None
 
-
-
-def call_ai(img_path, task_desc, history_messages=None):
-    with open(img_path, 'rb') as f:
-        img_base64 = base64.b64encode(f.read()).decode('utf-8')
-    prompt = f"""
-你是一个专业的 UI 自动化测试助手。请根据提供的用户界面截图（分辨率为 1280x720），分析并推理出完成【当前目标】所需的所有操作步骤。
-
-🎯 当前目标：{task_desc}
+# 静态的系统提示词：操作说明与格式约定在所有步骤、所有任务中完全相同，
+# 作为对话的固定前缀发送，可以命中模型服务的前缀缓存，不必每一步重新计费
+SYSTEM_PROMPT = """
+你是一个专业的 UI 自动化测试助手。请根据提供的用户界面截图，分析并推理出完成【当前目标】所需的所有操作步骤。
 
 📐 图像说明：
-- 当前截图分辨率固定为 1280x720。
+- 截图分辨率见每一步的说明。
 - **禁止对图像进行裁剪、缩放或增强处理**，必须基于原始截图进行坐标分析。
 - 所有坐标必须为 **归一化坐标**（x 和 y 值在 0~1 范围内，保留小数点后 4 位），确保多平台一致性。
 
@@ -50,62 +36,399 @@ def call_ai(img_path, task_desc, history_messages=None):
 
 ```json
 [
-  {{
+  {
     "action": "click" | "double_click" | "right_click" | "hover",
-    "coordinate": {{ "x": 0.1234, "y": 0.5678 }}
-  }},
-  {{
+    "coordinate": { "x": 0.1234, "y": 0.5678 }
+  },
+  {
     "action": "type",
-    "coordinate": {{ "x": 0.2345, "y": 0.6789 }},
+    "coordinate": { "x": 0.2345, "y": 0.6789 },
     "text": "示例输入内容"
-  }},
-  {{
+  },
+  {
     "action": "press_key",
     "key": "Enter"
-  }},
-  {{
+  },
+  {
     "action": "swipe",
-    "coordinate": {{ "x1": 0.1234, "y1": 0.5678, "x2": 0.4321, "y2": 0.8765 }}
-  }},
-  {{
+    "coordinate": { "x1": 0.1234, "y1": 0.5678, "x2": 0.4321, "y2": 0.8765 }
+  },
+  {
     "action": "scroll_to",
-    "coordinate": {{ "x": 0.0, "y": 0.9 }}
-  }},
-  {{
+    "coordinate": { "x": 0.0, "y": 0.9 }
+  },
+  {
     "action": "wait",
     "duration": 1500
-  }}
+  }
 ]
 ````
 
 ⚠️ 请严格返回上述格式的 **纯 JSON 数组**，不要添加注释、解释或任何非 JSON 内容。
 
-✅ 如果判断当前目标「{task_desc}」已完成，无需执行任何操作，请仅返回字符串："目标完成"
+🧭 页面元素列表：
+- 每一步可能附带当前视口内可交互元素的列表，格式为 `[编号] 角色 "名称" (中心点 x, y)`，坐标与截图为同一归一化坐标系。
+- 操作目标是列表中的元素时，请在该操作中加上 `"element": 编号`，坐标使用列表中的中心点；执行时以该元素为准。
+- 列表可能不完整（例如画布内的内容），目标不在列表中时按截图给出坐标即可。
+
+🎚️ 置信度：每个操作可以加上 `"confidence": 0~1`，表示你对该操作目标与坐标的把握；没有把握时请如实给出较低的值。
+
+📜 之前步骤中你返回的操作会以对话历史的形式给出，请结合当前截图判断它们是否已经生效。
+
+✅ 如果判断当前目标已完成，无需执行任何操作，请仅返回字符串："目标完成"
 """
 
-    # 构造对话 messages 列表
-    messages = history_messages[:] if history_messages else []
+# 同一个对象在每次请求中复用，保证前缀逐字节一致
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
+# 模型级联的两级：fast 为快速视觉模型，thinking 为先推理再回答的 MODEL_NAME
+CASCADE_MODELS = {"fast": FAST_MODEL_NAME, "thinking": MODEL_NAME}
+ESCALATION_REASONS = {
+    "invalid": "快速模型的输出未通过校验",
+    "low_confidence": "快速模型的置信度低",
+    "error": "快速模型调用失败",
+    "no_effect": "上一步的操作没有产生画面变化",
+}
+
+
+def build_prompt(task_desc, width=1280, height=720, element_map=""):
+    """构造每一步随截图发送的提示词；width / height 为发送给模型的图像尺寸，element_map 为元素列表文本"""
+    elements_text = f"🧭 页面可交互元素：\n{element_map}\n" if element_map else ""
+    return f"""🎯 当前目标：{task_desc}
+📐 当前截图分辨率为 {width}x{height}。
+{elements_text}✅ 如果判断当前目标「{task_desc}」已完成，请仅返回字符串："目标完成"；否则返回操作步骤的 JSON 数组。"""
+
+
+def build_repair_prompt(task_desc, content, errors):
+    """回复不符合格式时的修正请求：只带原回复与具体错误，不重发截图"""
+    problems = "\n".join(f"- {error}" for error in errors)
+    return f"""🎯 当前目标：{task_desc}
+你上一条回复无法按操作格式解析，问题如下：
+{problems}
+
+你上一条回复的内容：
+{content[-4000:]}
+
+请按系统提示中的格式修正后重新回复：只返回 JSON 操作数组（坐标为 0~1 的归一化坐标），或仅返回字符串"目标完成"，不要包含其他内容。"""
+
+
+def _cascade_tiers():
+    """本步可能询问的模型级别（按询问顺序）"""
+    return ("fast", "thinking") if MODEL_CASCADE_ENABLED else ("thinking",)
+
+
+def _prepare_request(img_path, task_desc, history_messages, use_cache, img_bytes, tier, elements=None,
+                     escalate=False):
+    """读取截图、构造 messages 并查询响应缓存，返回 (messages, cache_keys, cached, encoded)。
+
+    优先使用内存中的截图字节 img_bytes（由 operator.screenshot() 返回），
+    避免先写盘再读回；未提供时从 img_path 读取。截图按 tier 档位编码后发送。
+    elements 为截图时的可交互元素列表（见 operator.element_map），随提示词一起发送。
+    cache_keys 为模型级别 -> 缓存键（各级模型的结果分别缓存）；escalate 为 True 时之前的结果已被认为无效，不查询缓存。
+    """
+    if img_bytes is None:
+        with open(img_path, 'rb') as f:
+            img_bytes = f.read()
+    tier = get_tier(tier)
+    width, height = encoded_size(img_bytes, tier)
+    element_map = format_element_map(elements, *png_size(img_bytes)) if elements else ""
+    prompt = build_prompt(task_desc, width, height, element_map)
+
+    # 同一任务、同一提示词、同一对话历史、同一编码档位下画面未变化时，直接复用上次的模型结果
+    cache_keys = {}
+    if use_cache:
+        with span("ai.cache_lookup") as lookup_span:
+            img_hash = f"{tier.name}:{image_hash(img_bytes, AI_CACHE_HASH_SIZE)}"
+            history = history_digest(history_messages)
+            cache_keys = {level: make_cache_key(task_desc, SYSTEM_PROMPT + prompt, img_hash, history,
+                                                CASCADE_MODELS[level])
+                          for level in _cascade_tiers()}
+            cached = None
+            # 优先使用推理模型的结果
+            for level in () if escalate else reversed(_cascade_tiers()):
+                cached = response_cache.get(cache_keys[level])
+                if cached is not None:
+                    try:
+                        cached = result_from_json(cached)
+                        break
+                    except ActionParseError:
+                        # 旧版本缓存的结果不符合当前格式，视为未命中
+                        cached = None
+            lookup_span.set(hit=cached is not None)
+        if cached is not None:
+            print(f"[缓存] 命中模型响应缓存: {response_cache.stats()}")
+            return None, cache_keys, cached, None
+
+    with span("ai.encode", tier=tier.name) as encode_span:
+        if elements and DOM_GROUNDING_MARKS:
+            img_bytes = draw_marks(img_bytes, elements)
+        encoded = encode_image(img_bytes, tier)
+        image_url = to_data_url(encoded)
+        encode_span.set(payload_bytes=len(image_url))
+    # 构造对话 messages 列表：固定的系统提示词 + 历史步骤（见 conversation.ConversationHistory）+ 当前截图
+    messages = [SYSTEM_MESSAGE]
+    messages.extend(history_messages or [])
     messages.append({
         "role": "user",
         "content": [
-            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img_base64}"}},
+            {"type": "image_url", "image_url": {"url": image_url}},
             {"type": "text", "text": prompt}
         ]
     })
-    client = ZhipuAI(api_key=API_KEY)
-    response = client.chat.completions.create(
-        model=MODEL_NAME,
-        messages=messages
-    )
+    return messages, cache_keys, None, encoded
+
+
+def _image_size(encoded):
+    """模型所见图像的尺寸，用于把像素坐标换算为归一化坐标（降分辨率档位下模型可能返回缩小图上的像素）"""
+    return (encoded.width, encoded.height) if encoded is not None else None
+
+
+def _parse_content(content, encoded):
+    """把模型的完整回复解析为 call_ai 的返回格式；不符合格式时返回 error，parse_errors 为逐条的具体问题"""
+    print(content)
+    try:
+        actions = parse_reply(content, _image_size(encoded))
+    except ActionParseError as e:
+        return {"status": "error", "error": f"模型回复无法解析: {e}", "raw": content, "parse_errors": e.errors}
+    return {"status": "done"} if actions is None else {"status": "action", "data": actions}
+
+
+def _cache_result(cache_key, result):
+    """只缓存可用的结果，解析失败或调用失败时下次仍然重新询问模型"""
+    if cache_key and result.get("status") in ("action", "done"):
+        response_cache.put(cache_key, result_to_json(result))
 
-    content = response.choices[0].message.content.strip()
 
-    if "目标完成" in content:
-        return {"status": "done"}
+def _chat(messages, tier, tenant=None, control=None):
+    """向模型级联中的一级发送一次请求；各级的耗时分别汇总为 llm.request.<tier>"""
+    model = CASCADE_MODELS[tier]
+    with span(f"llm.request.{tier}", model=model) as request_span:
+        response = get_llm_client().chat(messages, model=model, tenant=tenant,
+                                         deadline=control.deadline if control else None)
+        request_span.set(usage=response.usage)
+    if control:
+        control.add_usage(response.usage, response.content)
+    return response
+
+
+def _parse_with_repair(content, encoded, task_desc, tenant=None, control=None, retries=AI_REPAIR_RETRIES):
+    """解析回复；不符合格式时把具体错误连同原回复发回给模型修正（纯文本请求，不重发截图），最多 retries 次"""
+    result = _parse_content(content, encoded)
+    for attempt in range(retries):
+        if "parse_errors" not in result:
+            break
+        print(f"[解析] {result['error']}，请求模型修正格式")
+        messages = [SYSTEM_MESSAGE, {"role": "user", "content": build_repair_prompt(task_desc, content,
+                                                                                  result["parse_errors"])}]
+        try:
+            with span("llm.repair", model=MODEL_NAME, attempt=attempt + 1) as repair_span:
+                response = get_llm_client().chat(messages, model=MODEL_NAME, tenant=tenant,
+                                                 deadline=control.deadline if control else None)
+                repair_span.set(usage=response.usage)
+            if control:
+                control.add_usage(response.usage, response.content)
+        except LLMError as e:
+            print(f"[解析] 修正请求失败: {e}")
+            break
+        content = response.content.strip()
+        result = _parse_content(content, encoded)
+    return result
+
+
+def _element_ids(elements):
+    return {element.id for element in elements} if elements else None
+
+
+def _action_problem(action, element_ids=None):
+    """快速模型的单个操作不宜直接执行的原因：引用了元素列表中不存在的编号，或自评置信度低于阈值"""
+    if element_ids is not None and action.element is not None and action.element not in element_ids:
+        return "invalid"
+    if action.confidence is not None and action.confidence < MODEL_CASCADE_MIN_CONFIDENCE:
+        return "low_confidence"
+    return None
+
+
+def _result_problem(result, element_ids=None):
+    """快速模型的结果需要升级到推理模型的原因；可以直接使用时返回 None"""
+    if result["status"] == "error":
+        return "invalid" if "parse_errors" in result else "error"
+    for action in result.get("data") or ():
+        problem = _action_problem(action, element_ids)
+        if problem:
+            return problem
+    return None
+
+
+def _record_route(reason):
+    """记录一次路由结果：reason 为 None 表示采用快速模型的结果，否则为升级到推理模型的原因"""
+    if reason is None:
+        metrics.inc("a2i_model_cascade_fast_accepted_total")
+        return
+    print(f"[级联] 改用推理模型 {MODEL_NAME}（{ESCALATION_REASONS[reason]}）")
+    metrics.inc(f"a2i_model_cascade_escalated_{reason}_total")
+
+
+def _call_tier(messages, tier, encoded, cache_key, task_desc, tenant=None, control=None, element_ids=None):
+    """非流式询问一级模型，返回 (result, reason)：reason 不为 None 时快速模型的结果不可用，需要升级。
+
+    快速模型的回复不符合格式时直接升级，不做修正重问；推理模型的回复按需修正重问。
+    """
+    try:
+        response = _chat(messages, tier, tenant, control)
+    except LLMError as e:
+        if tier == "fast":
+            print(f"[级联] 快速模型调用失败: {e}")
+            return None, "error"
+        return {"status": "error", "error": f"模型调用失败: {e}", "raw": ""}, None
+    with span("ai.parse", tier=tier):
+        if tier == "fast":
+            result = _parse_content(response.content.strip(), encoded)
+            reason = _result_problem(result, element_ids)
+            if reason:
+                return None, reason
+        else:
+            result = _parse_with_repair(response.content.strip(), encoded, task_desc, tenant, control)
+    _cache_result(cache_key, result)
+    return result, None
+
+
+def call_ai(img_path, task_desc, history_messages=None, use_cache=AI_CACHE_ENABLED, img_bytes=None,
+            tenant=None, tier=AI_IMAGE_TIER, elements=None, control=None, escalate=False):
+    """调用视觉模型分析截图。
+
+    tenant 通常为会话 id，用于按会话限制并发请求数；tier 为截图编码档位（见 image_encoding.TIERS）；
+    elements 为截图时的可交互元素列表，给出时随截图一起发送；
+    control 为本次任务的 task_control.TaskControl，给出时请求不超过其截止时间，并累计 token 用量。
+    启用模型级联时先询问快速模型，结果不可用时再询问推理模型；
+    escalate 为 True（上一步的操作没有产生画面变化，见 ConversationHistory.previous_step_had_no_effect）时直接询问推理模型。
+    """
+    messages, cache_keys, cached, encoded = _prepare_request(img_path, task_desc, history_messages, use_cache,
+                                                             img_bytes, tier, elements, escalate)
+    if cached is not None:
+        return cached
+    # 复用全局客户端（连接池、限流与重试见 llm_client）
+    if MODEL_CASCADE_ENABLED:
+        reason = "no_effect"
+        if not escalate:
+            result, reason = _call_tier(messages, "fast", encoded, cache_keys.get("fast"), task_desc, tenant,
+                                        control, _element_ids(elements))
+        _record_route(reason)
+        if reason is None:
+            return result
+    result, _ = _call_tier(messages, "thinking", encoded, cache_keys.get("thinking"), task_desc, tenant, control)
+    return result
+
+
+def _stream_tier(messages, tier, encoded, cache_key, task_desc, tenant=None, control=None, element_ids=None):
+    """流式询问一级模型（生成器）：边生成边产出 partial，返回 (result, reason)，含义同 _call_tier。
+
+    快速模型遇到不符合格式或置信度低的操作时立即结束本次请求：此前还没有产出操作则升级到推理模型；
+    已产出的操作已经执行、无法撤回，以它们作为本步的结果，由下一步根据新画面继续。
+    推理模型跳过不符合格式的操作，继续执行其余操作。
+    """
+    model = CASCADE_MODELS[tier]
+    fast = tier == "fast"
+    parser = IncrementalActionParser()
+    size = _image_size(encoded)
+    actions = []   # 编译通过的操作；不符合格式的操作不执行，记入 invalid
+    invalid = []
+    problem = None
+    # 流式响应跨越多次 yield，期间调用方会执行操作，因此只记录首个操作与整个流的时间点
+    started = time.perf_counter()
+    usage = {}
+    stream = get_llm_client().chat_stream(messages, model=model, tenant=tenant,
+                                          deadline=control.deadline if control else None)
     try:
-        action_data = extract_json_simple(content)
-        print(content)
-        # action_data = json.loads(content)
-        return {"status": "action", "data": action_data}
-    except json.JSONDecodeError:
-        return {"status": "error", "error": "Invalid JSON returned by AI", "raw": content}
+        for chunk in stream:
+            if control:
+                control.check()
+            usage = chunk.usage or usage
+            for data in parser.feed(chunk.content):
+                try:
+                    action = compile_action(data, len(parser.actions) - 1, size)
+                except ActionParseError as e:
+                    invalid.extend(e.errors)
+                    problem = "invalid" if fast else None
+                else:
+                    problem = _action_problem(action, element_ids) if fast else None
+                    if problem is None:
+                        actions.append(action)
+                        if len(actions) == 1:
+                            record_span(f"llm.first_action.{tier}", started)
+                        yield {"status": "partial", "data": action}
+                        continue
+                if problem:
+                    break
+            if problem:
+                break
+    except LLMError as e:
+        record_span(f"llm.stream.{tier}", started, model=model, error=str(e))
+        if fast and not actions:
+            print(f"[级联] 快速模型调用失败: {e}")
+            return None, "error"
+        return {"status": "error", "error": f"模型调用失败: {e}", "raw": parser.raw}, None
+    finally:
+        # 提前结束时关闭响应，释放连接与并发名额
+        stream.close()
+    record_span(f"llm.stream.{tier}", started, model=model, actions=len(actions))
+    if control:
+        control.add_usage(usage, parser.raw)
+
+    content = parser.raw.strip()
+    if problem and not actions:
+        return None, problem
+    if not actions:
+        # 没有可执行的操作：目标完成、格式错误（推理模型可修正重问）或没有操作数组
+        with span("ai.parse", tier=tier):
+            if fast:
+                result = _parse_content(content, encoded)
+                reason = _result_problem(result)
+                if reason:
+                    return None, reason
+            else:
+                result = _parse_with_repair(content, encoded, task_desc, tenant, control)
+        _cache_result(cache_key, result)
+        return result, None
+    print(content)
+    for error in parser.errors + invalid:
+        print(f"[流式解析] {error}")
+    if problem:
+        print(f"[级联] 快速模型的第 {len(actions) + 1} 个操作不可用，本步只执行之前的 {len(actions)} 个操作")
+    result = {"status": "action", "data": tuple(actions)}
+    # 数组没有完整闭合（回复被截断）或有操作被丢弃时不缓存
+    if parser.finished and not parser.errors and not invalid and not problem:
+        _cache_result(cache_key, result)
+    return result, None
+
+
+def call_ai_stream(img_path, task_desc, history_messages=None, use_cache=AI_CACHE_ENABLED, img_bytes=None,
+                   tenant=None, tier=AI_IMAGE_TIER, elements=None, control=None, escalate=False):
+    """call_ai 的流式版本（生成器）。
+
+    模型每输出一个完整的操作对象，就产出 {"status": "partial", "data": action}，
+    调用方可以立即执行，不必等待整个回复生成完毕；最后产出一个与 call_ai 格式相同的最终结果。
+    最终结果为 action 时，其 data 包含全部操作（含已通过 partial 产出的部分）。
+    给出 control 时每个片段之间检查取消与预算（抛出 task_control.TaskCancelled，连接随之关闭）。
+    模型级联与 escalate 的含义同 call_ai。
+    """
+    messages, cache_keys, cached, encoded = _prepare_request(img_path, task_desc, history_messages, use_cache,
+                                                             img_bytes, tier, elements, escalate)
+    if cached is not None:
+        if cached.get("status") == "action":
+            for action in cached.get("data") or []:
+                yield {"status": "partial", "data": action}
+        yield cached
+        return
+
+    if MODEL_CASCADE_ENABLED:
+        reason = "no_effect"
+        if not escalate:
+            result, reason = yield from _stream_tier(messages, "fast", encoded, cache_keys.get("fast"), task_desc,
+                                                     tenant, control, _element_ids(elements))
+        _record_route(reason)
+        if reason is None:
+            yield result
+            return
+    result, _ = yield from _stream_tier(messages, "thinking", encoded, cache_keys.get("thinking"),
+                                        task_desc, tenant, control)
+    yield result
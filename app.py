@@ -1,15 +1,39 @@
-from flask import Flask, render_template, request
+from flask import Flask, Response, render_template, request
 from flask_socketio import SocketIO, emit
+import functools
+import inspect
 import os
-from utils import generate_screenshot_name, ensure_dir
-from ai_handler import call_ai
-from global_operator import start_browser, get_operator, close_operator, is_browser_running, execute_in_browser_thread
+from screenshot_store import screenshot_store
+from ai_handler import call_ai, call_ai_stream
+from conversation import ConversationHistory
+from replay_cache import begin_plan_session
+from tracing import metrics, span, start_trace
+from global_operator import start_browser, get_operator, close_operator, is_browser_running, execute_in_browser_thread, scheduler, save_storage_state
+from storage_state import resolve_profile, storage_state_stats
+from scheduler import SchedulerBusy, task_name
 import json
 import traceback
+from config import EXECUTION_ENGINE, AI_STREAMING, DOM_GROUNDING_ENABLED, CAPTURE_POLICY
+from capture import CapturePolicy, policy_error
+from effect_verifier import EffectVerifier
+from step_actions import StepActions
+from screencast import live_view, screencast_params
+from task_control import TaskControl, TaskCancelled, running_tasks, budget_from_request
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+from cluster import join_cluster, PORT_ENV
+
+# async 引擎：所有会话在同一个事件循环中并发执行，模型等待不再阻塞其他任务
+async_engine = None
+if EXECUTION_ENGINE == "async":
+    from async_engine import async_engine
+
+# 多进程部署（python cluster.py）时本进程是集群中的一个节点，Socket.IO 消息经消息代理在进程间转发
+cluster = join_cluster()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key'
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading',
+                    **({'client_manager': cluster.client_manager()} if cluster is not None else {}))
 
 # 存储客户端SID的全局变量
 client_sids = {}
@@ -18,8 +42,140 @@ client_sids = {}
 def index():
     return render_template('index.html')
 
-def start_browser_task(url, sid):
-    """浏览器启动任务"""
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus 格式的指标：各阶段耗时直方图与运行状态"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+metrics.register_collector(lambda: {
+    'a2i_browser_queue_depth': scheduler.pending(),
+    **{f'a2i_scheduler_{k}': v for k, v in scheduler.stats().items() if k != 'pending'},
+    **{f'a2i_screenshot_store_{k}': v for k, v in screenshot_store.stats().items()},
+    **{f'a2i_live_view_{k}': v for k, v in live_view.stats().items()},
+    **{f'a2i_storage_state_{k}': v for k, v in storage_state_stats().items()},
+    **({f'a2i_cluster_{k}': v for k, v in cluster.stats().items()} if cluster is not None else {}),
+})
+
+# --- 集群：客户端的浏览器相关事件在拥有其浏览器的进程中执行 ---
+
+routed_handlers = {}  # 事件处理函数名 -> 处理函数
+
+def routed(assign=False, release=False):
+    """事件处理函数的装饰器：集群模式下该客户端的浏览器属于其他进程时，把事件转交过去执行。
+
+    assign=True 的事件（启动浏览器）为尚无浏览器的客户端选定拥有者，release=True 的事件（断开连接）转交后解除亲和。
+    """
+    def decorator(handler):
+        arity = len(inspect.signature(handler).parameters)
+        routed_handlers[handler.__name__] = handler
+
+        @functools.wraps(handler)
+        def wrapper(*args):
+            args = args[:arity]
+            if cluster is not None and cluster.forward(request.sid, handler.__name__, args, assign, release):
+                return
+            return handler(*args)
+        return wrapper
+    return decorator
+
+def run_forwarded_event(sid, name, args):
+    """执行其他进程转交来的事件：构造与 Socket.IO 事件相同的请求上下文，emit 经消息代理发回客户端"""
+    with app.test_request_context('/'):
+        request.sid = sid
+        request.namespace = '/'
+        routed_handlers[name](*args)
+
+def session_count():
+    """本进程中已分配浏览器的会话数，作为集群心跳中的负载"""
+    if async_engine is not None:
+        return len(async_engine.sessions)
+    return scheduler.stats()['sessions']
+
+def make_emitter(sid):
+    """返回只向指定客户端发送事件的 emit 函数"""
+    def emit_wrapper(event, data):
+        try:
+            socketio.emit(event, data, to=sid)
+        except Exception as e:
+            print(f"Emit error: {e}")
+    return emit_wrapper
+
+def schedule(func, *args, bounded=True):
+    """把当前客户端的任务交给浏览器工作线程（按会话公平调度）。
+
+    队列已满时向客户端发送 busy 事件并返回 False；需要排队时先推送一次 queue_status，
+    之后位置变化由调度器的 on_queue_update 推送。
+    """
+    try:
+        info = execute_in_browser_thread(func, *args, session_id=request.sid, bounded=bounded)
+    except SchedulerBusy as e:
+        emit('busy', {'msg': str(e), 'task': task_name(func)})
+        return False
+    if info['position'] > 1:
+        emit('queue_status', info)
+    return True
+
+def push_queue_status(sid, info):
+    """调度器回调：向排队中的客户端推送位置与预计等待时间（position 为 0 表示已开始执行）"""
+    socketio.emit('queue_status', info, to=sid)
+
+scheduler.on_queue_update = push_queue_status
+
+async def start_browser_task_async(url, sid, profile=None):
+    """浏览器启动任务（async 引擎）"""
+    emit_wrapper = make_emitter(sid)
+    success, message = await async_engine.start_session(sid, url, profile)
+    if not success:
+        emit_wrapper('browser_error', {'msg': message})
+        return
+    emit_wrapper('browser_started', {'msg': message, 'url': url})
+    operator = async_engine.get_operator(sid)
+    screenshot_store.put(await operator.screenshot(), lambda path: emit_wrapper('screenshot_update', {
+        'type': 'initial',
+        'img': path,
+        'msg': '浏览器启动完成，初始页面截图'
+    }))
+
+async def close_browser_task_async(sid):
+    """关闭浏览器任务（async 引擎）"""
+    await async_engine.close_session(sid)
+    make_emitter(sid)('browser_closed', {'msg': '浏览器已关闭'})
+
+def start_screencast_task(sid, on_frame):
+    """在浏览器线程中开始向客户端推送实时画面"""
+    operator = get_operator(sid)
+    if operator is None:
+        live_view.close(sid)
+        make_emitter(sid)('live_view_error', {'msg': '浏览器未启动'})
+        return
+    operator.start_screencast(on_frame, screencast_params())
+
+def stop_screencast_task(sid):
+    operator = get_operator(sid)
+    if operator is not None:
+        operator.stop_screencast()
+
+async def start_screencast_task_async(sid, on_frame):
+    """开始推送实时画面（async 引擎）"""
+    operator = async_engine.get_operator(sid)
+    if operator is None:
+        live_view.close(sid)
+        make_emitter(sid)('live_view_error', {'msg': '浏览器未启动'})
+        return
+    await operator.start_screencast(on_frame, screencast_params())
+
+async def stop_screencast_task_async(sid):
+    operator = async_engine.get_operator(sid)
+    if operator is not None:
+        await operator.stop_screencast()
+
+def browser_running(sid):
+    if async_engine is not None:
+        return async_engine.has_session(sid)
+    return is_browser_running(sid)
+
+def start_browser_task(url, sid, profile=None):
+    """浏览器启动任务；profile 为服务端配置的凭据档案，该站点与档案保存过登录状态时新会话直接恢复"""
     def emit_wrapper(event, data):
         try:
             socketio.emit(event, data, to=sid)
@@ -27,26 +183,27 @@ def start_browser_task(url, sid):
             print(f"Emit error: {e}")
     
     try:
-        success, message = start_browser(url)
+        # 每个客户端（sid）在共享 Chromium 中拥有独立的 context
+        success, message = start_browser(url, sid, profile)
         if success:
             emit_wrapper('browser_started', {'msg': message, 'url': url})
             
             # 获取初始截图
-            operator = get_operator()
+            operator = get_operator(sid)
             if operator:
-                screenshot_path = generate_screenshot_name("initial", suffix="_browser_start")
-                operator.screenshot(screenshot_path)
-                emit_wrapper('screenshot_update', {
+                # 文件写入后再推送给前端
+                screenshot_store.put(operator.screenshot(), lambda path: emit_wrapper('screenshot_update', {
                     'type': 'initial',
-                    'img': screenshot_path,
+                    'img': path,
                     'msg': '浏览器启动完成，初始页面截图'
-                })
+                }))
         else:
             emit_wrapper('browser_error', {'msg': message})
     except Exception as e:
         emit_wrapper('browser_error', {'msg': f'启动浏览器失败: {str(e)}'})
 
 @socketio.on('start_browser')
+@routed(assign=True)
 def handle_start_browser(data):
     """启动浏览器"""
     # 保存客户端SID
@@ -60,12 +217,24 @@ def handle_start_browser(data):
     # 确保URL有协议
     if not url.startswith(('http://', 'https://')):
         url = 'http://' + url
-    
+    # 凭据档案：只有服务端配置的档案（且访问密钥匹配）才保存与恢复登录状态，其他会话互不共享
+    profile = resolve_profile(data.get('profile'), data.get('profile_key'))
+    if data.get('profile') and profile is None:
+        print(f"[登录状态] 会话 {request.sid} 请求的档案未配置或密钥不匹配，本次不保存也不恢复登录状态")
+
+    # 重新启动会换一个新的 context，旧的实时画面随之失效；前端在 browser_started 后重新订阅
+    live_view.close(request.sid)
+
+    if async_engine is not None:
+        async_engine.submit(start_browser_task_async(url, request.sid, profile))
+        return
+
     # 在浏览器线程中执行启动任务
-    execute_in_browser_thread(start_browser_task, url, request.sid)
+    schedule(start_browser_task, url, request.sid, profile)
 
-def run_task_logic(task_desc, sid):
-    """任务执行逻辑 - 在浏览器线程中运行"""
+def run_task_logic(task_desc, sid, capture_policy=CAPTURE_POLICY, budget=None):
+    """任务执行逻辑 - 在浏览器线程中运行；capture_policy 为操作后截图策略（见 capture.py），
+    budget 为 TaskControl 的参数（时间、步数与 token 上限，见 task_control.budget_from_request）"""
     def emit_wrapper(event, data):
         try:
             socketio.emit(event, data, to=sid)
@@ -77,88 +246,155 @@ def run_task_logic(task_desc, sid):
         return
 
     emit_wrapper('task_start', {'msg': '开始执行任务...'})
-    
+
+    def capture_frame(step_num, substep_idx, last=False, msg='执行操作后截图'):
+        """按截图策略截取操作后的画面，保存并推送给前端（画面未变化时不推送）"""
+        data = operator.screenshot(settle=capture.settle(last))
+        if not capture.accept(data):
+            return
+        # 文件写入后再推送，前端不会请求到尚未写入的截图
+        run.save(data, f"step{step_num+1}_{substep_idx+1}", lambda path: emit_wrapper('screenshot_update', {
+            'type': 'action',
+            'step': step_num + 1,
+            'substep': substep_idx + 1,
+            'img': path,
+            'msg': msg
+        }))
+
+    def run_batch(step_actions, batch):
+        """执行一组操作（流式输出的单个操作或批量执行的剩余操作），校验效果，按截图策略截图并推送给前端"""
+        control.check()
+        label = step_actions.label(batch)
+        # 坐标按执行前的元素列表吸附，效果校验的本地重试同样使用
+        elements = step_actions.elements
+        if step_actions.record(batch, operator.execute_actions(batch, elements)):
+            verifier.verify(batch, lambda: operator.screenshot(settle=False, overlay=False),
+                            lambda action: operator.execute_action(action, elements),
+                            history, step_actions.step, label)
+        step_actions.advance(batch)
+        if capture.wants(step_actions.last):
+            capture_frame(step_actions.step - 1, step_actions.substep_idx, step_actions.last,
+                          msg='执行操作后截图' if len(batch) == 1 else f'执行 {len(batch)} 个操作后截图')
+
+    capture = CapturePolicy(capture_policy, background=False)
+    # 操作前后逐像素比较，本地判断操作是否生效（见 effect_verifier.py）
+    verifier = EffectVerifier()
+
+    plan_session = None
+    operator = None
+    status = "failed"
+    # 取消标志与预算；cancel_task 事件通过 running_tasks 在其他线程中设置取消标志
+    control = running_tasks.register(sid, TaskControl(**(budget or {})))
+    # 本次执行的截图按内容寻址保存，并在结束时写出清单
+    run = screenshot_store.begin_run(task_desc)
+    # 各阶段耗时记入本次任务的追踪文件（run_id 相同，便于与截图清单对照）
+    trace = start_trace("task", task=task_desc, session=sid, run_id=run.run_id)
     try:
-        ensure_dir()
-        operator = get_operator()
+        operator = get_operator(sid)
         if not operator:
             emit_wrapper('task_error', {'msg': '浏览器未启动'})
             return
             
-        max_steps = 2
-        messages = []
+        # 历史步骤压缩为操作摘要，按 token 预算裁剪
+        history = ConversationHistory()
+        # 相同 (URL, 任务) 录制过成功的操作序列时，画面一致的步骤直接回放
+        plan_session = begin_plan_session(operator.page.url, task_desc)
 
-        for step_num in range(max_steps):
-            emit_wrapper('step_start', {'step': step_num + 1})
-            
-            # 截图当前状态
-            img_path = generate_screenshot_name(task_desc, suffix=f"_step{step_num+1}_input")
-            operator.screenshot(img_path)
+        for step_num in range(control.max_steps):
+            with span("step", step=step_num + 1):
+                control.check()
+                # 本步中截图、导航等浏览器调用的超时不超过剩余时间
+                operator.set_call_timeout(control.timeout_ms())
+                emit_wrapper('step_start', {'step': step_num + 1})
             
-            emit_wrapper('screenshot_update', {
-                'type': 'input',
-                'step': step_num + 1,
-                'img': img_path,
-                'msg': f'步骤 {step_num + 1} 输入截图'
-            })
-
-            # 调用AI分析
-            ai_result = call_ai(img_path, task_desc, messages)
-            messages = [{
-                "role": "assistant",
-                "content": f"[步骤 {step_num + 1}] AI 返回：\n{ai_result}"
-            }]
-
-            if ai_result["status"] == "done":
-                emit_wrapper('task_done', {'msg': '任务完成'})
-                return
+                # 截图当前状态
+                # 截图字节直接交给模型，落盘在后台进行
+                img_bytes = operator.screenshot()
+                # 文件写入后再推送给前端；回调在写盘线程中执行，步骤号按值绑定
+                img_path = run.save(img_bytes, f"step{step_num+1}_input",
+                                    lambda path, step=step_num + 1: emit_wrapper('screenshot_update', {
+                                        'type': 'input',
+                                        'step': step,
+                                        'img': path,
+                                        'msg': f'步骤 {step} 输入截图'
+                                    }))
+                capture.seed(img_bytes)
+                # 效果校验的基准帧不含坐标标记（输入截图中的标记本身会被当成操作点附近的变化）
+                if verifier.enabled:
+                    verifier.seed(operator.screenshot(settle=False, overlay=False))
+                # 与截图同一时刻的可交互元素列表，随截图发送给模型
+                elements = operator.element_map() if DOM_GROUNDING_ENABLED else None
 
-            elif ai_result["status"] == "action":
-                actions = ai_result["data"]
-                if isinstance(actions, list):
-                    for substep_idx, action in enumerate(actions):
-                        operator.execute_action(action)
-                        sub_img_path = generate_screenshot_name(
-                            task_desc, suffix=f"_step{step_num+1}_{substep_idx+1}"
-                        )
-                        operator.screenshot(sub_img_path)
-                        emit_wrapper('screenshot_update', {
-                            'type': 'action',
-                            'step': step_num + 1,
-                            'substep': substep_idx + 1,
-                            'img': sub_img_path,
-                            'msg': f'执行操作后截图'
-                        })
-                elif isinstance(actions, dict):
-                    operator.execute_action(actions)
-                    sub_img_path = generate_screenshot_name(
-                        task_desc, suffix=f"_step{step_num+1}_1"
-                    )
-                    operator.screenshot(sub_img_path)
-                    emit_wrapper('screenshot_update', {
-                        'type': 'action',
-                        'step': step_num + 1,
-                        'substep': 1,
-                        'img': sub_img_path,
-                        'msg': f'执行操作后截图'
-                    })
+                # 调用AI分析（画面与录制一致时直接使用录制的结果）
+                # 本步操作的执行进度（流式阶段边生成边执行的操作不会重复执行）
+                step_actions = StepActions(step_num, history, plan_session, verifier, elements)
+                ai_result = plan_session.next_result(img_bytes) if plan_session else None
+                if ai_result is not None:
+                    print(f"[回放] 步骤 {step_num + 1} 使用录制的操作序列")
+                elif AI_STREAMING:
+                    # 模型每输出一个完整操作就立即执行，最后一项为完整结果；
+                    # 上一步的操作没有产生画面变化时直接询问推理模型（见 ai_handler 的模型级联）
+                    for ai_result in call_ai_stream(img_path, task_desc, history.messages(), img_bytes=img_bytes,
+                                                    tenant=sid, elements=elements, control=control,
+                                                    escalate=history.previous_step_had_no_effect(img_bytes)):
+                        if ai_result["status"] == "partial":
+                            run_batch(step_actions, [ai_result["data"]])
                 else:
-                    emit_wrapper('task_error', {'msg': '无法识别的操作数据格式'})
+                    ai_result = call_ai(img_path, task_desc, history.messages(), img_bytes=img_bytes, tenant=sid,
+                                        elements=elements, control=control,
+                                        escalate=history.previous_step_had_no_effect(img_bytes))
+                # 模型调用期间可能已被取消或用完预算（此时的调用失败是截止时间导致的）
+                control.check()
+                if plan_session:
+                    plan_session.record(ai_result)
+                history.add_step(step_num + 1, ai_result, img_bytes)
+
+                if ai_result["status"] == "done":
+                    status = "done"
+                    # 保存登录状态，同一站点与档案的新会话无需重新登录
+                    save_storage_state(sid)
+                    emit_wrapper('task_done', {'msg': '任务完成'})
                     return
 
-            elif ai_result["status"] == "error":
-                emit_wrapper('task_error', {'msg': ai_result['error']})
-                return
+                elif ai_result["status"] == "action":
+                    # 已按格式校验并编译的 Action 元组（见 actions.py）
+                    actions = ai_result["data"]
+                    # 跳过流式阶段已经执行过的操作；剩余多个操作时按配置批量执行
+                    for batch in step_actions.batches(actions):
+                        run_batch(step_actions, batch)
+                    # 流式执行的最后一个操作当时还不知道是最后一个，按策略补一张最终截图
+                    if capture.finish():
+                        capture_frame(step_num, len(actions) - 1, last=True)
+
+                elif ai_result["status"] == "error":
+                    emit_wrapper('task_error', {'msg': ai_result['error']})
+                    return
 
         else:
             emit_wrapper('task_warning', {'msg': '达到最大步骤数，任务可能未完成。'})
 
     except Exception as e:
-        error_msg = f'执行出错: {str(e)}'
-        print(f"Task error: {error_msg}\n{traceback.format_exc()}")
-        emit_wrapper('task_error', {'msg': error_msg})
+        # 时间预算用完时浏览器调用的超时由截止时间导致，按超出预算处理
+        if isinstance(e, PlaywrightTimeoutError) and control.timed_out():
+            e = control.error()
+        if isinstance(e, TaskCancelled):
+            status = e.status
+            emit_wrapper('task_cancelled', {'msg': str(e), 'reason': e.status, **control.stats()})
+        else:
+            error_msg = f'执行出错: {str(e)}'
+            print(f"Task error: {error_msg}\n{traceback.format_exc()}")
+            emit_wrapper('task_error', {'msg': error_msg})
+    finally:
+        running_tasks.unregister(sid, control)
+        if operator is not None:
+            operator.set_call_timeout()
+        if plan_session:
+            plan_session.finish(status == "done")
+        run.close(status)
+        trace.finish(status)
 
 @socketio.on('run_task')
+@routed()
 def handle_run_task(data):
     """执行AI任务"""
     # 保存客户端SID
@@ -168,14 +404,45 @@ def handle_run_task(data):
     if not task_desc:
         emit('task_error', {'msg': '任务描述不能为空'})
         return
+    # 操作后截图策略可按次指定，未指定时使用配置中的默认值
+    capture_policy = data.get('capture') or CAPTURE_POLICY
+    # 浏览器线程中的截图无法放到后台，async 策略只在异步引擎中可用
+    error = policy_error(capture_policy, background=async_engine is not None)
+    if error:
+        emit('task_error', {'msg': error})
+        return
+    # 时间、步数与 token 预算可按次调低（max_seconds / max_steps / max_tokens）
+    budget = budget_from_request(data)
 
     # 检查浏览器是否运行
-    if not is_browser_running():
+    if not browser_running(request.sid):
         emit('task_error', {'msg': '请先启动浏览器'})
         return
 
+    if async_engine is not None:
+        async_engine.submit(async_engine.run_task(task_desc, request.sid, make_emitter(request.sid),
+                                                  capture_policy=capture_policy, budget=budget))
+        return
+
     # 在浏览器线程中执行任务
-    execute_in_browser_thread(run_task_logic, task_desc, request.sid)
+    schedule(run_task_logic, task_desc, request.sid, capture_policy, budget)
+
+def cancel_tasks(sid, reason):
+    """取消会话正在执行的任务并丢弃排队中的任务，返回 (是否有运行中的任务, 丢弃的排队任务数)"""
+    if async_engine is not None:
+        return async_engine.cancel_task(sid, reason), 0
+    dropped = scheduler.discard(sid, lambda task: task.func is run_task_logic)
+    return running_tasks.cancel(sid, reason), dropped
+
+@socketio.on('cancel_task')
+@routed()
+def handle_cancel_task():
+    """取消任务：运行中的任务在下一个检查点停止并发送 task_cancelled，排队中的任务直接丢弃"""
+    running, dropped = cancel_tasks(request.sid, '任务已被用户取消')
+    if dropped and not running:
+        emit('task_cancelled', {'msg': f'已取消 {dropped} 个排队中的任务', 'reason': 'cancelled'})
+    elif not running:
+        emit('task_warning', {'msg': '没有正在执行的任务'})
 
 # --- 在文件顶部，import 部分之后，添加一个用于关闭浏览器任务的辅助函数 ---
 
@@ -191,8 +458,8 @@ def close_browser_task(sid):
 
     try:
         # 调用全局的 close_operator 函数，它会在线程安全的环境中操作 BrowserManager
-        # 这会调用 browser_manager.close_operator()，从而安全地关闭 Playwright 资源
-        close_operator()
+        # 这只会关闭该客户端自己的 context，共享的 Chromium 进程及其他会话不受影响
+        close_operator(sid)
         emit_wrapper('browser_closed', {'msg': '浏览器已关闭'})
         # 注意：在工作线程中无法直接修改主线程的 client_sids 字典
         # 我们将在主线程的 handle_close_browser 中处理这个清理
@@ -205,9 +472,14 @@ def close_browser_task(sid):
 # --- 修改 handle_close_browser 函数 ---
 
 @socketio.on('close_browser')
+@routed()
 def handle_close_browser():
     """关闭浏览器 - 通过工作线程执行"""
     sid = request.sid
+    # context 关闭时 screencast 随之结束，这里只需停止发送通道
+    live_view.close(sid)
+    # 正在执行的任务会占住该会话的工作线程，先让它停下，关闭任务才能尽快执行
+    cancel_tasks(sid, '浏览器已关闭，任务取消')
     try:
         # 1. 在主线程中，先清理客户端SID
         # 这样可以立即反映在UI状态上，即使关闭过程需要时间
@@ -217,7 +489,10 @@ def handle_close_browser():
 
         # 2. 调度实际的关闭任务到浏览器线程
         # 将 sid 传递给任务函数，以便它可以在完成后 emit 消息
-        execute_in_browser_thread(close_browser_task, sid)
+        if async_engine is not None:
+            async_engine.submit(close_browser_task_async(sid))
+        else:
+            schedule(close_browser_task, sid, bounded=False)
         
         # 注意：主线程在此处立即返回，不会等待工作线程完成
         # 关闭成功的确认将由 close_browser_task 通过 emit 发送
@@ -229,11 +504,41 @@ def handle_close_browser():
         emit('browser_error', {'msg': error_msg}) # 通知发起关闭请求的客户端
 
 
+@socketio.on('live_view_start')
+@routed()
+def handle_live_view_start():
+    """开始实时画面：JPEG 帧以二进制消息推送（live_frame 事件），客户端渲染完一帧后确认"""
+    sid = request.sid
+    if not browser_running(sid):
+        emit('live_view_error', {'msg': '请先启动浏览器'})
+        return
+    on_frame = live_view.open(socketio, sid)
+    if async_engine is not None:
+        async_engine.submit(start_screencast_task_async(sid, on_frame))
+    else:
+        if not schedule(start_screencast_task, sid, on_frame):
+            live_view.close(sid)
+
+
+@socketio.on('live_view_stop')
+@routed()
+def handle_live_view_stop():
+    """停止实时画面"""
+    sid = request.sid
+    if not live_view.close(sid):
+        return
+    if async_engine is not None:
+        async_engine.submit(stop_screencast_task_async(sid))
+    else:
+        schedule(stop_screencast_task, sid, bounded=False)
+
+
 @socketio.on('get_browser_status')
+@routed()
 def handle_get_browser_status():
     """获取浏览器状态"""
     try:
-        if is_browser_running():
+        if browser_running(request.sid):
             emit('browser_status', {'status': '浏览器运行中', 'type': 'success'})
         else:
             emit('browser_status', {'status': '浏览器未启动', 'type': 'secondary'})
@@ -248,16 +553,36 @@ def handle_connect():
     handle_get_browser_status()
 
 @socketio.on('disconnect')
+@routed(release=True)
 def handle_disconnect():
     print(f'客户端 {request.sid} 已断开连接')
     if request.sid in client_sids:
         del client_sids[request.sid]
+    live_view.close(request.sid)
+    cancel_tasks(request.sid, '客户端已断开，任务取消')
+    # 客户端断开后释放它占用的 context，避免等待空闲回收
+    if async_engine is not None:
+        async_engine.submit(async_engine.close_session(request.sid))
+    else:
+        execute_in_browser_thread(close_operator, request.sid, session_id=request.sid, bounded=False)
 
 if __name__ == '__main__':
+    # 服务启动时就启动浏览器（POOL_PREWARM），第一个客户端不必等待 Chromium 启动
+    if async_engine is not None:
+        async_engine.start()
+    else:
+        from global_operator import start_browser_thread
+        start_browser_thread()
+    if cluster is not None:
+        cluster.start(session_count, run_forwarded_event)
     try:
-        socketio.run(app, debug=False, port=5088, host='0.0.0.0')
+        socketio.run(app, debug=False, port=int(os.environ.get(PORT_ENV, 5088)), host='0.0.0.0',
+                     # 启动器拉起的服务进程没有终端，Flask-SocketIO 默认会拒绝以 Werkzeug 运行
+                     allow_unsafe_werkzeug=cluster is not None)
     except KeyboardInterrupt:
         print("正在关闭应用...")
-        close_operator()
+        if async_engine is not None:
+            async_engine.stop()
+        # 各浏览器工作线程执行完已提交的任务后关闭自己的浏览器
         from global_operator import stop_browser_thread
         stop_browser_thread()
\ No newline at end of file
@@ -0,0 +1,531 @@
+# async_engine.py
+# 基于 asyncio 的执行引擎：一个事件循环（运行在独立线程中）+ 一个共享 Chromium，
+# 每个会话一个 AsyncUIOperator。模型调用放到线程池中等待，因此某个任务在等待 LLM 时，
+# 其他会话的截图和操作可以继续执行，吞吐量随并发任务数增长。
+# 流式输出（AI_STREAMING）时模型的流在线程池中读取，每个完整的操作经队列交回事件循环立即执行。
+import asyncio
+import contextvars
+import functools
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+
+from ai_handler import call_ai, call_ai_stream
+from async_operator import AsyncUIOperator
+from settle import SettleDetector
+from replay_cache import begin_plan_session
+from config import (
+    HEADLESS,
+    TARGET_URL,
+    POOL_MAX_SIZE,
+    POOL_IDLE_TIMEOUT,
+    POOL_PREWARM,
+    ASYNC_MAX_CONCURRENT_TASKS,
+    ASYNC_LLM_THREADS,
+    DOM_GROUNDING_ENABLED,
+    AI_STREAMING,
+    CAPTURE_POLICY,
+)
+from conversation import ConversationHistory
+from tracing import span, start_trace
+from screenshot_store import screenshot_store
+from capture import CapturePolicy
+from effect_verifier import EffectVerifier
+from task_control import TaskControl, TaskCancelled, running_tasks
+from storage_state import get_state_store
+from step_actions import StepActions
+
+logger = logging.getLogger(__name__)
+
+
+async def run_task_logic_async(operator, task_desc, emit, call_ai_async, control=None, capture_policy=CAPTURE_POLICY,
+                               call_ai_stream_async=None):
+    """run_task_logic 的异步版本，事件与同步版本保持一致；control 为本次任务的 TaskControl。
+
+    call_ai_stream_async 为 call_ai_stream 的异步生成器版本（见 AsyncEngine.call_ai_stream），
+    开启 AI_STREAMING 且提供时边生成边执行操作，否则等完整结果返回后执行。
+
+    返回运行结果状态（"done"、"failed"、"cancelled" 等）。
+    """
+    control = control or TaskControl()
+    if not task_desc:
+        emit('task_error', {'msg': '任务描述不能为空'})
+        return "failed"
+
+    emit('task_start', {'msg': '开始执行任务...'})
+    plan_session = begin_plan_session(operator.page.url, task_desc)
+    run = screenshot_store.begin_run(task_desc)
+    trace = start_trace("task", task=task_desc, run_id=run.run_id)
+    status = "failed"
+    try:
+        success = await _run_steps(operator, task_desc, emit, call_ai_async, call_ai_stream_async, control,
+                                   plan_session, run, CapturePolicy(capture_policy), EffectVerifier())
+        status = "done" if success else "failed"
+    except (TaskCancelled, asyncio.CancelledError, PlaywrightTimeoutError) as e:
+        # AsyncEngine.cancel_task 会同时中断当前的 await；未设置取消标志的 CancelledError 来自引擎停止；
+        # 时间预算用完时浏览器调用的超时由截止时间导致，按超出预算处理
+        if isinstance(e, PlaywrightTimeoutError):
+            if not control.timed_out():
+                raise
+        elif not control.cancelled:
+            raise
+        error = e if isinstance(e, TaskCancelled) else control.error()
+        status = error.status
+        emit('task_cancelled', {'msg': str(error), 'reason': error.status, **control.stats()})
+    finally:
+        operator.set_call_timeout()
+        if plan_session:
+            plan_session.finish(status == "done")
+        run.close(status)
+        trace.finish(status)
+    return status
+
+
+async def _capture_frame(operator, capture, run, emit, step_num, substep_idx, last=False):
+    """按截图策略截取操作后的画面，保存并推送（画面未变化时不推送）"""
+    data = await operator.screenshot(settle=capture.settle(last))
+    if not capture.accept(data):
+        return
+    # 文件写入后（在写盘线程中）再推送，前端不会请求到尚未写入的截图
+    run.save(data, f"step{step_num+1}_{substep_idx+1}", lambda path: emit('screenshot_update', {
+        'type': 'action',
+        'step': step_num + 1,
+        'substep': substep_idx + 1,
+        'img': path,
+        'msg': '执行操作后截图'
+    }))
+
+
+async def _run_batch(operator, step_actions, run, emit, capture, verifier, batch, background):
+    """执行一组操作（流式输出的单个操作或批量执行的剩余操作），校验效果并按截图策略截图；
+    async 策略下截图放到后台任务（加入 background），与后续操作并行"""
+    label = step_actions.label(batch)
+    # 坐标按执行前的元素列表吸附，效果校验的本地重试同样使用
+    elements = step_actions.elements
+    if step_actions.record(batch, await operator.execute_actions(batch, elements)):
+        # 比较的是操作前后的画面，需在下一组操作之前完成
+        await verifier.verify_async(
+            batch, functools.partial(operator.screenshot, settle=False, overlay=False),
+            functools.partial(operator.execute_action, elements=elements),
+            step_actions.history, step_actions.step, label)
+    step_actions.advance(batch)
+    if capture.wants(step_actions.last):
+        frame = _capture_frame(operator, capture, run, emit, step_actions.step - 1, step_actions.substep_idx,
+                               step_actions.last)
+        if capture.background:
+            background.append(asyncio.ensure_future(frame))
+        else:
+            await frame
+
+
+async def _run_steps(operator, task_desc, emit, call_ai_async, call_ai_stream_async, control, plan_session, run,
+                     capture, verifier):
+    """执行步骤循环，任务完成时返回 True；取消或超出预算时抛出 TaskCancelled"""
+    history = ConversationHistory()
+    background = []  # async 策略下的后台截图任务，一步结束前统一等待
+    try:
+        for step_num in range(control.max_steps):
+            with span("step", step=step_num + 1):
+                control.check()
+                operator.set_call_timeout(control.timeout_ms())
+                emit('step_start', {'step': step_num + 1})
+
+                img_bytes = await operator.screenshot()
+                # 文件写入后（在写盘线程中）再推送，步骤号按值绑定
+                img_path = run.save(img_bytes, f"step{step_num+1}_input",
+                                    lambda path, step=step_num + 1: emit('screenshot_update', {
+                                        'type': 'input',
+                                        'step': step,
+                                        'img': path,
+                                        'msg': f'步骤 {step} 输入截图'
+                                    }))
+                capture.seed(img_bytes)
+                # 效果校验的基准帧不含坐标标记（输入截图中的标记本身会被当成操作点附近的变化）
+                if verifier.enabled:
+                    verifier.seed(await operator.screenshot(settle=False, overlay=False))
+                elements = await operator.element_map() if DOM_GROUNDING_ENABLED else None
+
+                # 本步操作的执行进度（流式阶段边生成边执行的操作不会重复执行）
+                step_actions = StepActions(step_num, history, plan_session, verifier, elements)
+                # 等待模型期间让出事件循环，其他会话继续执行；画面与录制一致时直接回放
+                ai_result = plan_session.next_result(img_bytes) if plan_session else None
+                if ai_result is None and AI_STREAMING and call_ai_stream_async is not None:
+                    # 模型每输出一个完整操作就立即执行，最后一项为完整结果；
+                    # 中途取消或出错时立即关闭流（而不是等垃圾回收），读取线程随之停止
+                    stream = call_ai_stream_async(img_path, task_desc, history.messages(), img_bytes=img_bytes,
+                                                  elements=elements, control=control,
+                                                  escalate=history.previous_step_had_no_effect(img_bytes))
+                    try:
+                        async for ai_result in stream:
+                            if ai_result["status"] == "partial":
+                                control.check()
+                                await _run_batch(operator, step_actions, run, emit, capture, verifier,
+                                                 [ai_result["data"]], background)
+                    finally:
+                        await stream.aclose()
+                elif ai_result is None:
+                    ai_result = await call_ai_async(img_path, task_desc, history.messages(), img_bytes=img_bytes,
+                                                    elements=elements, control=control,
+                                                    escalate=history.previous_step_had_no_effect(img_bytes))
+                control.check()
+                if plan_session:
+                    plan_session.record(ai_result)
+                history.add_step(step_num + 1, ai_result, img_bytes)
+
+                if ai_result["status"] == "done":
+                    emit('task_done', {'msg': '任务完成'})
+                    return True
+
+                elif ai_result["status"] == "action":
+                    actions = ai_result["data"]
+                    # 跳过流式阶段已经执行过的操作；批量执行时整组操作连续派发、只截图一次
+                    for batch in step_actions.batches(actions):
+                        control.check()
+                        await _run_batch(operator, step_actions, run, emit, capture, verifier, batch, background)
+                    await asyncio.gather(*background)
+                    background.clear()
+                    # 流式执行的最后一个操作当时还不知道是最后一个，按策略补一张最终截图（后台截图完成后才能判断）
+                    if capture.finish():
+                        await _capture_frame(operator, capture, run, emit, step_num, len(actions) - 1, last=True)
+
+                elif ai_result["status"] == "error":
+                    emit('task_error', {'msg': ai_result['error']})
+                    return False
+
+        emit('task_warning', {'msg': '达到最大步骤数，任务可能未完成。'})
+        return False
+    finally:
+        # 取消、超出预算或出错时不再等待后台截图：取消尚未完成的并等待其结束，避免任务泄漏与未取回的异常
+        for frame in background:
+            frame.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+
+
+class AsyncEngine:
+    def __init__(self, max_sessions=POOL_MAX_SIZE, max_concurrent_tasks=ASYNC_MAX_CONCURRENT_TASKS,
+                 llm_threads=ASYNC_LLM_THREADS, idle_timeout=POOL_IDLE_TIMEOUT, headless=HEADLESS):
+        self.max_sessions = max_sessions
+        self.max_concurrent_tasks = max_concurrent_tasks
+        self.idle_timeout = idle_timeout
+        self.headless = headless
+        self.llm_executor = ThreadPoolExecutor(max_workers=llm_threads, thread_name_prefix="llm")
+
+        self.loop = None
+        self.thread = None
+        self._started = threading.Event()
+        self._start_lock = threading.Lock()
+
+        # 以下状态只在事件循环线程中访问
+        self.playwright = None
+        self.browser = None
+        self.browser_lock = None  # asyncio.Lock：预热与并发的 start_session 只启动一个 Chromium
+        self.sessions = {}       # session_id -> AsyncUIOperator
+        self.starting = 0        # 正在启动中的会话数：第一个 await 之前占住名额，避免并发启动超过上限
+        self.urls = {}           # session_id -> 启动时打开的 URL
+        self.profiles = {}       # session_id -> 凭据档案（登录状态按 站点 + 档案 保存；没有档案的会话不保存）
+        self.last_used = {}      # session_id -> 时间戳
+        self.session_locks = {}  # session_id -> asyncio.Lock，同一会话的任务串行执行
+        self.running = {}        # session_id -> 正在执行任务的 asyncio.Task
+        self.task_semaphore = None
+        self.settle = SettleDetector()  # 所有会话共用，汇总等待耗时
+
+    # --- 事件循环线程 ---
+
+    def start(self):
+        """启动事件循环线程（幂等）"""
+        with self._start_lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self._started.clear()
+            self.thread = threading.Thread(target=self._run_loop, name="async-engine", daemon=True)
+            self.thread.start()
+        self._started.wait()
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.task_semaphore = asyncio.Semaphore(self.max_concurrent_tasks)
+        self.browser_lock = asyncio.Lock()
+        self.loop.create_task(self._evict_idle_loop())
+        if POOL_PREWARM:
+            # 服务启动时即启动 Chromium，第一个会话只需新建 context
+            self.loop.create_task(self._prewarm())
+        self._started.set()
+        logger.info("Async engine event loop started.")
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """从任意线程提交协程，返回 concurrent.futures.Future"""
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    @staticmethod
+    def _log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Async engine task failed", exc_info=future.exception())
+
+    def stop(self, timeout=10):
+        """关闭所有会话和浏览器，然后停止事件循环"""
+        if self.loop is None or not self.loop.is_running():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result(timeout)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout)
+            self.llm_executor.shutdown(wait=False)
+
+    # --- 会话管理（协程，在事件循环中执行） ---
+
+    async def _ensure_browser(self):
+        if self.browser is not None and self.browser.is_connected():
+            return self.browser
+        async with self.browser_lock:
+            # 等待锁期间可能已由其他协程（预热或另一个 start_session）启动
+            if self.browser is not None and self.browser.is_connected():
+                return self.browser
+            if self.browser is not None:
+                # 浏览器已断开：其上的 context 全部失效，逐个关闭会话并清理 URL、档案等状态
+                logger.warning("Shared Chromium disconnected, closing its sessions and relaunching.")
+                for session_id in list(self.sessions):
+                    await self.close_session(session_id)
+                self.browser = None
+            if self.playwright is None:
+                self.playwright = await async_playwright().start()
+            self.browser = await self.playwright.chromium.launch(headless=self.headless)
+            logger.info("Shared Chromium launched for async engine.")
+            return self.browser
+
+    async def _prewarm(self):
+        try:
+            await self._ensure_browser()
+        except Exception as e:
+            logger.warning(f"Async engine prewarm failed: {e}", exc_info=True)
+
+    def has_session(self, session_id):
+        return session_id in self.sessions
+
+    def get_operator(self, session_id):
+        operator = self.sessions.get(session_id)
+        if operator is not None:
+            self.last_used[session_id] = time.time()
+        return operator
+
+    async def start_session(self, session_id, url, profile=None):
+        """为会话新建 context 并打开 URL，返回 (success, message)；该站点与档案有保存的登录状态时一并恢复"""
+        await self.close_session(session_id)
+        if len(self.sessions) + self.starting >= self.max_sessions:
+            return False, f"启动浏览器失败: 会话数已达上限 {self.max_sessions}"
+        # 检查与占位之间没有 await，并发的 start_session 不会同时通过上限检查
+        self.starting += 1
+        try:
+            store = get_state_store()
+            state = store.load(url, profile) if store else None
+            with span("session.start", restored=state is not None):
+                browser = await self._ensure_browser()
+                operator = await AsyncUIOperator.create(browser=browser, settle=self.settle, storage_state=state)
+                self.sessions[session_id] = operator
+                self.urls[session_id] = url
+                self.profiles[session_id] = profile
+                self.last_used[session_id] = time.time()
+                await operator.navigate_to(url)
+            return True, "浏览器启动成功（已恢复登录状态）" if state else "浏览器启动成功"
+        except Exception as e:
+            logger.error(f"Failed to start async session {session_id}: {e}", exc_info=True)
+            await self.close_session(session_id)
+            return False, f"启动浏览器失败: {str(e)}"
+        finally:
+            self.starting -= 1
+
+    async def close_session(self, session_id):
+        operator = self.sessions.pop(session_id, None)
+        self.urls.pop(session_id, None)
+        self.profiles.pop(session_id, None)
+        self.last_used.pop(session_id, None)
+        self.session_locks.pop(session_id, None)
+        if operator is None:
+            return False
+        try:
+            await operator.close()
+        except Exception as e:
+            logger.warning(f"Exception while closing async session {session_id}: {e}", exc_info=True)
+        return True
+
+    async def save_storage_state(self, session_id):
+        """保存会话当前的登录状态（cookie 与 localStorage），返回是否已保存"""
+        store = get_state_store()
+        operator = self.sessions.get(session_id)
+        url = self.urls.get(session_id)
+        profile = self.profiles.get(session_id)
+        if store is None or operator is None or url is None or not profile:
+            return False
+        try:
+            state = await operator.context.storage_state()
+        except Exception as e:
+            logger.warning(f"Failed to read storage state for async session {session_id}: {e}")
+            return False
+        store.save(url, profile, state)
+        return True
+
+    async def _evict_idle_loop(self):
+        while True:
+            await asyncio.sleep(30)
+            if not self.idle_timeout:
+                continue
+            now = time.time()
+            for session_id, last in list(self.last_used.items()):
+                lock = self.session_locks.get(session_id)
+                if now - last > self.idle_timeout and not (lock and lock.locked()):
+                    logger.info(f"Evicting idle async session {session_id}.")
+                    await self.close_session(session_id)
+
+    async def shutdown(self):
+        for session_id in list(self.sessions):
+            await self.close_session(session_id)
+        if self.browser is not None:
+            await self.browser.close()
+            self.browser = None
+        if self.playwright is not None:
+            await self.playwright.stop()
+            self.playwright = None
+
+    # --- 任务执行 ---
+
+    async def call_ai(self, img_path, task_desc, history_messages=None, img_bytes=None, tenant=None, elements=None,
+                      control=None, escalate=False):
+        """在线程池中等待模型响应，不阻塞事件循环；任务被取消时 await 立即返回，请求本身受截止时间约束"""
+        # 复制当前上下文，模型调用中的 span 仍归入当前任务的追踪
+        context = contextvars.copy_context()
+        return await self.loop.run_in_executor(
+            self.llm_executor,
+            functools.partial(context.run, call_ai, img_path, task_desc, history_messages, img_bytes=img_bytes,
+                              tenant=tenant, elements=elements, control=control, escalate=escalate)
+        )
+
+    async def call_ai_stream(self, img_path, task_desc, history_messages=None, img_bytes=None, tenant=None,
+                             elements=None, control=None, escalate=False):
+        """call_ai_stream 的异步生成器版本：流在线程池中读取，每一项经队列交回事件循环。
+
+        调用方提前停止迭代（任务取消等）后，读取线程在下一项处关闭流；请求本身受截止时间约束。
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stopped = threading.Event()
+
+        def produce():
+            stream = call_ai_stream(img_path, task_desc, history_messages, img_bytes=img_bytes, tenant=tenant,
+                                    elements=elements, control=control, escalate=escalate)
+            try:
+                for item in stream:
+                    if stopped.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, ("item", item))
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, ("error", e))
+            finally:
+                stream.close()
+                loop.call_soon_threadsafe(queue.put_nowait, ("end", None))
+
+        context = contextvars.copy_context()
+        loop.run_in_executor(self.llm_executor, functools.partial(context.run, produce))
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind == "error":
+                    raise value
+                if kind == "end":
+                    return
+                yield value
+        finally:
+            stopped.set()
+
+    def cancel_task(self, session_id, reason="任务已取消"):
+        """取消会话正在执行的任务（可在任意线程调用）：设置取消标志并中断其当前的 await"""
+        if not running_tasks.cancel(session_id, reason):
+            return False
+        task = self.running.get(session_id)
+        if task is not None:
+            self.loop.call_soon_threadsafe(task.cancel)
+        return True
+
+    def _expire(self, session_id, control):
+        """时间预算用完：与取消相同，中断任务当前的 await"""
+        control.cancel(f"超出时间预算（{control.max_seconds} 秒）", budget=True)
+        task = self.running.get(session_id)
+        if task is not None:
+            task.cancel()
+
+    async def run_task(self, task_desc, session_id, emit, capture_policy=CAPTURE_POLICY, budget=None):
+        """在会话上执行任务；同一会话串行，不同会话并发（受 max_concurrent_tasks 限制）。
+
+        budget 为 TaskControl 的参数；时间预算从开始执行（而不是排队）时计算。
+        """
+        lock = self.session_locks.setdefault(session_id, asyncio.Lock())
+        async with lock, self.task_semaphore:
+            operator = self.get_operator(session_id)
+            if operator is None:
+                emit('task_error', {'msg': '浏览器未启动'})
+                return
+            control = running_tasks.register(session_id, TaskControl(**(budget or {})))
+            self.running[session_id] = asyncio.current_task()
+            timer = None
+            if control.deadline is not None:
+                timer = self.loop.call_later(control.remaining(), self._expire, session_id, control)
+            try:
+                status = await run_task_logic_async(operator, task_desc, emit,
+                                                    functools.partial(self.call_ai, tenant=session_id),
+                                                    control, capture_policy,
+                                                    functools.partial(self.call_ai_stream, tenant=session_id))
+                if status == "done":
+                    # 保存登录状态，同一站点与档案的新会话无需重新登录
+                    await self.save_storage_state(session_id)
+            except Exception as e:
+                logger.error(f"Async task error: {e}", exc_info=True)
+                emit('task_error', {'msg': f'执行出错: {str(e)}'})
+            finally:
+                if timer is not None:
+                    timer.cancel()
+                self.running.pop(session_id, None)
+                running_tasks.unregister(session_id, control)
+                self.last_used[session_id] = time.time()
+
+
+# 全局异步引擎（仅在 EXECUTION_ENGINE = "async" 时被使用）
+async_engine = AsyncEngine()
+
+
+async def _run_concurrently(task_descs, url, max_steps):
+    """命令行入口：每个任务一个会话，在同一个事件循环中并发执行"""
+    engine = async_engine
+
+    async def run_one(index, task_desc):
+        session_id = f"cli-{index}"
+        success, message = await engine.start_session(session_id, url)
+        if not success:
+            print(f"[{session_id}] {message}")
+            return
+        started = time.perf_counter()
+        await engine.run_task(task_desc, session_id,
+                              lambda event, data: print(f"[{session_id}] {event}: {data}"),
+                              budget={"max_steps": max_steps})
+        print(f"[{session_id}] 耗时 {time.perf_counter() - started:.1f}s")
+        await engine.close_session(session_id)
+
+    engine.loop = asyncio.get_running_loop()
+    engine.task_semaphore = asyncio.Semaphore(engine.max_concurrent_tasks)
+    engine.browser_lock = asyncio.Lock()
+    try:
+        await asyncio.gather(*(run_one(i, t) for i, t in enumerate(task_descs)))
+    finally:
+        await engine.shutdown()
+
+
+if __name__ == "__main__":
+    tasks = sys.argv[1:] or ["使用 Lewis1:Lewis123! 登录"]
+    asyncio.run(_run_concurrently(tasks, TARGET_URL, max_steps=6))
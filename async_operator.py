@@ -0,0 +1,215 @@
+# async_operator.py
+# 基于 Playwright 异步 API 的 UIOperator，供 async_engine 在单个事件循环中并发驱动多个会话。
+# 操作解析与高亮脚本与同步版 UIOperator 共用（见 ui_operator.resolve_action）。
+import asyncio
+import base64
+
+from playwright.async_api import async_playwright
+
+from ui_operator import (
+    VIEWPORT,
+    HIGHLIGHT_CALL_JS,
+    HIDE_OVERLAY_CSS,
+    SCROLL_JS,
+    init_scripts,
+    norm_to_pixel,
+    resolve_action,
+    to_action,
+    snap_to_elements,
+    settles_after,
+    elements_after,
+)
+from settle import SettleDetector
+from tracing import span
+from dom_grounding import ELEMENT_MAP_JS, parse_elements
+from config import (DOM_GROUNDING_MAX_ELEMENTS, HIGHLIGHT_ENABLED, HIGHLIGHT_DURATION_MS, TYPE_FAST_FILL,
+                    BROWSER_CALL_TIMEOUT_MS)
+
+
+class AsyncUIOperator:
+    def __init__(self, browser, context, page, playwright=None, settle=None):
+        # 请通过 AsyncUIOperator.create() 创建实例
+        self.browser = browser
+        self.context = context
+        self.page = page
+        self.playwright = playwright
+        self._owns_browser = playwright is not None
+        self.settle = settle or SettleDetector()
+        self._screencast = None
+        self.set_call_timeout()
+
+    @classmethod
+    async def create(cls, browser=None, target_url=None, headless=True, settle=None, storage_state=None):
+        """创建 operator；传入 browser 时只在其上新建一个隔离的 context，storage_state 为保存的登录状态"""
+        playwright = None
+        if browser is None:
+            playwright = await async_playwright().start()
+            browser = await playwright.chromium.launch(headless=headless)
+        context = await browser.new_context(viewport=VIEWPORT, device_scale_factor=1, storage_state=storage_state)
+        for script in init_scripts():
+            await context.add_init_script(script)
+        page = await context.new_page()
+        operator = cls(browser, context, page, playwright, settle)
+        if target_url:
+            await operator.navigate_to(target_url)
+        return operator
+
+    def set_call_timeout(self, timeout_ms=BROWSER_CALL_TIMEOUT_MS):
+        """设置截图、导航与等待类调用的默认超时（Playwright 中为同步方法）"""
+        self.page.set_default_timeout(timeout_ms)
+        self.page.set_default_navigation_timeout(timeout_ms)
+
+    async def navigate_to(self, url):
+        """导航到指定URL"""
+        if not url:
+            raise ValueError("URL不能为空")
+        with span("page.goto"):
+            await self.page.goto(url)
+        await self.settle.wait_async(self.page, "navigate")
+
+    async def screenshot(self, settle=True, overlay=True):
+        """截图并返回 PNG 字节；settle、overlay 见 UIOperator.screenshot"""
+        if settle:
+            await self.settle.wait_async(self.page, "screenshot")  # 等待 DOM、网络与动画稳定
+        with span("screenshot.capture"):
+            data = await self.page.screenshot(full_page=False, style=None if overlay else HIDE_OVERLAY_CSS)
+        return data
+
+    async def highlight_point(self, x, y, duration=HIGHLIGHT_DURATION_MS):
+        if HIGHLIGHT_ENABLED:
+            await self.page.evaluate(HIGHLIGHT_CALL_JS, [x, y, duration])
+
+    def norm_to_pixel(self, x_norm, y_norm):
+        return norm_to_pixel(x_norm, y_norm)
+
+    async def element_map(self):
+        """收集视口内可见的可交互元素，返回 dom_grounding.Element 列表"""
+        with span("dom.element_map") as map_span:
+            try:
+                elements = parse_elements(await self.page.evaluate(ELEMENT_MAP_JS, DOM_GROUNDING_MAX_ELEMENTS))
+            except Exception as e:
+                print("[定位] 收集页面元素失败:", e)
+                elements = []
+            map_span.set(elements=len(elements))
+        return elements
+
+    async def execute_action(self, action, elements=None, settle=True):
+        """执行一个操作，成功返回 True，参数无效或执行出错返回 False；参数见 UIOperator.execute_action"""
+        action = to_action(action)
+        if action is None:
+            return False
+        if elements:
+            action = snap_to_elements(action, elements)
+        with span("action.execute", action=action.kind) as action_span:
+            ok = await self._execute_action(action, settle)
+            action_span.set(ok=ok)
+        return ok
+
+    async def execute_actions(self, actions, elements=None):
+        """连续执行一组操作，返回每个操作是否成功（见 UIOperator.execute_actions）"""
+        results = []
+        with span("action.batch", count=len(actions)):
+            for index, action in enumerate(actions):
+                action = to_action(action)
+                settle = settles_after(action, last=index == len(actions) - 1)
+                results.append(await self.execute_action(action, elements, settle))
+                elements = elements_after(action, elements)
+        return results
+
+    async def _execute_action(self, action, settle=True):
+        resolved = resolve_action(action, self.norm_to_pixel)
+        if resolved is None:
+            return False
+
+        action, points = resolved.action, resolved.points
+        page = self.page
+        try:
+            if action in ("click", "type", "hover", "double_click", "right_click"):
+                x, y = points[0]
+                print(f"[操作] {action} 坐标: ({x}, {y})")
+                if action == "click":
+                    await page.mouse.click(x, y)
+                elif action == "type":
+                    await page.mouse.click(x, y)
+                    if TYPE_FAST_FILL and "\n" not in resolved.text and "\t" not in resolved.text:
+                        await page.keyboard.insert_text(resolved.text)
+                    else:
+                        await page.keyboard.type(resolved.text)
+                elif action == "hover":
+                    await page.mouse.move(x, y)
+                elif action == "double_click":
+                    await page.mouse.dblclick(x, y)
+                else:
+                    await page.mouse.click(x, y, button="right")
+
+            elif action == "swipe":
+                (x1, y1), (x2, y2) = points
+                print(f"[操作] 滑动坐标: ({x1}, {y1}) -> ({x2}, {y2})")
+                await page.mouse.move(x1, y1)
+                await page.mouse.down()
+                await page.wait_for_timeout(100)
+                await page.mouse.move(x2, y2, steps=25)
+                await page.wait_for_timeout(100)
+                await page.mouse.up()
+
+            elif action == "press_key":
+                print(f"[操作] 按键: {resolved.key}")
+                await page.keyboard.press(resolved.key)
+
+            elif action == "wait":
+                print(f"[操作] 等待 {resolved.duration} 毫秒")
+                await page.wait_for_timeout(resolved.duration)
+
+            elif action == "scroll_to":
+                x, y = points[0]
+                print(f"[操作] 页面滚动到: ({x}, {y})")
+                await page.evaluate(SCROLL_JS, [x, y])
+
+            if settle:
+                await self.settle.wait_async(page, action)
+            return True
+
+        except Exception as e:
+            print("[异常] 执行操作时出错:", e)
+            return False
+
+    async def start_screencast(self, on_frame, params):
+        """通过 CDP 开始推送画面帧，on_frame(jpeg_bytes, metadata) 在事件循环中被调用"""
+        await self.stop_screencast()
+        cdp = await self.context.new_cdp_session(self.page)
+
+        def handle_frame(event):
+            ack = asyncio.ensure_future(cdp.send("Page.screencastFrameAck", {"sessionId": event["sessionId"]}))
+            ack.add_done_callback(lambda f: f.cancelled() or f.exception())  # 页面关闭时确认失败，忽略
+            on_frame(base64.b64decode(event["data"]), event.get("metadata"))
+
+        cdp.on("Page.screencastFrame", handle_frame)
+        await cdp.send("Page.startScreencast", params)
+        self._screencast = cdp
+
+    async def stop_screencast(self):
+        cdp, self._screencast = self._screencast, None
+        if cdp is None:
+            return
+        try:
+            await cdp.send("Page.stopScreencast")
+            await cdp.detach()
+        except Exception:
+            pass  # 页面或 context 已关闭
+
+    async def is_healthy(self):
+        """健康检查：浏览器连接正常且页面可以执行脚本"""
+        try:
+            if not self.browser.is_connected() or self.page.is_closed():
+                return False
+            return await self.page.evaluate("1 + 1") == 2
+        except Exception:
+            return False
+
+    async def close(self):
+        try:
+            await self.context.close()
+        finally:
+            if self._owns_browser:
+                await self.browser.close()
+                await self.playwright.stop()
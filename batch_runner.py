@@ -0,0 +1,306 @@
+# batch_runner.py
+# 批量执行任务：从 JSONL 文件读取任务，分发给 N 个工作进程（每个进程一个独立浏览器）并行执行，
+# 每个任务使用新的 BrowserContext，任务之间不共享 cookie、存储与页面状态；
+# 支持单任务超时、失败重试，并输出 JSON / JUnit 格式的汇总报告（含每一步的耗时）。
+#
+# JSONL 每行一个任务，字段：
+#   task（或 task_desc / title）: 任务描述，必填
+#   id（或 request_id）        : 任务标识，缺省为行号
+#   url                        : 起始页面，缺省为 config.TARGET_URL
+#   max_steps / timeout / retries: 覆盖命令行中的默认值
+#
+# 用法: python batch_runner.py tasks.jsonl --workers 4 --timeout 300 --retries 1 \
+#           --json-report report.json --junit-report report.xml
+import argparse
+import json
+import logging
+import multiprocessing
+import queue
+import sys
+import time
+import traceback
+import xml.etree.ElementTree as ET
+
+from config import TARGET_URL, HEADLESS
+
+logger = logging.getLogger(__name__)
+
+WORKER_STARTUP_TIMEOUT = 120   # 工作进程启动浏览器的最长时间（秒），不计入任务超时
+WORKER_STARTUP_FAILURES = 3    # 连续这么多次启动失败后放弃剩余任务，避免无限重启
+
+
+def load_tasks(path):
+    """读取 JSONL 任务文件，跳过空行，缺少任务描述或任务 id 重复的行报错"""
+    tasks = []
+    lines = {}  # 任务 id -> 所在行号；结果按 id 汇总，重复的 id 会互相覆盖
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            task_desc = record.get("task") or record.get("task_desc") or record.get("title")
+            if not task_desc:
+                raise ValueError(f"{path}:{line_no} 缺少任务描述（task / task_desc / title）")
+            record["task"] = task_desc
+            record["id"] = str(record.get("id") or record.get("request_id") or line_no)
+            if record["id"] in lines:
+                raise ValueError(f"{path}:{line_no} 任务 id {record['id']} 与第 {lines[record['id']]} 行重复")
+            lines[record["id"]] = line_no
+            tasks.append(record)
+    return tasks
+
+
+def worker_main(worker_id, inbox, outbox, headless):
+    """工作进程：启动一个浏览器后报告 ready，每个任务新建一个 BrowserContext，直到收到 None"""
+    # 在子进程中导入，避免父进程加载 Playwright
+    from playwright.sync_api import sync_playwright
+    from main import main as run_task
+    from task_control import TaskControl
+    from ui_operator import UIOperator
+
+    playwright = sync_playwright().start()
+    try:
+        browser = playwright.chromium.launch(headless=headless)
+        outbox.put(("ready", worker_id))
+        while True:
+            task = inbox.get()
+            if task is None:
+                break
+            outbox.put(("started", worker_id, task["id"]))
+            operator = None
+            try:
+                operator = UIOperator(target_url=None, browser=browser)
+                operator.navigate_to(task.get("url") or TARGET_URL)
+                # 进程内的时间预算略短于超时，任务先自行停下并保留浏览器；终止进程只作为兜底
+                control = TaskControl(max_seconds=task["timeout"] * 0.9, max_steps=task["max_steps"])
+                result = run_task(task["task"], operator=operator, control=control)
+            except Exception as e:
+                result = {"task": task["task"], "status": "error", "error": f"{e}\n{traceback.format_exc()}",
+                          "steps": []}
+            finally:
+                if operator is not None:
+                    try:
+                        operator.close()
+                    except Exception as e:
+                        logger.warning(f"Failed to close browser context on worker {worker_id}: {e}")
+            outbox.put(("result", worker_id, task["id"], result))
+            if not browser.is_connected():
+                break  # 浏览器已崩溃：退出进程，由父进程补一个新的
+    finally:
+        playwright.stop()
+
+
+class BatchRunner:
+    def __init__(self, tasks, workers=2, timeout=300, retries=0, max_steps=6, headless=HEADLESS):
+        self.tasks = {t["id"]: t for t in tasks}
+        self.order = [t["id"] for t in tasks]
+        if len(self.tasks) != len(self.order):
+            raise ValueError("任务 id 重复（见 load_tasks）")
+        self.workers_count = max(1, min(workers, len(tasks)))
+        self.default_timeout = timeout
+        self.default_retries = retries
+        self.default_max_steps = max_steps
+        self.headless = headless
+        # Playwright 不能在 fork 出的子进程中安全复用，统一使用 spawn
+        self.ctx = multiprocessing.get_context("spawn")
+        self.outbox = self.ctx.Queue()
+        self.workers = {}   # worker_id -> {"process", "inbox", "ready", "spawned_at", "task_id", "started_at"}
+        self._next_worker_id = 0  # 重启的工作进程使用新 id，避免把旧进程迟到的结果算到新进程上
+        self._startup_failures = 0  # 连续启动失败次数，任一进程 ready 后清零
+        self.results = {task_id: {"id": task_id, "task": self.tasks[task_id]["task"], "attempts": []}
+                        for task_id in self.order}
+
+    def _spawn(self):
+        worker_id = self._next_worker_id
+        self._next_worker_id += 1
+        inbox = self.ctx.Queue()
+        process = self.ctx.Process(target=worker_main, args=(worker_id, inbox, self.outbox, self.headless),
+                                   name=f"batch-worker-{worker_id}", daemon=True)
+        process.start()
+        self.workers[worker_id] = {"process": process, "inbox": inbox, "ready": False, "spawned_at": time.time(),
+                                   "task_id": None, "started_at": None}
+        return worker_id
+
+    def _kill(self, worker_id):
+        worker = self.workers.pop(worker_id)
+        worker["process"].terminate()
+        worker["process"].join(5)
+
+    def _task_option(self, task_id, name, default):
+        value = self.tasks[task_id].get(name)
+        return default if value is None else value
+
+    def _assign(self, worker_id, pending):
+        task_id = pending.pop(0)
+        task = dict(self.tasks[task_id])
+        task["max_steps"] = self._task_option(task_id, "max_steps", self.default_max_steps)
+        task["timeout"] = self._task_option(task_id, "timeout", self.default_timeout)
+        worker = self.workers[worker_id]
+        worker["task_id"] = task_id
+        worker["started_at"] = time.time()  # 浏览器已就绪，超时从派发时开始计算，收到 started 后校正
+        worker["inbox"].put(task)
+
+    def _finish_attempt(self, task_id, attempt, pending):
+        """记录一次尝试；未成功且还有重试次数时重新排队"""
+        attempts = self.results[task_id]["attempts"]
+        attempts.append(attempt)
+        retries = self._task_option(task_id, "retries", self.default_retries)
+        if attempt["status"] != "done" and len(attempts) <= retries:
+            logger.info(f"Task {task_id} attempt {len(attempts)} ended with {attempt['status']}, retrying.")
+            pending.append(task_id)
+
+    def _startup_failed(self, worker_id, reason, pending):
+        """工作进程在浏览器就绪前退出或超时：重启；连续失败过多时把剩余任务记为 crashed"""
+        logger.warning(f"Worker {worker_id} failed to start: {reason}")
+        self._kill(worker_id)
+        self._startup_failures += 1
+        if self._startup_failures < WORKER_STARTUP_FAILURES:
+            self._spawn()
+            return
+        # 仍有已就绪或正在启动的工作进程时由它们继续执行；正在启动的进程之后失败时会再次到这里判断
+        if not pending or any(w["ready"] or w["process"].is_alive() for w in self.workers.values()):
+            return
+        logger.error(f"Workers failed to start {self._startup_failures} times in a row, giving up.")
+        for task_id in pending:
+            self.results[task_id]["attempts"].append({
+                "task": self.tasks[task_id]["task"], "status": "crashed",
+                "error": f"工作进程无法启动浏览器：{reason}", "steps": [], "duration_s": 0,
+            })
+        pending.clear()
+
+    def run(self):
+        pending = list(self.order)
+        started = time.time()
+        idle = []  # 浏览器已就绪且空闲的工作进程
+        for _ in range(self.workers_count):
+            self._spawn()
+
+        while pending or any(w["task_id"] for w in self.workers.values()):
+            while pending and idle:
+                self._assign(idle.pop(0), pending)
+
+            try:
+                message = self.outbox.get(timeout=0.5)
+            except queue.Empty:
+                message = None
+
+            if message and message[0] == "ready":
+                _, worker_id = message
+                if worker_id in self.workers:
+                    self.workers[worker_id]["ready"] = True
+                    self._startup_failures = 0
+                    idle.append(worker_id)
+            elif message and message[0] == "started":
+                _, worker_id, task_id = message
+                if worker_id in self.workers:
+                    self.workers[worker_id]["started_at"] = time.time()
+            elif message and message[0] == "result":
+                _, worker_id, task_id, result = message
+                worker = self.workers.get(worker_id)
+                if worker and worker["task_id"] == task_id:
+                    result["duration_s"] = round(time.time() - worker["started_at"], 2)
+                    worker["task_id"] = None
+                    idle.append(worker_id)
+                    self._finish_attempt(task_id, result, pending)
+
+            # 超时与崩溃检测：直接终止工作进程（连同其浏览器），再补一个新的
+            now = time.time()
+            for worker_id, worker in list(self.workers.items()):
+                if not worker["ready"]:
+                    if not worker["process"].is_alive():
+                        self._startup_failed(worker_id, "进程异常退出", pending)
+                    elif now - worker["spawned_at"] > WORKER_STARTUP_TIMEOUT:
+                        self._startup_failed(worker_id, f"超过 {WORKER_STARTUP_TIMEOUT}s 未就绪", pending)
+                    continue
+                task_id = worker["task_id"]
+                if task_id is None:
+                    if not worker["process"].is_alive():
+                        self._kill(worker_id)
+                        idle.remove(worker_id)
+                        self._spawn()
+                    continue
+                timeout = self._task_option(task_id, "timeout", self.default_timeout)
+                timed_out = now - worker["started_at"] > timeout
+                if timed_out or not worker["process"].is_alive():
+                    status = "timeout" if timed_out else "crashed"
+                    logger.warning(f"Task {task_id} {status} on worker {worker_id}, restarting worker.")
+                    self._kill(worker_id)
+                    self._finish_attempt(task_id, {
+                        "task": self.tasks[task_id]["task"], "status": status,
+                        "error": f"超过 {timeout}s 未完成" if timed_out else "工作进程异常退出",
+                        "steps": [], "duration_s": round(now - worker["started_at"], 2),
+                    }, pending)
+                    self._spawn()
+
+        for worker in self.workers.values():
+            worker["inbox"].put(None)
+        for worker_id in list(self.workers):
+            self.workers[worker_id]["process"].join(30)
+            if self.workers[worker_id]["process"].is_alive():
+                self._kill(worker_id)
+
+        return self.summary(time.time() - started)
+
+    def summary(self, elapsed):
+        tasks = []
+        for task_id in self.order:
+            record = self.results[task_id]
+            final = record["attempts"][-1] if record["attempts"] else {"status": "not_run"}
+            tasks.append({**record, "status": final["status"]})
+        counts = {}
+        for t in tasks:
+            counts[t["status"]] = counts.get(t["status"], 0) + 1
+        return {"total": len(tasks), "passed": counts.get("done", 0), "statuses": counts,
+                "workers": self.workers_count, "elapsed_s": round(elapsed, 2), "tasks": tasks}
+
+
+def write_junit(summary, path):
+    """JUnit XML：每个任务一个 testcase，最后一次尝试的每步耗时写入 system-out"""
+    suite = ET.Element("testsuite", name="a2i-batch", tests=str(summary["total"]),
+                       failures=str(summary["total"] - summary["passed"]), time=str(summary["elapsed_s"]))
+    for task in summary["tasks"]:
+        attempts = task["attempts"]
+        last = attempts[-1] if attempts else {}
+        case = ET.SubElement(suite, "testcase", classname="a2i", name=f"{task['id']}: {task['task']}",
+                             time=str(sum(a.get("duration_s", 0) for a in attempts)))
+        if task["status"] != "done":
+            failure = ET.SubElement(case, "failure", type=task["status"], message=str(last.get("error") or task["status"]))
+            failure.text = str(last.get("error") or "")
+        lines = [f"attempts: {len(attempts)}"]
+        for step in last.get("steps", []):
+            lines.append(json.dumps(step, ensure_ascii=False))
+        ET.SubElement(case, "system-out").text = "\n".join(lines)
+    ET.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="并行批量执行 A2I 任务")
+    parser.add_argument("tasks", help="JSONL 任务文件")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--timeout", type=float, default=300, help="单次尝试超时（秒）")
+    parser.add_argument("--retries", type=int, default=0, help="失败后的重试次数")
+    parser.add_argument("--max-steps", type=int, default=6)
+    parser.add_argument("--json-report", default="batch_report.json")
+    parser.add_argument("--junit-report")
+    args = parser.parse_args(argv)
+
+    tasks = load_tasks(args.tasks)
+    if not tasks:
+        print("任务文件为空")
+        return 0
+    runner = BatchRunner(tasks, workers=args.workers, timeout=args.timeout,
+                         retries=args.retries, max_steps=args.max_steps)
+    summary = runner.run()
+
+    with open(args.json_report, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    if args.junit_report:
+        write_junit(summary, args.junit_report)
+
+    print(f"完成 {summary['passed']}/{summary['total']}，耗时 {summary['elapsed_s']}s，状态统计: {summary['statuses']}")
+    return 0 if summary["passed"] == summary["total"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
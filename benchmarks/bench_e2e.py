@@ -0,0 +1,267 @@
+# benchmarks/bench_e2e.py
+# 离线端到端基准：本地 HTTP 服务提供 fixtures/ 中的演示页面（登录表单、拖拽、长列表），
+# mock_vision_model 作为确定性的模拟视觉模型（经 stub_llm_server 以 OpenAI 兼容接口提供），
+# 不依赖外网与智谱接口，可在普通 Linux CI 机器上运行。
+#
+# 两种驱动方式：
+#   main     : 直接调用 main.main()，每个场景复用一个 UIOperator
+#   socketio : 用 N 个 Socket.IO 测试客户端并发走 app.py 的完整路径（start_browser -> run_task）
+# 输出：完成率、steps/sec、单步耗时 p50/p99、浏览器进程内存（总量与每会话）。
+# 指定 --baseline 时与基线报告比较，吞吐下降或 p99 上升超过 --max-regression 即以退出码 1 结束。
+#
+# 用法: python benchmarks/bench_e2e.py [--mode main|socketio|both] [--clients 4] [--iterations 3]
+#           [--latency 0.05] [--json e2e_report.json] [--baseline e2e_baseline.json]
+import argparse
+import functools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import config  # noqa: E402
+from mock_vision_model import SCENARIOS, scripted_responder  # noqa: E402
+from stub_llm_server import start_stub_server  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fixture_server():
+    """在后台线程提供 fixtures 目录，返回 (server, base_url)"""
+    handler = functools.partial(_QuietHandler, directory=FIXTURES_DIR)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def configure(args, llm_base_url, work_dir):
+    """在导入 main / app 之前改写配置：模型指向本地桩服务，关闭缓存与回放，产物写入临时目录"""
+    config.LLM_PROVIDER = "openai"
+    config.LLM_BASE_URL = llm_base_url
+    config.LLM_API_KEY = "mock"
+    config.LLM_RATE_PER_SEC = 0
+    config.HEADLESS = True
+    config.AI_STREAMING = args.streaming
+    config.AI_CACHE_ENABLED = args.with_cache
+    config.PLAN_CACHE_ENABLED = args.with_cache
+    config.PLAN_CACHE_DIR = os.path.join(work_dir, "plans")
+    config.SCREENSHOT_DIR = os.path.join(work_dir, "screenshots")
+    config.TRACE_DIR = None
+
+
+def browser_rss_mb():
+    """当前进程所有子孙进程（即 Chromium 各进程）的常驻内存之和（MiB）；非 Linux 返回 None"""
+    if not os.path.isdir("/proc"):
+        return None
+    parents = {}
+    rss = {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/status", "r") as f:
+                fields = dict(line.split(":", 1) for line in f if ":" in line)
+        except OSError:
+            continue
+        parents[int(pid)] = int(fields.get("PPid", "0").strip())
+        rss[int(pid)] = int(fields.get("VmRSS", "0 kB").split()[0]) if "VmRSS" in fields else 0
+    me = os.getpid()
+    total_kb = 0
+    for pid in rss:
+        ancestor = parents.get(pid)
+        while ancestor and ancestor != me:
+            ancestor = parents.get(ancestor)
+        if ancestor == me:
+            total_kb += rss[pid]
+    return round(total_kb / 1024, 1)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else None
+
+
+def summarize(name, step_ms, tasks, done, elapsed, sessions):
+    rss = browser_rss_mb()
+    return {
+        "mode": name,
+        "tasks": tasks,
+        "done": done,
+        "steps": len(step_ms),
+        "elapsed_s": round(elapsed, 2),
+        "steps_per_sec": round(len(step_ms) / elapsed, 2) if elapsed else None,
+        "step_p50_ms": round(percentile(step_ms, 0.5), 1) if step_ms else None,
+        "step_p99_ms": round(percentile(step_ms, 0.99), 1) if step_ms else None,
+        "step_mean_ms": round(statistics.mean(step_ms), 1) if step_ms else None,
+        "browser_rss_mb": rss,
+        "rss_per_session_mb": round(rss / sessions, 1) if rss and sessions else None,
+    }
+
+
+def bench_main(args, fixture_url):
+    from main import main as run_task
+    from ui_operator import UIOperator
+
+    step_ms = []
+    done = tasks = 0
+    operators = []
+    started = time.perf_counter()
+    for scenario in SCENARIOS.values():
+        operator = UIOperator(target_url=None, headless=True)
+        operators.append(operator)
+        for _ in range(args.iterations):
+            operator.navigate_to(f"{fixture_url}/{scenario['page']}")
+            result = run_task(scenario["task"], operator=operator, max_steps=len(scenario["replies"]) + 1,
+                              capture_policy=args.capture)
+            tasks += 1
+            done += result["status"] == "done"
+            step_ms.extend(step["total_ms"] for step in result["steps"] if "total_ms" in step)
+    elapsed = time.perf_counter() - started
+    summary = summarize("main", step_ms, tasks, done, elapsed, len(operators))
+    for operator in operators:
+        operator.close()
+    return summary
+
+
+def _wait_for(client, events, timeout):
+    """轮询测试客户端收到的事件，直到出现 events 中的任一事件；返回 (事件名, 收到的全部事件及时间)"""
+    received = []
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        for packet in client.get_received():
+            received.append((packet["name"], time.perf_counter()))
+            if packet["name"] in events:
+                return packet["name"], received
+        time.sleep(0.005)
+    return "timeout", received
+
+
+def bench_socketio(args, fixture_url):
+    import app as web_app
+
+    scenarios = list(SCENARIOS.values())
+    results = []
+    lock = threading.Lock()
+
+    def client_main(index):
+        scenario = scenarios[index % len(scenarios)]
+        client = web_app.socketio.test_client(web_app.app)
+        client.emit("start_browser", {"url": f"{fixture_url}/{scenario['page']}"})
+        status, _ = _wait_for(client, {"browser_started", "browser_error"}, args.timeout)
+        local = {"tasks": 0, "done": 0, "step_ms": []}
+        if status == "browser_started":
+            for _ in range(args.iterations):
+                client.emit("run_task", {"task": scenario["task"], "capture": args.capture})
+                status, events = _wait_for(client, {"task_done", "task_error", "task_warning"}, args.timeout)
+                local["tasks"] += 1
+                local["done"] += status == "task_done"
+                # 单步耗时：相邻 step_start 之间，最后一步到任务结束事件
+                marks = [t for name, t in events if name == "step_start"] + [events[-1][1]] if events else []
+                local["step_ms"].extend((b - a) * 1000 for a, b in zip(marks, marks[1:]))
+        with lock:
+            results.append((client, local))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client_main, args=(i,)) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    step_ms = [ms for _, local in results for ms in local["step_ms"]]
+    summary = summarize("socketio", step_ms, sum(l["tasks"] for _, l in results),
+                        sum(l["done"] for _, l in results), elapsed, args.clients)
+    for client, _ in results:
+        client.disconnect()
+    if web_app.async_engine is not None:
+        web_app.async_engine.stop()
+    else:
+        from global_operator import stop_browser_thread
+        stop_browser_thread()
+    return summary
+
+
+def compare(report, baseline, max_regression):
+    """返回回归说明列表：吞吐下降或 p99 上升超过阈值的模式"""
+    problems = []
+    previous = {row["mode"]: row for row in baseline.get("results", [])}
+    for row in report["results"]:
+        base = previous.get(row["mode"])
+        if not base:
+            continue
+        if base.get("steps_per_sec") and row["steps_per_sec"] is not None \
+                and row["steps_per_sec"] < base["steps_per_sec"] * (1 - max_regression):
+            problems.append(f"{row['mode']}: steps/sec {row['steps_per_sec']} < 基线 {base['steps_per_sec']}")
+        if base.get("step_p99_ms") and row["step_p99_ms"] is not None \
+                and row["step_p99_ms"] > base["step_p99_ms"] * (1 + max_regression):
+            problems.append(f"{row['mode']}: p99 {row['step_p99_ms']}ms > 基线 {base['step_p99_ms']}ms")
+        if row["done"] < row["tasks"]:
+            problems.append(f"{row['mode']}: 仅完成 {row['done']}/{row['tasks']} 个任务")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线端到端基准（本地演示页面 + 模拟视觉模型）")
+    parser.add_argument("--mode", choices=["main", "socketio", "both"], default="both")
+    parser.add_argument("--clients", type=int, default=4, help="socketio 模式的并发客户端数")
+    parser.add_argument("--iterations", type=int, default=3, help="每个场景 / 每个客户端执行任务的次数")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟模型每次请求的延迟（秒）")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="模拟模型流式片段间隔（秒）")
+    parser.add_argument("--timeout", type=float, default=120, help="等待单个任务完成的上限（秒）")
+    parser.add_argument("--no-streaming", dest="streaming", action="store_false")
+    parser.add_argument("--with-cache", action="store_true", help="保留响应缓存与操作回放")
+    parser.add_argument("--capture", default=config.CAPTURE_POLICY, help="操作后截图策略（见 capture.py）")
+    parser.add_argument("--json", help="把报告写入 JSON 文件")
+    parser.add_argument("--baseline", help="基线报告（同格式的 JSON）")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    fixture_server, fixture_url = start_fixture_server()
+    llm_server, llm_url = start_stub_server(latency=args.latency, chunk_delay=args.chunk_delay,
+                                            responder=scripted_responder)
+    work_dir = tempfile.mkdtemp(prefix="a2i-e2e-")
+    configure(args, llm_url, work_dir)
+
+    results = []
+    if args.mode in ("main", "both"):
+        results.append(bench_main(args, fixture_url))
+    if args.mode in ("socketio", "both"):
+        results.append(bench_socketio(args, fixture_url))
+    report = {"args": vars(args), "results": results, "model_requests": llm_server.state.requests}
+
+    print(f"{'mode':<10}{'done':>9}{'steps/s':>9}{'p50_ms':>9}{'p99_ms':>9}{'rss_mb':>9}{'rss/sess':>10}")
+    for row in results:
+        print(f"{row['mode']:<10}{row['done']:>4}/{row['tasks']:<4}{str(row['steps_per_sec']):>9}"
+              f"{str(row['step_p50_ms']):>9}{str(row['step_p99_ms']):>9}{str(row['browser_rss_mb']):>9}"
+              f"{str(row['rss_per_session_mb']):>10}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    fixture_server.shutdown()
+    llm_server.shutdown()
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            problems = compare(report, json.load(f), args.max_regression)
+        for problem in problems:
+            print(f"[回归] {problem}")
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+# benchmarks/bench_image_tiers.py
+# 对比截图编码档位（image_encoding.TIERS）的成本与定位精度：
+# 把已保存的截图逐一按各档位编码后发给模型，统计
+#   payload_kb : data URL 体积（上传量，近似反映视觉 token 成本）
+#   encode_ms  : 本地编码耗时
+#   model_ms   : 模型调用耗时
+#   err_px     : 与参考档位（默认无损 png）给出的坐标之间的距离（视口像素），按操作序号对应
+#   hit        : 误差不超过 --tolerance 像素且操作类型一致的比例
+#
+# 截图来源：默认读取截图存储中的运行清单（runs/*/*.json，取每步的输入截图与任务描述）；
+# 也可以用 --images 指定 PNG 文件并用 --task 给出任务描述。
+#
+# 用法: python benchmarks/bench_image_tiers.py [--tiers png,webp80,jpeg75_050] [--limit 20]
+#           [--images a.png b.png --task "登录"] [--no-model] [--base-url http://127.0.0.1:8900/v1]
+import argparse
+import glob
+import json
+import math
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_handler import call_ai  # noqa: E402
+from config import SCREENSHOT_DIR  # noqa: E402
+from image_encoding import TIERS, encode_image, to_data_url  # noqa: E402
+from ui_operator import resolve_action  # noqa: E402
+
+
+def load_samples(args):
+    """返回 [(任务描述, 截图字节)]"""
+    if args.images:
+        if not args.task:
+            raise SystemExit("--images 需要同时给出 --task")
+        paths = [(args.task, path) for path in args.images]
+    else:
+        paths = []
+        for manifest_path in sorted(glob.glob(os.path.join(args.screenshot_dir, "runs", "*", "*.json"))):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            for entry in manifest.get("screenshots", []):
+                if entry["label"].endswith("_input") and os.path.exists(entry["path"]):
+                    paths.append((manifest["task_desc"], entry["path"]))
+    samples = []
+    for task_desc, path in paths[:args.limit]:
+        with open(path, "rb") as f:
+            samples.append((task_desc, f.read()))
+    return samples
+
+
+def action_points(result):
+    """把模型结果中的每个操作解析为 (操作类型, 视口像素坐标列表)"""
+    if result.get("status") != "action":
+        return [(result.get("status"), [])]
+    actions = result["data"]
+    if isinstance(actions, dict):
+        actions = [actions]
+    points = []
+    for action in actions or []:
+        resolved = resolve_action(action)
+        points.append((resolved.action, resolved.points) if resolved else (None, []))
+    return points
+
+
+def coordinate_errors(reference, candidate):
+    """按操作序号逐点计算距离；操作类型或点数不一致时记为无穷大"""
+    errors = []
+    for index, (ref_action, ref_points) in enumerate(reference):
+        if index >= len(candidate) or candidate[index][0] != ref_action \
+                or len(candidate[index][1]) != len(ref_points):
+            errors.append(math.inf)
+            continue
+        for (rx, ry), (cx, cy) in zip(ref_points, candidate[index][1]):
+            errors.append(math.hypot(rx - cx, ry - cy))
+        if not ref_points:
+            errors.append(0.0)
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="截图编码档位的成本与定位精度对比")
+    parser.add_argument("--tiers", default=",".join(TIERS), help="逗号分隔的档位名")
+    parser.add_argument("--reference", default="png", help="作为坐标基准的档位")
+    parser.add_argument("--screenshot-dir", default=SCREENSHOT_DIR)
+    parser.add_argument("--images", nargs="*")
+    parser.add_argument("--task")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--tolerance", type=float, default=10, help="视为命中的最大坐标误差（像素）")
+    parser.add_argument("--no-model", action="store_true", help="只统计体积与编码耗时，不调用模型")
+    parser.add_argument("--base-url", help="使用 OpenAI 兼容服务（例如 benchmarks/stub_llm_server.py）")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    tiers = [name.strip() for name in args.tiers.split(",") if name.strip()]
+    if args.reference not in tiers:
+        tiers.insert(0, args.reference)
+    if args.base_url:
+        from llm_client import LLMClient, OpenAICompatibleProvider, set_llm_client
+        set_llm_client(LLMClient(OpenAICompatibleProvider(base_url=args.base_url)))
+
+    samples = load_samples(args)
+    if not samples:
+        raise SystemExit("没有可用的截图，请先执行任务或使用 --images")
+
+    rows = {name: {"payload": [], "encode": [], "model": [], "errors": []} for name in tiers}
+    for index, (task_desc, img_bytes) in enumerate(samples):
+        reference_points = None
+        for name in [args.reference] + [t for t in tiers if t != args.reference]:
+            started = time.perf_counter()
+            encoded = encode_image(img_bytes, name)
+            rows[name]["encode"].append((time.perf_counter() - started) * 1000)
+            rows[name]["payload"].append(len(to_data_url(encoded)) / 1024)
+            if args.no_model:
+                continue
+            started = time.perf_counter()
+            result = call_ai(None, task_desc, img_bytes=img_bytes, use_cache=False, tier=name)
+            rows[name]["model"].append((time.perf_counter() - started) * 1000)
+            points = action_points(result)
+            if reference_points is None:
+                reference_points = points
+            else:
+                rows[name]["errors"].extend(coordinate_errors(reference_points, points))
+        print(f"[{index + 1}/{len(samples)}] {task_desc}")
+
+    summary = []
+    for name in tiers:
+        row = rows[name]
+        finite = [e for e in row["errors"] if math.isfinite(e)]
+        summary.append({
+            "tier": name,
+            "payload_kb": round(statistics.mean(row["payload"]), 1),
+            "encode_ms": round(statistics.mean(row["encode"]), 1),
+            "model_ms": round(statistics.mean(row["model"]), 1) if row["model"] else None,
+            "err_px": round(statistics.mean(finite), 1) if finite else None,
+            "hit": round(sum(1 for e in row["errors"] if e <= args.tolerance) / len(row["errors"]), 3)
+            if row["errors"] else None,
+        })
+
+    print(f"{'tier':<18}{'payload_kb':>12}{'encode_ms':>11}{'model_ms':>10}{'err_px':>8}{'hit':>7}")
+    for row in summary:
+        print(f"{row['tier']:<18}{row['payload_kb']:>12}{row['encode_ms']:>11}"
+              f"{str(row['model_ms']):>10}{str(row['err_px']):>8}{str(row['hit']):>7}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"samples": len(samples), "tolerance": args.tolerance, "tiers": summary},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# benchmarks/bench_llm_client.py
+# 使用本地桩服务测量 LLMClient 在并发请求下的吞吐、限流与重试情况。
+#
+# 用法: python benchmarks/bench_llm_client.py [--requests 200] [--threads 32] [--latency 0.2] [--rate-limit 0.05]
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from llm_client import LLMClient, OpenAICompatibleProvider  # noqa: E402
+from stub_llm_server import start_stub_server  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLMClient 并发基准（本地桩服务）")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--tenants", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--rate-limit", type=float, default=0.05, help="桩服务返回 429 的概率")
+    parser.add_argument("--rate", type=float, default=0, help="客户端令牌桶速率，0 为不限")
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(latency=args.latency, rate_limit=args.rate_limit)
+    client = LLMClient(OpenAICompatibleProvider(base_url=base_url, api_key="stub"),
+                       max_concurrency=args.concurrency, rate_per_sec=args.rate,
+                       burst=args.concurrency, backoff_base=0.05, backoff_max=1.0)
+    messages = [{"role": "user", "content": "ping"}]
+
+    def one(i):
+        started = time.perf_counter()
+        client.chat(messages, model="stub", tenant=f"tenant-{i % args.tenants}")
+        return (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        latencies = sorted(pool.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+    client.close()
+
+    print(f"requests={args.requests} elapsed={elapsed:.2f}s throughput={args.requests / elapsed:.1f} req/s")
+    print(f"latency p50={statistics.median(latencies):.0f}ms p99={latencies[int(len(latencies) * 0.99) - 1]:.0f}ms")
+    print(f"client stats={client.stats} server requests={server.state.requests}")
+
+
+if __name__ == "__main__":
+    main()
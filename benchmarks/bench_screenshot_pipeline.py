@@ -0,0 +1,88 @@
+# benchmarks/bench_screenshot_pipeline.py
+# 对比两种截图 -> 模型输入的路径：
+#   file   : page.screenshot(path=...) 写盘，再打开文件读取并 base64 编码（原有做法）
+#   memory : page.screenshot() 直接返回字节并 base64 编码，落盘交给 ScreenshotStore 的后台线程
+# 只测量截图管线本身（不含 networkidle 与固定等待），输出每步耗时与 Python 侧峰值内存。
+#
+# 用法: python benchmarks/bench_screenshot_pipeline.py [URL] [--steps N] [--no-persist]
+import argparse
+import base64
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ui_operator import UIOperator  # noqa: E402
+from screenshot_store import ScreenshotStore  # noqa: E402
+
+DEMO_PAGE = "data:text/html," + "".join(
+    f"<p style='font:16px sans-serif;color:#{i * 37 % 999:03d}'>row {i} lorem ipsum dolor sit amet</p>"
+    for i in range(60)
+)
+
+
+def step_file(page, path):
+    page.screenshot(path=path, full_page=False)
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode("utf-8")
+
+
+def step_memory(page, store):
+    data = page.screenshot(full_page=False)
+    if store is not None:
+        store.put(data)
+    return base64.b64encode(data).decode("utf-8")
+
+
+def run(name, func, steps, out_dir):
+    timings = []
+    tracemalloc.start()
+    for i in range(steps):
+        path = os.path.join(out_dir, f"{name}_{i}.png")
+        started = time.perf_counter()
+        func(path)
+        timings.append((time.perf_counter() - started) * 1000)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "name": name,
+        "mean_ms": statistics.mean(timings),
+        "p50_ms": statistics.median(timings),
+        "max_ms": max(timings),
+        "peak_kb": peak / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="截图管线基准：文件往返 vs 内存直传")
+    parser.add_argument("url", nargs="?", default=DEMO_PAGE)
+    parser.add_argument("--steps", type=int, default=30)
+    parser.add_argument("--no-persist", action="store_true", help="memory 模式下不落盘")
+    args = parser.parse_args()
+
+    operator = UIOperator(target_url=args.url)
+    page = operator.page
+    try:
+        page.screenshot()  # 预热
+        with tempfile.TemporaryDirectory() as out_dir:
+            store = None if args.no_persist else ScreenshotStore(root=os.path.join(out_dir, "store"), fmt="png")
+            results = [
+                run("file", lambda p: step_file(page, p), args.steps, out_dir),
+                run("memory", lambda p: step_memory(page, store), args.steps, out_dir),
+            ]
+            if store is not None:
+                store.flush()  # 等待后台写入完成再清理目录
+    finally:
+        operator.close()
+
+    print(f"{'mode':<8}{'mean ms':>10}{'p50 ms':>10}{'max ms':>10}{'peak KiB':>12}")
+    for r in results:
+        print(f"{r['name']:<8}{r['mean_ms']:>10.1f}{r['p50_ms']:>10.1f}{r['max_ms']:>10.1f}{r['peak_kb']:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
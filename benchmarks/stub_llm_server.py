@@ -0,0 +1,147 @@
+# benchmarks/stub_llm_server.py
+# 本地 OpenAI 兼容桩服务：POST /v1/chat/completions 返回预设的回复，用于在测试和基准中替代智谱接口。
+# 可模拟响应延迟和 429 限流；请求中 "stream": true 时以 SSE 分块返回（模拟逐 token 生成）。配置 config.LLM_PROVIDER = "openai"、
+# LLM_BASE_URL = "http://127.0.0.1:8900/v1" 即可让 call_ai 走桩服务。
+# 需要按请求内容决定回复时（例如按任务与步骤返回脚本化的操作，见 mock_vision_model.py），传入 responder。
+#
+# 用法: python benchmarks/stub_llm_server.py [--port 8900] [--latency 0.5] [--rate-limit 0.1] [--replies replies.json]
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLIES = [
+    '[{"action": "click", "coordinate": {"x": 0.5000, "y": 0.5000}}]',
+    "目标完成",
+]
+
+
+class StubState:
+    def __init__(self, replies, latency=0.0, rate_limit=0.0, chunk_size=8, chunk_delay=0.0, responder=None):
+        self.replies = itertools.cycle(replies)
+        self.responder = responder
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def next_reply(self, request):
+        with self.lock:
+            self.requests += 1
+            if self.responder is None:
+                return next(self.replies)
+        return self.responder(request)
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # 支持 keep-alive，便于观察连接复用
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, body, headers=None):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_stream(self, model, content, usage):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def write_event(payload):
+                data = f"data: {payload}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            for i in range(0, len(content), state.chunk_size):
+                if state.chunk_delay:
+                    time.sleep(state.chunk_delay)
+                write_event(json.dumps({"model": model, "choices": [
+                    {"index": 0, "delta": {"content": content[i:i + state.chunk_size]}}]}, ensure_ascii=False))
+            write_event(json.dumps({"model": model, "choices": [], "usage": usage}))
+            write_event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            if state.rate_limit and random.random() < state.rate_limit:
+                self._send_json(429, {"error": {"message": "rate limited"}}, {"Retry-After": "0.1"})
+                return
+            if state.latency:
+                time.sleep(state.latency)
+            content = state.next_reply(request)
+            prompt_chars = len(json.dumps(request.get("messages", []), ensure_ascii=False))
+            usage = {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(content) // 4,
+                     "total_tokens": prompt_chars // 4 + len(content) // 4}
+            if request.get("stream"):
+                self._send_stream(request.get("model", "stub"), content, usage)
+                return
+            self._send_json(200, {
+                "id": f"stub-{state.requests}",
+                "object": "chat.completion",
+                "model": request.get("model", "stub"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": usage,
+            })
+
+    return Handler
+
+
+def start_stub_server(port=0, replies=None, latency=0.0, rate_limit=0.0, chunk_size=8, chunk_delay=0.0,
+                      responder=None):
+    """在后台线程启动桩服务，返回 (server, base_url)；port=0 时自动分配端口。
+
+    responder(request) 给出时按请求体生成回复，replies 被忽略。
+    """
+    state = StubState(replies or DEFAULT_REPLIES, latency, rate_limit, chunk_size, chunk_delay, responder)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的本地桩模型服务")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的模拟延迟（秒）")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="返回 429 的概率")
+    parser.add_argument("--replies", help="JSON 文件，内容为按顺序循环返回的回复字符串列表")
+    parser.add_argument("--chunk-size", type=int, default=8, help="流式响应每个片段的字符数")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="流式响应片段间隔（秒）")
+    args = parser.parse_args()
+
+    replies = None
+    if args.replies:
+        with open(args.replies, "r", encoding="utf-8") as f:
+            replies = json.load(f)
+    server, base_url = start_stub_server(args.port, replies, args.latency, args.rate_limit,
+                                         args.chunk_size, args.chunk_delay)
+    print(f"桩模型服务已启动: {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
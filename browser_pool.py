@@ -0,0 +1,237 @@
+# browser_pool.py
+# 多会话浏览器池：整个进程只启动一个 Chromium，每个会话（Socket.IO sid 或任务 id）
+# 分配一个独立的 BrowserContext（cookie、localStorage、页面互相隔离）。
+#
+# 注意：Playwright 的同步 API 不是线程安全的，池中的所有对象必须在创建它们的线程里使用。
+# 在 Web 服务中，global_operator 的每个浏览器工作线程各自拥有一个池，会话固定在其中一个线程上。
+import logging
+import time
+
+from playwright.sync_api import sync_playwright
+
+from config import (
+    HEADLESS,
+    POOL_MIN_SIZE,
+    POOL_MAX_SIZE,
+    POOL_IDLE_TIMEOUT,
+    POOL_HEALTH_CHECK_INTERVAL,
+)
+from settle import SettleDetector
+from ui_operator import UIOperator
+
+logger = logging.getLogger(__name__)
+
+
+class PoolExhaustedError(RuntimeError):
+    """浏览器池中的 context 数量已达上限"""
+
+
+class PooledSession:
+    """池中一个会话占用的 context 及其使用时间信息"""
+
+    def __init__(self, session_id, operator):
+        self.session_id = session_id
+        self.operator = operator
+        self.created_at = time.time()
+        self.last_used = self.created_at
+
+    def touch(self):
+        self.last_used = time.time()
+
+    def idle_seconds(self, now=None):
+        return (now or time.time()) - self.last_used
+
+
+class BrowserPool:
+    def __init__(self, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 idle_timeout=POOL_IDLE_TIMEOUT,
+                 health_check_interval=POOL_HEALTH_CHECK_INTERVAL,
+                 headless=HEADLESS):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError(f"浏览器池大小配置无效: min={min_size}, max={max_size}")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.headless = headless
+
+        self.playwright = None
+        self.browser = None
+        self.sessions = {}   # session_id -> PooledSession
+        self.standby = []    # 预热好、尚未分配的 UIOperator
+        self._last_health_check = 0.0
+        # 所有会话共用一个稳定检测器，汇总各类操作的等待耗时用于调参
+        self.settle = SettleDetector()
+
+    # --- 浏览器进程 ---
+
+    def _ensure_browser(self):
+        """按需启动（或在崩溃后重启）共享的 Chromium 进程"""
+        if self.browser is not None and self.browser.is_connected():
+            return self.browser
+        if self.browser is not None:
+            logger.warning("Shared Chromium disconnected, relaunching and dropping all contexts.")
+            self._drop_all_contexts()
+        if self.playwright is None:
+            self.playwright = sync_playwright().start()
+        self.browser = self.playwright.chromium.launch(headless=self.headless)
+        logger.info("Shared Chromium launched for browser pool.")
+        return self.browser
+
+    def _new_operator(self, storage_state=None):
+        return UIOperator(target_url=None, browser=self._ensure_browser(), settle=self.settle,
+                          storage_state=storage_state)
+
+    @staticmethod
+    def _close_operator(operator):
+        try:
+            operator.close()
+        except Exception as e:
+            logger.warning(f"Exception while closing pooled context: {e}", exc_info=True)
+
+    def _drop_all_contexts(self):
+        """浏览器已失联时，仅清理引用（context 随进程一起消失）"""
+        self.sessions.clear()
+        self.standby.clear()
+
+    def size(self):
+        return len(self.sessions) + len(self.standby)
+
+    # --- 会话分配 ---
+
+    def acquire(self, session_id, storage_state=None):
+        """获取会话的 operator；不存在则从预热队列取或新建一个 context。
+
+        给出 storage_state（保存的登录状态）时新建带该状态的 context：状态只能在创建 context 时完整载入，
+        预热的 context 用不上，但 Chromium 已在运行，新建 context 只需几十毫秒。
+        """
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.touch()
+            return session.operator
+
+        operator = None
+        while self.standby and operator is None and storage_state is None:
+            candidate = self.standby.pop()
+            if candidate.is_healthy():
+                operator = candidate
+            else:
+                self._close_operator(candidate)
+
+        if operator is None:
+            if self.size() >= self.max_size:
+                # 尝试先回收空闲会话再判断是否已满
+                self.evict_idle()
+                if self.size() >= self.max_size:
+                    raise PoolExhaustedError(f"浏览器池已满（上限 {self.max_size} 个会话）")
+            operator = self._new_operator(storage_state)
+
+        self.sessions[session_id] = PooledSession(session_id, operator)
+        logger.info(f"Context assigned to session {session_id} ({len(self.sessions)} active).")
+        return operator
+
+    def get(self, session_id):
+        """获取已分配的 operator，不存在时返回 None"""
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        session.touch()
+        return session.operator
+
+    def has_session(self, session_id):
+        return session_id in self.sessions
+
+    def release(self, session_id):
+        """关闭并移除某个会话的 context"""
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self._close_operator(session.operator)
+        logger.info(f"Context released for session {session_id} ({len(self.sessions)} active).")
+        return True
+
+    # --- 维护：空闲回收、健康检查、预热 ---
+
+    def evict_idle(self):
+        """回收空闲超时的会话，返回被回收的 session_id 列表"""
+        if not self.idle_timeout:
+            return []
+        now = time.time()
+        expired = [sid for sid, s in self.sessions.items()
+                   if s.idle_seconds(now) > self.idle_timeout]
+        for sid in expired:
+            logger.info(f"Evicting idle session {sid}.")
+            self.release(sid)
+        return expired
+
+    def health_check(self):
+        """移除不健康的 context，返回被移除的 session_id 列表"""
+        self._last_health_check = time.time()
+        if self.browser is None:
+            return []
+        if not self.browser.is_connected():
+            dead = list(self.sessions)
+            self._drop_all_contexts()
+            self.browser = None
+            return dead
+        dead = [sid for sid, s in self.sessions.items() if not s.operator.is_healthy()]
+        for sid in dead:
+            logger.warning(f"Session {sid} failed health check, closing its context.")
+            self.release(sid)
+        healthy = []
+        for op in self.standby:
+            if op.is_healthy():
+                healthy.append(op)
+            else:
+                self._close_operator(op)
+        self.standby = healthy
+        return dead
+
+    def prewarm(self):
+        """启动 Chromium 并补足预热 context，使第一个会话也无需等待"""
+        self._ensure_browser()
+        self.fill_standby()
+
+    def fill_standby(self):
+        """补充预热 context，使总数不低于 min_size"""
+        while self.size() < self.min_size:
+            self.standby.append(self._new_operator())
+
+    def maintain(self):
+        """周期性维护，由浏览器工作线程在空闲时调用；返回空闲回收与健康检查移除的 session_id 列表"""
+        removed = self.evict_idle()
+        if time.time() - self._last_health_check >= self.health_check_interval:
+            removed += self.health_check()
+        if self.browser is not None or self.sessions:
+            # 预热失败不影响已完成的回收，调用方仍需拿到被移除的会话以清理其状态
+            try:
+                self.fill_standby()
+            except Exception as e:
+                logger.warning(f"Failed to refill standby contexts: {e}", exc_info=True)
+        return removed
+
+    def close_all(self):
+        for sid in list(self.sessions):
+            self.release(sid)
+        for op in self.standby:
+            self._close_operator(op)
+        self.standby.clear()
+        if self.browser is not None:
+            try:
+                self.browser.close()
+            except Exception as e:
+                logger.warning(f"Exception while closing shared Chromium: {e}", exc_info=True)
+            self.browser = None
+        if self.playwright is not None:
+            self.playwright.stop()
+            self.playwright = None
+
+    def stats(self):
+        return {
+            "active": len(self.sessions),
+            "standby": len(self.standby),
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "browser_connected": bool(self.browser and self.browser.is_connected()),
+            "settle": self.settle.stats(),
+        }
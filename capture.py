@@ -0,0 +1,85 @@
+# capture.py
+# 操作后截图策略。这些截图只用于前端时间线和运行清单，模型看不到，
+# 因此不必每个操作后都等待页面稳定再截一张。每次运行可单独指定策略：
+#   all              每个操作后等待页面稳定并截图（原有行为）
+#   final-only       只在一步的全部操作执行完后截图一次
+#   on-visual-change 每个操作后立即截图（不等待稳定），画面与上一帧相同则丢弃；一步的最后一帧等待稳定
+#   async            每个操作后立即截图，不等待页面稳定，截图在后台任务中进行，不阻塞下一个操作。
+#                    只有异步引擎支持：sync Playwright 只能在浏览器线程中调用，同步执行入口（app 的浏览器线程、main.py）
+#                    无法把截图放到后台，选择该策略时直接报错，而不是悄悄退化为阻塞截图
+from collections import Counter
+
+from ai_cache import image_hash
+from config import CAPTURE_POLICY, CAPTURE_HASH_SIZE
+
+CAPTURE_POLICIES = ("all", "final-only", "on-visual-change", "async")
+
+
+def policy_error(policy, background=True):
+    """策略不可用时返回原因，否则返回 None；background 表示执行入口能否在后台截图（仅异步引擎可以）"""
+    if policy not in CAPTURE_POLICIES:
+        return f"未知的截图策略: {policy}（可选 {', '.join(CAPTURE_POLICIES)}）"
+    if policy == "async" and not background:
+        return ('截图策略 async 需要异步引擎（EXECUTION_ENGINE = "async"）：同步引擎的截图只能在浏览器线程中进行，'
+                '无法放到后台；只需跳过中间截图的页面稳定等待时可使用 on-visual-change')
+    return None
+
+
+class CapturePolicy:
+    """一次运行内的操作后截图决策。
+
+    调用方式：每一步开始时 seed(输入截图)；每个操作执行后 wants(last) 为真则截图，
+    截图前按 settle(last) 决定是否等待页面稳定，截到后 accept(data) 为真才保存并推送；
+    一步的操作全部执行后 finish() 为真时再补一张最终截图（last=True）。
+    """
+
+    def __init__(self, policy=CAPTURE_POLICY, background=True):
+        error = policy_error(policy, background)
+        if error:
+            raise ValueError(error)
+        self.policy = policy
+        self.pending = False  # 最近一次截图之后是否又执行过操作
+        self._last_hash = None
+        self.counters = Counter()
+
+    @property
+    def background(self):
+        """截图是否放到后台进行（仅异步引擎支持，见 policy_error）"""
+        return self.policy == "async"
+
+    def seed(self, img_bytes):
+        """记录一步开始时的输入截图，作为 on-visual-change 的比较基准"""
+        self.pending = False
+        if self.policy == "on-visual-change":
+            self._last_hash = image_hash(img_bytes, CAPTURE_HASH_SIZE)
+
+    def wants(self, last=False):
+        """刚执行完一个操作：现在是否截图；last 表示这一步之后不会再有操作"""
+        self.pending = True
+        if last or self.policy != "final-only":
+            return True
+        self.counters["skipped"] += 1
+        return False
+
+    def settle(self, last=False):
+        """截图前是否等待页面稳定"""
+        return self.policy == "all" or (last and self.policy in ("final-only", "on-visual-change"))
+
+    def accept(self, data):
+        """截到的画面是否保存并推送给前端；on-visual-change 下与上一帧相同的画面被丢弃"""
+        self.pending = False
+        if self.policy == "on-visual-change":
+            digest = image_hash(data, CAPTURE_HASH_SIZE)
+            if digest == self._last_hash:
+                self.counters["unchanged"] += 1
+                return False
+            self._last_hash = digest
+        self.counters["captured"] += 1
+        return True
+
+    def finish(self):
+        """一步的操作全部执行完：是否还需要补一张最终截图"""
+        return self.pending
+
+    def stats(self):
+        return {"policy": self.policy, **self.counters}
@@ -0,0 +1,386 @@
+# cluster.py
+# 多进程横向扩展：多个服务进程（节点）各自拥有浏览器，经消息代理协调。
+#   - 消息代理：LocalBroker 是基于 multiprocessing.connection 的发布/订阅转发，作为 Redis 等消息队列的本地替身
+#   - 跨进程 emit：BrokerManager 是 python-socketio 的 PubSubManager，任一进程 socketio.emit(to=sid)
+#     都会经代理送到该客户端连接所在的进程（包括实时画面的二进制帧与确认回调）
+#   - 会话亲和：客户端启动浏览器时由其连接所在的节点选定拥有者（优先本节点，满载时选负载最低的节点），
+#     之后该客户端的浏览器相关事件都转交给拥有者执行，直到断开连接
+#   - 负载：各节点定期广播心跳（会话数、容量），超时未收到心跳的节点视为下线
+#
+# 启动：python cluster.py --workers 4 启动代理与 4 个服务进程（端口 CLUSTER_BASE_PORT 起依次递增），
+# 前面用支持粘性会话的负载均衡（例如 nginx 的 ip_hash）把同一客户端的连接固定到同一进程。
+# 跨机器部署时各节点需共享截图目录（SCREENSHOT_DIR），并把 CLUSTER_BROKER_ADDRESS 指向代理所在的机器。
+#
+# 安全：multiprocessing.connection 会反序列化（unpickle）收到的每条消息，能连上代理并通过认证的一方
+# 可以在代理与所有节点上执行任意代码。认证密钥只从环境变量 A2I_CLUSTER_AUTHKEY 读取（没有默认值，
+# 未设置时拒绝启动），代理端口只能在本机或受信任的内网中访问，绝不能暴露到公网或不受信任的网络。
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+import socketio
+
+from config import (
+    CLUSTER_BROKER_ADDRESS,
+    CLUSTER_WORKERS,
+    CLUSTER_BASE_PORT,
+    CLUSTER_NODE_CAPACITY,
+    CLUSTER_HEARTBEAT_INTERVAL,
+    CLUSTER_NODE_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+# 启动器通过环境变量告诉服务进程自己的节点编号与端口
+NODE_ENV = "A2I_NODE_ID"
+PORT_ENV = "A2I_PORT"
+# 代理连接的认证密钥（见文件头的安全说明）
+AUTHKEY_ENV = "A2I_CLUSTER_AUTHKEY"
+AUTHKEY_MIN_LENGTH = 16
+LOOPBACK_HOSTS = ("127.0.0.1", "::1", "localhost")
+
+NODES_CHANNEL = "a2i.nodes"
+SOCKETIO_CHANNEL = "a2i.socketio"
+
+
+def node_channel(node_id):
+    return f"a2i.node.{node_id}"
+
+
+def cluster_authkey():
+    """从环境变量读取代理连接的认证密钥；未设置或过短时拒绝启动"""
+    key = os.environ.get(AUTHKEY_ENV, "")
+    if len(key) < AUTHKEY_MIN_LENGTH:
+        raise RuntimeError(f"未配置集群认证密钥：请在环境变量 {AUTHKEY_ENV} 中设置至少 {AUTHKEY_MIN_LENGTH} 个字符的随机密钥"
+                           f"（例如 python -c \"import secrets; print(secrets.token_hex(32))\"）")
+    return key.encode()
+
+
+class LocalBroker:
+    """本地消息代理：把发布到某个频道的消息转发给该频道的所有订阅连接"""
+
+    def __init__(self, address=CLUSTER_BROKER_ADDRESS, authkey=None):
+        if address[0] not in LOOPBACK_HOSTS:
+            logger.warning(f"Broker is listening on {address[0]}: messages are unpickled, so this port must only be "
+                           f"reachable from trusted hosts.")
+        self.listener = Listener(tuple(address), authkey=authkey or cluster_authkey())
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)  # 频道 -> 订阅连接
+        self.send_locks = {}                 # 连接 -> 发送锁（同一连接可能被多个发布者同时写入）
+        self.counters = Counter()
+
+    @property
+    def address(self):
+        return self.listener.address
+
+    def serve_forever(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                break
+            except Exception as e:  # 认证失败等，继续接受其他连接
+                logger.warning(f"Broker rejected a connection: {e}")
+                continue
+            threading.Thread(target=self._serve, args=(conn,), name="broker-conn", daemon=True).start()
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="broker", daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        self.listener.close()
+
+    def _serve(self, conn):
+        with self.lock:
+            self.send_locks[conn] = threading.Lock()
+        try:
+            while True:
+                op, channel, *payload = conn.recv()
+                if op == "sub":
+                    with self.lock:
+                        self.subscribers[channel].add(conn)
+                elif op == "pub":
+                    self._publish(channel, payload[0])
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self.lock:
+                for conns in self.subscribers.values():
+                    conns.discard(conn)
+                self.send_locks.pop(conn, None)
+            conn.close()
+
+    def _publish(self, channel, message):
+        with self.lock:
+            targets = [(conn, self.send_locks.get(conn)) for conn in self.subscribers.get(channel, ())]
+        self.counters["published"] += 1
+        for conn, send_lock in targets:
+            if send_lock is None:
+                continue
+            try:
+                with send_lock:
+                    conn.send((channel, message))
+                self.counters["delivered"] += 1
+            except OSError:
+                # 订阅方已断开，由其读取线程清理
+                self.counters["dropped"] += 1
+
+
+class BrokerClient:
+    """消息代理的客户端：publish 共用一个连接，listen 为每个订阅单独建立连接"""
+
+    def __init__(self, address=CLUSTER_BROKER_ADDRESS, authkey=None):
+        self.address = tuple(address)
+        self.authkey = authkey or cluster_authkey()
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        """发布消息；代理不可用时重连一次，仍失败则丢弃并返回 False"""
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._conn is None:
+                        self._conn = Client(self.address, authkey=self.authkey)
+                    self._conn.send(("pub", channel, message))
+                    return True
+                except (OSError, EOFError, AuthenticationError) as e:
+                    self._conn = None
+                    if attempt:
+                        logger.error(f"Cannot publish to broker {self.address}: {e}")
+        return False
+
+    def listen(self, *channels):
+        """逐条产出订阅频道上的 (channel, message)；连接断开后退避重连"""
+        backoff = 0.5
+        while True:
+            try:
+                conn = Client(self.address, authkey=self.authkey)
+            except (OSError, AuthenticationError) as e:
+                logger.warning(f"Cannot connect to broker {self.address}: {e}, retrying in {backoff}s")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 10.0)
+                continue
+            backoff = 0.5
+            try:
+                for channel in channels:
+                    conn.send(("sub", channel))
+                while True:
+                    yield conn.recv()
+            except (EOFError, OSError):
+                logger.warning("Broker connection lost, reconnecting.")
+            finally:
+                conn.close()
+
+
+class BrokerManager(socketio.PubSubManager):
+    """经本地消息代理在各服务进程间转发 Socket.IO 消息的客户端管理器"""
+
+    name = "a2i-broker"
+
+    def __init__(self, address=CLUSTER_BROKER_ADDRESS, authkey=None, channel=SOCKETIO_CHANNEL,
+                 write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.client = BrokerClient(address, authkey)
+
+    def _publish(self, data):
+        self.client.publish(self.channel, data)
+
+    def _listen(self):
+        for _, message in self.client.listen(self.channel):
+            yield message
+
+
+class ClusterNode:
+    """集群中的一个服务进程：维护节点心跳表与会话拥有者，把事件转交给拥有者执行"""
+
+    def __init__(self, node_id, address=CLUSTER_BROKER_ADDRESS, authkey=None,
+                 capacity=CLUSTER_NODE_CAPACITY, heartbeat_interval=CLUSTER_HEARTBEAT_INTERVAL,
+                 node_timeout=CLUSTER_NODE_TIMEOUT):
+        self.node_id = str(node_id)
+        self.address = address
+        self.authkey = authkey or cluster_authkey()
+        self.capacity = capacity
+        self.heartbeat_interval = heartbeat_interval
+        self.node_timeout = node_timeout
+        self.client = BrokerClient(address, authkey)
+        self.lock = threading.Lock()
+        self.owners = {}   # sid -> 拥有其浏览器的节点（只记录连接在本进程的客户端）
+        self.nodes = {}    # node_id -> {"load", "capacity", "seen"}
+        self.counters = Counter()
+        self.load_fn = lambda: 0
+        # on_event(sid, event, args)：在本进程执行其他节点转交来的事件
+        self.on_event = None
+        self._started = False
+
+    def client_manager(self):
+        return BrokerManager(self.address, self.authkey)
+
+    def start(self, load_fn, on_event):
+        """开始心跳与接收转交的事件；load_fn 返回本节点当前的会话数"""
+        if self._started:
+            return
+        self._started = True
+        self.load_fn = load_fn
+        self.on_event = on_event
+        threading.Thread(target=self._listen, name="cluster-listen", daemon=True).start()
+        threading.Thread(target=self._heartbeat, name="cluster-heartbeat", daemon=True).start()
+        logger.info(f"Cluster node {self.node_id} joined broker {tuple(self.address)}.")
+
+    # --- 心跳与节点表 ---
+
+    def _heartbeat(self):
+        while True:
+            self.client.publish(NODES_CHANNEL, {"node": self.node_id, "load": self.load_fn(),
+                                                "capacity": self.capacity})
+            time.sleep(self.heartbeat_interval)
+
+    def _listen(self):
+        for channel, message in self.client.listen(NODES_CHANNEL, node_channel(self.node_id)):
+            try:
+                if channel == NODES_CHANNEL:
+                    with self.lock:
+                        self.nodes[message["node"]] = {"load": message["load"], "capacity": message["capacity"],
+                                                       "seen": time.monotonic()}
+                else:
+                    self.counters["received"] += 1
+                    # 按到达顺序依次执行，同一客户端的事件（启动浏览器、执行任务……）不会乱序
+                    self.on_event(message["sid"], message["event"], message["args"])
+            except Exception as e:
+                logger.error(f"Cluster message on {channel} failed: {e}", exc_info=True)
+
+    def alive_nodes(self):
+        """心跳未超时的节点 -> 负载信息（本节点总是在内，负载取实时值）"""
+        now = time.monotonic()
+        with self.lock:
+            nodes = {node: dict(info) for node, info in self.nodes.items()
+                     if now - info["seen"] <= self.node_timeout}
+        nodes[self.node_id] = {"load": self.load_fn(), "capacity": self.capacity}
+        return nodes
+
+    def pick_node(self):
+        """为新会话选拥有者：本节点未满时就地执行（免去转发），否则选负载比例最低的节点"""
+        nodes = self.alive_nodes()
+        local = nodes[self.node_id]
+        if local["load"] < local["capacity"]:
+            return self.node_id
+        candidates = {node: info for node, info in nodes.items() if info["load"] < info["capacity"]}
+        if not candidates:
+            # 所有节点都已满：留在本节点，由浏览器池报告会话数已达上限
+            return self.node_id
+        node = min(candidates, key=lambda n: candidates[n]["load"] / candidates[n]["capacity"])
+        if node != self.node_id:
+            # 心跳到达前先计入本次分配，避免同一时刻的一批会话都选中同一个节点
+            with self.lock:
+                if node in self.nodes:
+                    self.nodes[node]["load"] += 1
+        return node
+
+    # --- 会话亲和与事件转交 ---
+
+    def owner_of(self, sid):
+        with self.lock:
+            return self.owners.get(sid)
+
+    def forward(self, sid, event, args, assign=False, release=False):
+        """把客户端事件转交给拥有其浏览器的节点；返回 False 表示应在本进程执行。
+
+        assign=True（启动浏览器）时尚无拥有者则选定一个；release=True（断开连接）时转交后清除亲和。
+        拥有者已下线时清除亲和，事件在本进程执行（浏览器已随该节点消失）。
+        """
+        with self.lock:
+            owner = self.owners.get(sid)
+        if owner is None and assign:
+            owner = self.pick_node()
+            with self.lock:
+                self.owners[sid] = owner
+        if release:
+            with self.lock:
+                self.owners.pop(sid, None)
+        if owner is None or owner == self.node_id:
+            return False
+        if owner not in self.alive_nodes():
+            logger.warning(f"Owner node {owner} of session {sid} is down, handling {event} locally.")
+            with self.lock:
+                if self.owners.get(sid) == owner:
+                    del self.owners[sid]
+            if assign:
+                return self.forward(sid, event, args, assign=True)
+            return False
+        if not self.client.publish(node_channel(owner), {"sid": sid, "event": event, "args": list(args)}):
+            return False
+        self.counters["forwarded"] += 1
+        return True
+
+    def stats(self):
+        nodes = self.alive_nodes()
+        with self.lock:
+            remote = sum(1 for owner in self.owners.values() if owner != self.node_id)
+        return {"nodes": len(nodes), "remote_sessions": remote, "load": nodes[self.node_id]["load"],
+                **self.counters}
+
+
+def join_cluster():
+    """由启动器启动的服务进程（设置了 A2I_NODE_ID）返回本节点的 ClusterNode，单进程运行时返回 None"""
+    node_id = os.environ.get(NODE_ENV)
+    if not node_id:
+        return None
+    return ClusterNode(node_id)
+
+
+def main(argv=None):
+    """启动消息代理与若干服务进程；--workers 0 时只运行代理（其他机器上的节点可接入）。
+
+    服务进程继承环境变量中的认证密钥；其他机器上的节点需配置相同的 A2I_CLUSTER_AUTHKEY。
+    """
+    parser = argparse.ArgumentParser(description="A2I 多进程服务启动器")
+    parser.add_argument("--workers", type=int, default=CLUSTER_WORKERS or os.cpu_count() or 1,
+                        help="服务进程数（默认 CLUSTER_WORKERS，为 0 时取 CPU 核数）")
+    parser.add_argument("--port", type=int, default=CLUSTER_BASE_PORT, help="第一个服务进程的端口，其余依次递增")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    broker = LocalBroker()
+    broker.start()
+    logger.info(f"Broker listening on {broker.address}.")
+
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    processes = []
+    for index in range(args.workers):
+        env = {**os.environ, NODE_ENV: str(index), PORT_ENV: str(args.port + index)}
+        processes.append(subprocess.Popen([sys.executable, app_path], env=env))
+        logger.info(f"Node {index} started on port {args.port + index} (pid {processes[-1].pid}).")
+
+    try:
+        while True:
+            for index, process in enumerate(processes):
+                if process.poll() is not None:
+                    logger.error(f"Node {index} exited with code {process.returncode}.")
+            processes = [p for p in processes if p.poll() is None]
+            if args.workers and not processes:
+                break
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logger.info("Stopping cluster...")
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        broker.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,3 +2,145 @@ API_KEY = "bdeaed9"
 MODEL_NAME = "glm-4.1v-thinking-flashx"
 TARGET_URL = "http://134.175.222.87:5016/auth/login"
 HEADLESS = True
+
+# 浏览器池：共享一个 Chromium 进程，每个会话分配独立的 BrowserContext
+POOL_MIN_SIZE = 1                  # 至少保持的 context 数量（含预热备用）
+POOL_MAX_SIZE = 32                 # 同时存在的 context 上限
+POOL_IDLE_TIMEOUT = 600            # 会话空闲超过该秒数后被回收
+POOL_HEALTH_CHECK_INTERVAL = 30    # 健康检查间隔（秒）
+POOL_PREWARM = True                # 服务启动时即启动 Chromium 并预热 POOL_MIN_SIZE 个 context，首个会话无需等待
+
+# 登录状态持久化（见 storage_state.py）：任务成功后按 (站点, 凭据档案) 保存 cookie 与 localStorage，新会话直接恢复
+# 只有服务端在 STORAGE_STATE_PROFILES 中配置的档案才会保存与恢复；客户端启动浏览器时需同时给出档案名与访问密钥，
+# 未给出或不匹配时不保存、不恢复（否则打开同一站点的任何客户端都会拿到别人的登录状态）
+STORAGE_STATE_ENABLED = True
+STORAGE_STATE_PROFILES = {}        # 档案名 -> 访问密钥，例如 {"qa-admin": "<随机生成的长字符串>"}
+STORAGE_STATE_DIR = "cache/storage_state"
+STORAGE_STATE_TTL = 7 * 24 * 3600  # 秒；超过后不再恢复，重新登录；0 表示永不过期
+
+# 多会话任务调度（thread 引擎，见 scheduler.py）：每个会话一个队列，多个浏览器工作线程轮询取任务
+SCHEDULER_WORKERS = 2              # 浏览器工作线程数；每个线程有自己的 Chromium 与浏览器池（POOL_* 按线程计）
+SCHEDULER_MAX_PENDING_PER_SESSION = 4   # 单个会话排队中的任务上限，超出时向客户端发送 busy 事件
+SCHEDULER_MAX_PENDING = 64         # 所有会话排队中的任务总数上限
+SCHEDULER_DEFAULT_TASK_SECONDS = 5.0    # 尚无耗时记录的任务估算预计等待时间所用的默认耗时（秒）
+
+# 任务取消与预算（见 task_control.py）：run_task 事件可在这些上限内调低；时间与 token 为 0 表示不限制
+TASK_MAX_SECONDS = 300             # 单次任务的墙钟时间上限（秒）
+TASK_MAX_STEPS = 6                 # 单次任务的步数上限
+TASK_MAX_TOKENS = 200000           # 单次任务的模型 token 上限（提供方未返回用量时按回复文本估算）
+BROWSER_CALL_TIMEOUT_MS = 15000    # 任务中单次浏览器调用（截图、导航、等待）的默认超时，不超过剩余时间
+
+# 多进程横向扩展（见 cluster.py）：python cluster.py 启动消息代理与多个服务进程，每个进程有自己的浏览器
+CLUSTER_WORKERS = 0                # 服务进程数；0 表示取 CPU 核数
+CLUSTER_BASE_PORT = 5088           # 第一个服务进程的端口，其余依次递增
+CLUSTER_BROKER_ADDRESS = ("127.0.0.1", 5087)   # 本地消息代理地址；跨机器部署时改为代理所在机器的地址
+# 代理连接的认证密钥没有默认值，只从环境变量 A2I_CLUSTER_AUTHKEY 读取，未设置时代理与节点拒绝启动；
+# 代理会反序列化（unpickle）收到的每条消息，能连上代理端口并通过认证即可在所有节点上执行代码，切勿暴露到公网
+CLUSTER_NODE_CAPACITY = 32         # 单个进程承载的会话数，超过后新会话的浏览器分配到负载更低的进程
+CLUSTER_HEARTBEAT_INTERVAL = 2.0   # 节点心跳间隔（秒）
+CLUSTER_NODE_TIMEOUT = 6.0         # 超过该秒数未收到心跳的节点视为下线
+
+# 执行引擎："thread" 为浏览器工作线程 + 同步 Playwright；"async" 为单事件循环 + 异步 Playwright
+EXECUTION_ENGINE = "thread"
+ASYNC_MAX_CONCURRENT_TASKS = 16    # async 引擎中同时运行的任务上限
+ASYNC_LLM_THREADS = 32             # 用于等待模型响应的线程数（zhipuai SDK 为同步接口）
+
+# 模型响应缓存：按 (任务描述, 规范化提示词, 截图感知哈希) 复用结果
+AI_CACHE_ENABLED = True
+AI_CACHE_MAX_ENTRIES = 512
+AI_CACHE_TTL = 3600                # 秒；0 表示永不过期
+AI_CACHE_HASH_SIZE = 32            # 感知哈希网格边长，越大越能区分细小的画面变化
+AI_CACHE_DIR = None                # 例如 "cache/ai_responses"，设置后缓存写入磁盘，重启后仍可命中
+
+# 页面稳定检测：替代固定等待，DOM 无变化、无进行中请求、无动画时立即返回
+SETTLE_TIMEOUT_MS = 5000           # 单次等待上限
+SETTLE_QUIET_MS = 300              # DOM 连续无变化多久视为稳定
+SETTLE_POLL_MS = 50                # 页面内轮询间隔
+SETTLE_CHECK_FRAMES = False        # 额外要求连续两帧截图完全相同（更稳，但多两次截图）
+
+# 操作计划录制与回放：相同 (URL 模式, 任务) 的成功操作序列直接回放，画面校验失败时才调用模型
+PLAN_CACHE_ENABLED = True
+PLAN_CACHE_DIR = "cache/plans"
+PLAN_CACHE_HASH_SIZE = 16          # 回放校验用的感知哈希网格边长
+PLAN_CACHE_MAX_DISTANCE = 12       # 与录制画面的最大汉明距离，超过则回退到模型
+
+# 模型客户端：长连接复用、并发限制、令牌桶限流与带抖动的重试
+LLM_PROVIDER = "zhipu"             # "zhipu" 或 "openai"（任意 OpenAI 兼容服务，如本地桩服务）
+LLM_BASE_URL = None                # openai 提供方的地址，例如 "http://127.0.0.1:8900/v1"
+LLM_API_KEY = API_KEY
+LLM_TIMEOUT = 120                  # 单次请求超时（秒）
+LLM_MAX_CONNECTIONS = 64           # HTTP 连接池大小
+LLM_MAX_CONCURRENCY = 16           # 全局同时进行的请求数
+LLM_TENANT_CONCURRENCY = 4         # 单个租户（会话）同时进行的请求数
+LLM_RATE_PER_SEC = 5.0             # 令牌桶速率（请求/秒）；0 表示不限流
+LLM_BURST = 10                     # 令牌桶容量
+LLM_MAX_RETRIES = 3                # 限流或临时错误时的最大重试次数
+LLM_BACKOFF_BASE = 1.0             # 指数退避基数（秒）
+LLM_BACKOFF_MAX = 30.0             # 单次退避上限（秒）
+
+# 流式输出：模型每生成一个完整的操作就立即执行，不等待整个回复结束
+AI_STREAMING = True
+
+# 模型回复解析（见 actions.py）：回复不符合操作格式时，把具体错误发回给模型只修正格式（纯文本，不重发截图）
+AI_REPAIR_RETRIES = 1              # 每一步最多修正重问的次数；0 表示不重问，直接报错
+
+# 模型级联：每一步先交给快速视觉模型，输出不符合格式、置信度低或上一步操作没有产生画面变化时，
+# 才改用 MODEL_NAME（推理模型）重新询问；路由结果与各级耗时见 /metrics
+MODEL_CASCADE_ENABLED = True
+FAST_MODEL_NAME = "glm-4v-flash"   # 快速模型，不先推理再回答
+MODEL_CASCADE_MIN_CONFIDENCE = 0.6 # 快速模型任一操作的 confidence 低于该值时升级到推理模型
+
+# 截图存储：按内容哈希寻址，相同画面只保存一份；按总大小与保存时间回收
+SCREENSHOT_DIR = "static/screenshots"
+SCREENSHOT_FORMAT = "png"          # "png"、"webp" 或 "jpeg"（后两者需要 Pillow）
+SCREENSHOT_QUALITY = 80            # webp / jpeg 压缩质量
+SCREENSHOT_MAX_BYTES = 1024 * 1024 * 1024  # 截图目录总大小上限，超过后删除最久未使用的截图
+SCREENSHOT_MAX_AGE = 7 * 24 * 3600  # 截图与运行清单的最长保留时间（秒）；0 表示不按时间回收
+SCREENSHOT_GC_INTERVAL = 300       # 两次回收之间的最小间隔（秒）
+
+# 发送给模型的截图编码档位（见 image_encoding.TIERS），例如 "webp80"、"jpeg75_050"
+AI_IMAGE_TIER = "png"
+
+# 对话历史：之前的步骤压缩为操作摘要，总量不超过预算（估算 token 数）；只有最近几步附带截图
+HISTORY_TOKEN_BUDGET = 2000
+HISTORY_KEEP_IMAGES = 0            # 附带截图的最近步骤数；0 表示历史中不发送截图
+
+# 分段耗时追踪：汇总为 /metrics 上的 Prometheus 直方图，并按任务写出 JSON 追踪文件
+TRACING_ENABLED = True
+TRACE_DIR = "cache/traces"         # 设为 None 时只导出指标，不写追踪文件
+
+# DOM 辅助定位：随截图发送可交互元素列表，执行前把坐标吸附到最近的匹配元素上（见 dom_grounding）
+DOM_GROUNDING_ENABLED = True
+DOM_GROUNDING_MAX_ELEMENTS = 60    # 发送给模型的元素数上限
+DOM_GROUNDING_MARKS = False        # 在发送的截图上绘制元素边框与编号
+DOM_SNAP_RADIUS = 24               # 坐标未落在任何元素内时，吸附到该距离（像素）内最近的元素
+
+# 操作执行：坐标标记由初始化脚本常驻页面并随鼠标事件移动；操作列表可批量派发，中间只在必要时等待页面稳定
+HIGHLIGHT_ENABLED = True
+HIGHLIGHT_DURATION_MS = 1500       # 坐标标记显示时长
+TYPE_FAST_FILL = True              # type 操作用一次 insert_text 填入文字；依赖逐键事件的页面可设为 False
+ACTION_BATCHING = True             # 非流式结果的整个操作列表批量执行，执行完只截图一次
+
+# 操作后截图策略（见 capture.py）：all / final-only / on-visual-change / async（仅异步引擎）；run_task 事件可按次指定
+CAPTURE_POLICY = "all"
+CAPTURE_HASH_SIZE = 32             # on-visual-change 判断画面是否变化所用的感知哈希网格边长
+
+# 操作效果校验（见 effect_verifier.py）：逐像素比较操作前后的截图，判断操作没有效果、局部变化还是整页变化；需要 NumPy 与 Pillow
+EFFECT_VERIFY_ENABLED = True
+EFFECT_VERIFY_ACTIONS = ("click", "double_click", "right_click", "type", "press_key", "swipe", "scroll_to")
+EFFECT_RETRY_ACTIONS = ()          # 没有效果时在本地重新执行的操作类型，默认不重试：画面没变不代表操作没生效，
+                                   # 重复点击可能重复提交或把开关切回去，只对确认幂等的页面开启（如 ("click",)）
+EFFECT_RETRIES = 1                 # 开启时的本地重试次数；仍没有效果时在对话历史中告知模型
+EFFECT_PIXEL_THRESHOLD = 24        # 灰度差超过该值的像素视为变化（忽略抗锯齿等细微差异）
+EFFECT_LOCAL_RADIUS = 64           # 操作点周围参与局部比较的区域半径（截图像素）
+EFFECT_LOCAL_MIN_RATIO = 0.02      # 局部区域内变化像素的比例达到该值视为局部变化
+EFFECT_GLOBAL_MIN_RATIO = 0.005    # 整个视口变化像素的比例达到该值也视为有变化（操作点之外的弹层、提示等）
+EFFECT_NAVIGATION_RATIO = 0.5      # 整个视口变化像素的比例达到该值视为整页变化（跳转、滚动）
+
+# 实时画面：CDP screencast 的 JPEG 帧以二进制 Socket.IO 消息推送给前端（见 screencast.py）
+LIVEVIEW_MAX_FPS = 10              # 每个客户端的帧率上限
+LIVEVIEW_QUALITY = 60              # JPEG 质量
+LIVEVIEW_MAX_WIDTH = 1280          # 帧的最大宽 / 高
+LIVEVIEW_EVERY_NTH_FRAME = 1       # Chromium 每隔几帧发送一帧
+LIVEVIEW_ACK_TIMEOUT = 2.0         # 等待客户端确认上一帧的上限（秒）
+LIVEVIEW_PUMP_INTERVAL = 0.05      # 同步引擎空闲时处理画面帧事件的间隔（秒）
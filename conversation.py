@@ -0,0 +1,133 @@
+# conversation.py
+# 任务执行过程中的对话历史：每一步保存为一对消息
+#   user      : "[步骤 n] ..."（最近 keep_images 步附带当时的截图，更早的步骤省略截图）
+#   assistant : 模型当时返回的操作，压缩为紧凑的 JSON
+# 生成请求时从最新的步骤往前取，总量不超过 token 预算；更早的步骤直接丢弃。
+# 固定的系统提示词由 ai_handler 放在最前面，不计入这里的预算。
+# 模型级联需要判断上一步的操作是否产生了画面变化：优先使用本地效果校验的结果（见 effect_verifier），
+# 没有校验结果时比较前后两步输入截图的感知哈希。
+import json
+import re
+from collections import defaultdict
+
+from config import HISTORY_TOKEN_BUDGET, HISTORY_KEEP_IMAGES, AI_IMAGE_TIER, MODEL_CASCADE_ENABLED, CAPTURE_HASH_SIZE
+from ai_cache import image_hash
+from effect_verifier import NO_EFFECT
+from image_encoding import encode_image, to_data_url
+
+_CJK = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uff00-\uffef]")
+# 视觉模型通常按 28x28 像素的图块计算图像 token
+IMAGE_PATCH_PIXELS = 28 * 28
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中日韩字符按 1 个计，其余字符约 4 个计 1 个"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def summarize_result(result):
+    """把 call_ai 的结果压缩为一条简短的 assistant 消息内容"""
+    status = result.get("status")
+    if status == "done":
+        return "目标完成"
+    if status == "error":
+        return f"（本步骤模型输出无法使用：{str(result.get('error'))[:120]}）"
+    # 操作还原为模型格式的字典（坐标保留 4 位小数）
+    return json.dumps([action.to_dict() for action in result.get("data") or ()], ensure_ascii=False,
+                      separators=(",", ":"))
+
+
+def _frame_hash(img_bytes):
+    # 只有模型级联需要比较前后画面，未启用时不计算哈希
+    if not MODEL_CASCADE_ENABLED or img_bytes is None:
+        return None
+    return image_hash(img_bytes, CAPTURE_HASH_SIZE)
+
+
+class ConversationHistory:
+    """按 token 预算裁剪的步骤历史。
+
+    用法：每一步调用 call_ai(..., history.messages())，拿到结果后调用
+    history.add_step(step, result, img_bytes)；操作执行失败时调用 history.note_failure(step, ...)
+    （流式执行时操作可能先于 add_step 执行，因此按步骤号记录）。
+    """
+
+    def __init__(self, token_budget=HISTORY_TOKEN_BUDGET, keep_images=HISTORY_KEEP_IMAGES, tier=AI_IMAGE_TIER):
+        self.token_budget = token_budget
+        self.keep_images = keep_images
+        self.tier = tier
+        self.steps = []   # {"step", "status", "summary", "frame_hash", "img_bytes", "image_url", "image_tokens"}
+        self.notes = defaultdict(list)  # 步骤号 -> 执行失败等说明
+        self.effects = defaultdict(list)  # 步骤号 -> 各次效果校验的结果（effect_verifier.Effect.kind）
+
+    def add_step(self, step, result, img_bytes=None):
+        self.steps.append({
+            "step": step,
+            "status": result.get("status"),
+            "summary": summarize_result(result),
+            "frame_hash": _frame_hash(img_bytes),
+            # 只有可能附带截图的最近几步才保留截图字节
+            "img_bytes": img_bytes if self.keep_images else None,
+            "image_url": None,
+            "image_tokens": 0,
+        })
+        for old in self.steps[:-self.keep_images or None]:
+            old["img_bytes"] = old["image_url"] = None
+
+    def previous_step_had_no_effect(self, img_bytes):
+        """上一步执行了操作，但没有产生画面变化：校验过的操作全部没有效果，
+        或（没有校验结果时）当前截图与上一步的输入截图相同"""
+        if not self.steps or self.steps[-1]["status"] != "action":
+            return False
+        effects = self.effects.get(self.steps[-1]["step"])
+        if effects:
+            return all(kind == NO_EFFECT for kind in effects)
+        frame_hash = self.steps[-1]["frame_hash"]
+        return frame_hash is not None and frame_hash == _frame_hash(img_bytes)
+
+    def note_effect(self, step, kind):
+        """记录指定步骤中一次操作效果校验的结果"""
+        self.effects[step].append(kind)
+
+    def note_failure(self, step, message):
+        """为指定步骤追加执行失败的说明，例如某个操作参数无效"""
+        self.notes[step].append(message)
+
+    def _image(self, entry):
+        if entry["image_url"] is None and entry["img_bytes"] is not None:
+            encoded = encode_image(entry["img_bytes"], self.tier)
+            entry["image_url"] = to_data_url(encoded)
+            entry["image_tokens"] = encoded.width * encoded.height // IMAGE_PATCH_PIXELS
+        return entry["image_url"]
+
+    def _step_messages(self, entry, with_image):
+        text = f"[步骤 {entry['step']}] 当时的截图{'如下' if with_image else '已省略'}。"
+        if self.notes.get(entry["step"]):
+            text += " 执行结果：" + "；".join(self.notes[entry["step"]])
+        if with_image:
+            content = [{"type": "image_url", "image_url": {"url": self._image(entry)}},
+                       {"type": "text", "text": text}]
+            tokens = estimate_tokens(text) + entry["image_tokens"]
+        else:
+            content = text
+            tokens = estimate_tokens(text)
+        tokens += estimate_tokens(entry["summary"])
+        return [{"role": "user", "content": content},
+                {"role": "assistant", "content": entry["summary"]}], tokens
+
+    def messages(self):
+        """返回预算内的历史消息（按时间顺序）"""
+        selected = []
+        used = 0
+        for age, entry in enumerate(reversed(self.steps)):
+            with_image = age < self.keep_images and entry["img_bytes"] is not None
+            step_messages, tokens = self._step_messages(entry, with_image)
+            if with_image and used + tokens > self.token_budget:
+                # 带截图超出预算时退化为只保留文字摘要
+                step_messages, tokens = self._step_messages(entry, False)
+            if used + tokens > self.token_budget:
+                break
+            selected[:0] = step_messages
+            used += tokens
+        return selected
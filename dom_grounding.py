@@ -0,0 +1,135 @@
+# dom_grounding.py
+# DOM 辅助定位：截图时用一次 page.evaluate 收集视口内可见的可交互元素（位置、角色、名称），
+# 以紧凑列表随截图发送给模型（可选在截图上绘制编号），执行操作前把模型返回的坐标
+# 吸附到最近的匹配元素上，减少“差几个像素点空”导致的无效点击和额外一轮模型调用。
+import io
+from collections import namedtuple
+
+from config import DOM_SNAP_RADIUS
+
+try:
+    from PIL import Image, ImageDraw
+except ImportError:  # 没有 Pillow 时不绘制编号，只发送文字列表
+    Image = ImageDraw = None
+
+# 元素位置为视口内的 CSS 像素（左上角 + 宽高，已裁剪到视口范围内）
+Element = namedtuple("Element", ["id", "role", "label", "left", "top", "width", "height", "editable"])
+
+# 会把坐标吸附到元素上的操作；type 只吸附到可输入的元素
+SNAP_ACTIONS = ("click", "double_click", "right_click", "hover", "type")
+
+# 参数为元素数上限，返回 [role, label, left, top, width, height, editable] 列表（按文档顺序）
+ELEMENT_MAP_JS = r"""
+(maxElements) => {
+    const selector = [
+        "a[href]", "button", "input:not([type=hidden])", "select", "textarea", "summary",
+        "[role=button]", "[role=link]", "[role=checkbox]", "[role=radio]", "[role=tab]", "[role=menuitem]",
+        "[role=option]", "[role=switch]", "[role=textbox]", "[role=combobox]",
+        "[contenteditable='']", "[contenteditable=true]", "[onclick]", "[tabindex]:not([tabindex='-1'])",
+    ].join(",");
+    const nonText = ["button", "submit", "reset", "checkbox", "radio", "file", "image", "range", "color"];
+    const vw = window.innerWidth, vh = window.innerHeight;
+    const out = [];
+    for (const el of document.querySelectorAll(selector)) {
+        const r = el.getBoundingClientRect();
+        const left = Math.max(0, r.left), top = Math.max(0, r.top);
+        const right = Math.min(vw, r.right), bottom = Math.min(vh, r.bottom);
+        if (right - left < 2 || bottom - top < 2) continue;
+        const style = getComputedStyle(el);
+        if (style.visibility === "hidden" || style.pointerEvents === "none" || Number(style.opacity) === 0) continue;
+        // 被其他元素遮挡的跳过（点击也点不到它）；<label> 遮住对应输入框时不算遮挡
+        const hit = document.elementFromPoint((left + right) / 2, (top + bottom) / 2);
+        if (hit && hit !== el && !el.contains(hit) && hit.control !== el) continue;
+
+        const tag = el.tagName.toLowerCase();
+        const type = (el.getAttribute("type") || "").toLowerCase();
+        const editable = el.isContentEditable || tag === "textarea" || (tag === "input" && !nonText.includes(type));
+        const role = el.getAttribute("role") || (tag === "a" ? "link" : tag === "select" ? "combobox"
+            : editable ? "textbox" : tag === "input" ? (type || "input") : tag);
+        // 输入框的当前值可能是密码等敏感内容，不作为名称发送
+        const label = (el.getAttribute("aria-label") || (el.labels && el.labels[0] && el.labels[0].innerText)
+            || el.getAttribute("placeholder") || el.getAttribute("alt") || el.getAttribute("title")
+            || (tag === "input" && !editable ? el.value : "") || (editable ? "" : el.innerText) || "")
+            .replace(/\s+/g, " ").trim().slice(0, 40);
+        out.push([role, label, Math.round(left), Math.round(top), Math.round(right - left),
+                  Math.round(bottom - top), Boolean(editable)]);
+        if (out.length >= maxElements) break;
+    }
+    return out;
+}
+"""
+
+
+def parse_elements(raw):
+    """把 ELEMENT_MAP_JS 的返回值转换为 Element 列表，编号从 1 开始"""
+    return [Element(index, *item) for index, item in enumerate(raw or [], 1)]
+
+
+def center(element):
+    return element.left + element.width / 2, element.top + element.height / 2
+
+
+def format_element_map(elements, width, height):
+    """元素列表的紧凑文本形式：编号、角色、名称与中心点归一化坐标（与模型返回的坐标同一坐标系）"""
+    lines = []
+    for element in elements:
+        cx, cy = center(element)
+        label = f' "{element.label}"' if element.label else ""
+        lines.append(f"[{element.id}] {element.role}{label} ({cx / width:.4f}, {cy / height:.4f})")
+    return "\n".join(lines)
+
+
+def _distance(element, x, y):
+    """点到元素矩形的距离（点在矩形内时为 0）"""
+    dx = max(element.left - x, 0, x - (element.left + element.width))
+    dy = max(element.top - y, 0, y - (element.top + element.height))
+    return (dx * dx + dy * dy) ** 0.5
+
+
+def snap_point(elements, x, y, editable_only=False, radius=DOM_SNAP_RADIUS):
+    """返回应吸附到的元素；点已落在某个候选元素内或附近没有元素时返回 None"""
+    candidates = [e for e in elements if e.editable or not editable_only]
+    if not candidates or any(_distance(e, x, y) == 0 for e in candidates):
+        return None
+    nearest = min(candidates, key=lambda e: _distance(e, x, y))
+    return nearest if _distance(nearest, x, y) <= radius else None
+
+
+def snap_action(action, elements, width, height):
+    """按元素列表修正操作坐标，返回 (actions.Action, 吸附到的元素或 None)。
+
+    模型通过 "element" 字段引用编号时直接使用该元素中心；否则坐标未落在任何匹配元素内、
+    且距离最近的元素不超过 DOM_SNAP_RADIUS 像素时，改为该元素中心。
+    """
+    if not elements or action.kind not in SNAP_ACTIONS:
+        return action, None
+
+    target = None
+    if action.element is not None:
+        target = next((e for e in elements if str(e.id) == str(action.element)), None)
+    if target is None:
+        x, y = action.points[0]
+        target = snap_point(elements, x * width, y * height, editable_only=action.kind == "type")
+    if target is None:
+        return action, None
+
+    cx, cy = center(target)
+    return action._replace(points=((round(cx / width, 4), round(cy / height, 4)),)), target
+
+
+def draw_marks(png_bytes, elements):
+    """在截图上为每个元素绘制边框和编号（set-of-marks），返回 PNG 字节；没有 Pillow 时原样返回"""
+    if Image is None or not elements:
+        return png_bytes
+    image = Image.open(io.BytesIO(png_bytes)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for element in elements:
+        box = (element.left, element.top, element.left + element.width - 1, element.top + element.height - 1)
+        draw.rectangle(box, outline=(255, 0, 80), width=2)
+        tag = str(element.id)
+        tag_box = (element.left, element.top, element.left + 7 * len(tag) + 4, element.top + 12)
+        draw.rectangle(tag_box, fill=(255, 0, 80))
+        draw.text((element.left + 2, element.top), tag, fill=(255, 255, 255))
+    out = io.BytesIO()
+    image.save(out, format="PNG")
+    return out.getvalue()
@@ -0,0 +1,160 @@
+# effect_verifier.py
+# 操作效果的本地校验：用 NumPy 向量化地逐像素比较操作前后的两帧截图，几毫秒内判断操作是否生效，不必等下一步交给模型：
+#   no_effect   操作点附近与整个视口都没有明显变化（点击落空、页面尚未可交互等）
+#   local       局部变化（输入框出现文字、勾选、展开菜单、操作点之外的提示等）
+#   navigation  视口大部分像素变化（页面跳转、滚动、全屏弹层）
+# 没有效果时在对话历史中注明，下一步直接询问推理模型（见 ai_handler 的模型级联）；
+# 本地重新执行默认关闭，只对 EFFECT_RETRY_ACTIONS 中显式开启的操作类型生效（重复执行可能有副作用）。
+# 基准帧与校验用的截图都隐藏坐标标记（见 ui_operator.HIDE_OVERLAY_CSS），否则标记本身就会被当成操作点附近的变化。
+import io
+import logging
+from collections import Counter, namedtuple
+
+from config import (
+    EFFECT_VERIFY_ENABLED,
+    EFFECT_VERIFY_ACTIONS,
+    EFFECT_RETRY_ACTIONS,
+    EFFECT_RETRIES,
+    EFFECT_PIXEL_THRESHOLD,
+    EFFECT_LOCAL_RADIUS,
+    EFFECT_LOCAL_MIN_RATIO,
+    EFFECT_GLOBAL_MIN_RATIO,
+    EFFECT_NAVIGATION_RATIO,
+)
+from tracing import span, metrics
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:  # NumPy 与 Pillow 为可选依赖，缺失时不做校验
+    np = None
+
+logger = logging.getLogger(__name__)
+
+NO_EFFECT = "no_effect"
+LOCAL = "local"
+NAVIGATION = "navigation"
+
+# local_ratio / global_ratio 为操作点附近、整个视口中变化像素的比例
+Effect = namedtuple("Effect", ["kind", "local_ratio", "global_ratio"])
+
+
+def decode_gray(img_bytes):
+    """把截图解码为灰度 uint8 数组（高 x 宽）"""
+    with Image.open(io.BytesIO(img_bytes)) as img:
+        return np.asarray(img.convert("L"))
+
+
+def changed_mask(before, after, threshold=EFFECT_PIXEL_THRESHOLD):
+    """逐像素比较两帧灰度数组，返回变化像素的布尔掩码（转为 int16 再相减，避免 uint8 回绕）"""
+    return np.abs(after.astype(np.int16) - before) > threshold
+
+
+def local_ratio(mask, point, radius=EFFECT_LOCAL_RADIUS):
+    """归一化坐标 point 周围边长 2*radius 的区域内变化像素的比例"""
+    height, width = mask.shape
+    x, y = int(point[0] * width), int(point[1] * height)
+    region = mask[max(y - radius, 0):y + radius, max(x - radius, 0):x + radius]
+    return float(region.mean()) if region.size else 0.0
+
+
+def classify(before, after, points=()):
+    """比较操作前后的两帧灰度数组，返回 Effect；points 为操作的归一化坐标点（可以为空）"""
+    if before.shape != after.shape:
+        # 视口尺寸变化，无法逐像素比较
+        return Effect(NAVIGATION, 1.0, 1.0)
+    mask = changed_mask(before, after)
+    global_ratio = float(mask.mean())
+    local = max((local_ratio(mask, point) for point in points), default=0.0)
+    if global_ratio >= EFFECT_NAVIGATION_RATIO:
+        kind = NAVIGATION
+    elif local >= EFFECT_LOCAL_MIN_RATIO or global_ratio >= EFFECT_GLOBAL_MIN_RATIO:
+        kind = LOCAL
+    else:
+        kind = NO_EFFECT
+    return Effect(kind, round(local, 4), round(global_ratio, 4))
+
+
+class EffectVerifier:
+    """一次运行内的操作效果校验，用法与 capture.CapturePolicy 类似：
+
+    每一步开始时 seed(不含坐标标记的截图)；执行一个（或一批）操作后 wants(actions) 为真时调用
+    verify（异步任务循环用 verify_async）：截图、比较、按需在本地重试，并把结果记入对话历史。
+    比较基准随每次 check 更新为最新的一帧。
+    """
+
+    def __init__(self, enabled=EFFECT_VERIFY_ENABLED, retries=EFFECT_RETRIES):
+        self.enabled = enabled and np is not None
+        self.retries = retries
+        self._frame = None    # 比较基准：最近一帧截图的字节
+        self._pixels = None   # 基准的灰度数组，第一次比较时才解码
+        self.counters = Counter()
+
+    def seed(self, img_bytes):
+        """记录一步开始时不含坐标标记的截图，作为第一个操作的比较基准"""
+        self._frame, self._pixels = img_bytes, None
+
+    def wants(self, actions):
+        """这些操作执行后是否需要校验效果（悬停、等待等本来就可能没有画面变化的操作不校验）"""
+        return self.enabled and self._frame is not None and any(
+            action.kind in EFFECT_VERIFY_ACTIONS for action in actions)
+
+    def check(self, actions, img_bytes):
+        """比较基准与操作后的截图，返回 Effect，并把基准更新为这一帧"""
+        with span("effect.verify", actions=len(actions)) as verify_span:
+            if self._pixels is None:
+                self._pixels = decode_gray(self._frame)
+            after = decode_gray(img_bytes)
+            effect = classify(self._pixels, after, [point for action in actions for point in action.points])
+            verify_span.set(effect=effect.kind, local_ratio=effect.local_ratio, global_ratio=effect.global_ratio)
+        self._frame, self._pixels = img_bytes, after
+        self.counters[effect.kind] += 1
+        metrics.inc(f"a2i_action_effect_{effect.kind}_total")
+        return effect
+
+    def should_retry(self, actions, effect, attempt=0):
+        """没有效果的单个操作是否在本地重新执行（只重试 EFFECT_RETRY_ACTIONS 中显式开启的操作类型，最多 retries 次）"""
+        if (effect.kind != NO_EFFECT or attempt >= self.retries or len(actions) != 1
+                or actions[0].kind not in EFFECT_RETRY_ACTIONS):
+            return False
+        self.counters["retried"] += 1
+        metrics.inc("a2i_action_effect_retries_total")
+        return True
+
+    def verify(self, actions, screenshot, execute, history, step, label):
+        """校验操作效果并记入对话历史，返回 Effect。
+
+        screenshot() 返回不含坐标标记的截图，execute(action) 在本地重新执行单个操作；
+        step 为从 1 开始的步骤号，label 为写入历史与日志的操作描述。
+        """
+        effect = self.check(actions, screenshot())
+        attempt = 0
+        while self.should_retry(actions, effect, attempt):
+            attempt += 1
+            logger.info(f"{label} had no visible effect, executing it again.")
+            execute(actions[0])
+            effect = self.check(actions, screenshot())
+        self._note(history, step, label, effect)
+        return effect
+
+    async def verify_async(self, actions, screenshot, execute, history, step, label):
+        """verify 的异步版本：screenshot 与 execute 为协程函数"""
+        effect = self.check(actions, await screenshot())
+        attempt = 0
+        while self.should_retry(actions, effect, attempt):
+            attempt += 1
+            logger.info(f"{label} had no visible effect, executing it again.")
+            await execute(actions[0])
+            effect = self.check(actions, await screenshot())
+        self._note(history, step, label, effect)
+        return effect
+
+    @staticmethod
+    def _note(history, step, label, effect):
+        """把效果记入对话历史；没有效果时作为失败说明告知模型"""
+        history.note_effect(step, effect.kind)
+        if effect.kind == NO_EFFECT:
+            history.note_failure(step, f"{label}执行后画面没有变化")
+
+    def stats(self):
+        return {"enabled": self.enabled, **self.counters}
@@ -1,7 +1,11 @@
 # global_operator.py (优化后完整代码)
-from ui_operator import UIOperator
+from browser_pool import BrowserPool, PoolExhaustedError
+from tracing import span, observe
+from screencast import live_view
+from scheduler import FairScheduler, task_name
+from storage_state import get_state_store
+from config import LIVEVIEW_PUMP_INTERVAL, SCHEDULER_WORKERS, POOL_PREWARM
 import threading
-import queue
 import time
 import logging
 
@@ -16,210 +20,322 @@ logger = logging.getLogger(__name__)
 # --- 配置日志结束 ---
 
 
+DEFAULT_SESSION = "default"
+
+
 class BrowserManager:
-    def __init__(self):
-        self.operator = None
+    """按会话管理浏览器：同一工作线程的会话共享一个 Chromium，每个会话独占一个 context"""
+
+    def __init__(self, pool=None):
+        self.pool = pool or BrowserPool()
         # 使用 RLock 以增强安全性，允许同一线程多次获取锁
         self.lock = threading.RLock()
-        self.current_url = None
+        self.current_urls = {}  # session_id -> 最近一次导航的 URL
+        self.profiles = {}      # session_id -> 凭据档案（登录状态按 站点 + 档案 保存；没有档案的会话不保存）
 
-    def start_browser(self, url):
-        """启动浏览器并访问指定URL"""
-        logger.info(f"Attempting to start browser for URL: {url}")
+    def start_browser(self, url, session_id=DEFAULT_SESSION, profile=None):
+        """为会话分配浏览器 context 并访问指定URL；该站点与档案有保存的登录状态时一并恢复"""
+        logger.info(f"Attempting to start browser for session {session_id}, URL: {url}")
         with self.lock:
-            # 确保在创建新实例前，旧实例已被尽可能关闭和清理
-            self._internal_close() # 调用内部健壮的关闭方法
+            # 同一会话重复启动时，先关闭它自己的旧 context，不影响其他会话
+            self._internal_close(session_id)
             try:
-                # 创建新的浏览器实例
-                # 注意：传递 target_url=None, 然后调用 navigate_to(url) 是合理的
-                # 如果 UIOperator 构造函数可以直接接受 URL 并导航，也可以考虑直接传入
-                self.operator = UIOperator(target_url=None, headless=True)
-                logger.debug("UIOperator instance created.")
-                self.operator.navigate_to(url)
+                store = get_state_store()
+                state = store.load(url, profile) if store else None
+                with span("session.start", restored=state is not None):
+                    operator = self.pool.acquire(session_id, storage_state=state)
+                    logger.debug("Pooled context acquired.")
+                    operator.navigate_to(url)
                 logger.debug(f"Navigated to {url}")
-                self.current_url = url
+                self.current_urls[session_id] = url
+                self.profiles[session_id] = profile
                 logger.info("Browser started successfully.")
-                return True, "浏览器启动成功"
+                return True, "浏览器启动成功（已恢复登录状态）" if state else "浏览器启动成功"
+            except PoolExhaustedError as e:
+                logger.warning(str(e))
+                return False, f"启动浏览器失败: {e}"
             except Exception as e:
                 # 记录详细错误
                 error_msg = f"启动浏览器失败: {str(e)}"
                 logger.error(error_msg, exc_info=True) # exc_info=True 记录堆栈跟踪
                 # 确保失败时清理状态
-                self._internal_close() # 再次尝试清理，确保状态干净
+                self._internal_close(session_id) # 再次尝试清理，确保状态干净
                 return False, error_msg
 
-    def get_operator(self):
-        """获取当前浏览器操作器"""
+    def get_operator(self, session_id=DEFAULT_SESSION):
+        """获取会话对应的浏览器操作器"""
         with self.lock:
-            logger.debug(f"get_operator called. Operator exists: {self.operator is not None}")
-            return self.operator
+            operator = self.pool.get(session_id)
+            logger.debug(f"get_operator called for {session_id}. Operator exists: {operator is not None}")
+            return operator
 
-    def _internal_close(self):
-        """内部方法：健壮地关闭浏览器并清理状态。
+    def _internal_close(self, session_id):
+        """内部方法：关闭会话的 context 并清理状态。
            此方法应在已持有 self.lock 的情况下被调用。
         """
-        logger.debug("Internal close initiated.")
-        if self.operator:
-            try:
-                logger.debug("Attempting to close UIOperator...")
-                # 尝试正常关闭
-                self.operator.close()
-                logger.debug("UIOperator closed successfully (or close() returned).")
-            except Exception as e:
-                # 捕获所有异常，记录但不中断流程，确保状态被清理
-                logger.warning(f"Exception occurred during operator.close(): {e}", exc_info=True)
-                # 如果问题持续，需要检查 UIOperator 的具体实现，
-                # 看是否需要更细致的资源清理（如 page, context）。
-            finally:
-                # *** 关键点：无论 close() 成功与否，都必须清理引用 ***
-                self.operator = None
-                self.current_url = None
-                logger.debug("Operator reference and current_url cleared.")
+        logger.debug(f"Internal close initiated for session {session_id}.")
+        # release() 内部已捕获 close() 的异常，这里只需清理 URL 记录
+        if self.pool.release(session_id):
+            logger.debug("Pooled context closed.")
         else:
             logger.debug("No operator to close.")
+        self._forget(session_id)
+
+    def _forget(self, session_id):
+        """清理会话的 URL 与档案记录（context 已关闭或已被浏览器池移除）"""
+        self.current_urls.pop(session_id, None)
+        self.profiles.pop(session_id, None)
 
-    def close_operator(self):
-        """关闭浏览器"""
-        logger.info("Close operator requested.")
+    def close_operator(self, session_id=DEFAULT_SESSION):
+        """关闭会话的浏览器 context"""
+        logger.info(f"Close operator requested for session {session_id}.")
         with self.lock:
-            # 调用内部健壮的关闭方法
-            self._internal_close()
+            self._internal_close(session_id)
         logger.info("Close operator completed.")
 
-    def is_browser_running(self):
-        """检查浏览器是否正在运行"""
+    def is_browser_running(self, session_id=DEFAULT_SESSION):
+        """检查会话的浏览器是否正在运行"""
         with self.lock:
-            # 简单检查 operator 实例是否存在
-            running = self.operator is not None
-            logger.debug(f"Is browser running? {running}")
+            # 只检查会话是否持有 context，不调用 Playwright（可在任意线程调用）
+            running = self.pool.has_session(session_id)
+            logger.debug(f"Is browser running for {session_id}? {running}")
             return running
 
+    def save_storage_state(self, session_id=DEFAULT_SESSION):
+        """保存会话当前的登录状态（cookie 与 localStorage），需在浏览器线程中调用；返回是否已保存"""
+        store = get_state_store()
+        with self.lock:
+            operator = self.pool.get(session_id)
+            url = self.current_urls.get(session_id)
+            profile = self.profiles.get(session_id)
+            if store is None or operator is None or url is None or not profile:
+                return False
+            try:
+                state = operator.context.storage_state()
+            except Exception as e:
+                logger.warning(f"Failed to read storage state for session {session_id}: {e}")
+                return False
+            store.save(url, profile, state)
+            return True
 
-# 全局浏览器管理器
-browser_manager = BrowserManager()
+    def prewarm(self):
+        """启动 Chromium 并预热 context，需在浏览器线程中调用"""
+        with self.lock:
+            try:
+                self.pool.prewarm()
+            except Exception as e:
+                logger.warning(f"Browser pool prewarm failed: {e}", exc_info=True)
 
-# 全局任务队列和工作线程
-task_queue = queue.Queue()
-browser_thread = None  # 显式初始化为 None
-browser_thread_running = False
+    def pump_events(self, session_ids):
+        """让 Playwright 处理积压的事件（例如实时画面帧），需在浏览器线程中调用。
 
+        同步 API 只在调用期间分发事件；所有会话共用一个连接，对任一页面的一次短等待即可分发全部事件。
+        """
+        with self.lock:
+            for session_id in session_ids:
+                session = self.pool.sessions.get(session_id)  # 不刷新空闲时间，观看实时画面不算使用
+                if session is None:
+                    continue
+                try:
+                    session.operator.page.wait_for_timeout(1)
+                except Exception as e:
+                    logger.debug(f"Event pump failed for session {session_id}: {e}")
+                return
 
-def browser_worker():
-    """浏览器操作工作线程"""
-    global browser_thread_running
-    logger.info("Browser worker thread started.")
-    while browser_thread_running:
-        try:
-            # 使用 timeout 避免无限期阻塞，以便能响应 browser_thread_running 状态变化
-            task = task_queue.get(timeout=1)
-            if task is None:  # 停止信号
-                logger.info("Stop signal received in browser worker.")
-                task_queue.task_done()
-                break
-            func, args, kwargs, callback = task
+    def maintain(self):
+        """空闲回收、健康检查与预热，需在浏览器线程中调用"""
+        with self.lock:
             try:
-                logger.debug(f"Executing task: {func.__name__ if hasattr(func, '__name__') else 'lambda/anonymous'}")
-                result = func(*args, **kwargs)
-                if callback:
-                    logger.debug("Calling success callback.")
-                    callback(result, None)
+                removed = self.pool.maintain()
             except Exception as e:
-                logger.error(f"Error executing task: {e}", exc_info=True)
-                if callback:
-                    logger.debug("Calling error callback.")
-                    callback(None, e)
-            finally:
-                task_queue.task_done()
-                logger.debug("Task done.")
-        except queue.Empty:
-            # 队列超时，继续循环检查 browser_thread_running
-            continue
-        except Exception as e:
-            logger.critical(f"Unexpected error in browser worker thread: {e}", exc_info=True)
+                logger.warning(f"Browser pool maintenance failed: {e}", exc_info=True)
+                return
+            # 空闲回收与健康检查移除的会话与 _internal_close 一样清理状态，之后不会再按旧的 URL 与档案保存登录状态
+            for session_id in removed:
+                self._forget(session_id)
+
+    def shutdown(self):
+        """关闭所有会话以及共享的 Chromium 进程"""
+        with self.lock:
+            self.pool.close_all()
+            self.current_urls.clear()
+            self.profiles.clear()
+
+
+# 全局公平调度器：每个会话一个队列，多个浏览器工作线程轮询取任务（见 scheduler.py）
+scheduler = FairScheduler()
+_local = threading.local()  # 工作线程中保存其 BrowserWorker，全局函数据此找到本线程的管理器
+
+
+class BrowserWorker:
+    """浏览器工作线程：独占一个 BrowserManager（自己的 Chromium 进程），只执行亲和到自己的会话的任务。
+
+    同步 Playwright 对象只能在创建它们的线程中使用，所以每个线程各管一个浏览器池，
+    会话由调度器固定分配到第一次执行它的线程上。
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.manager = BrowserManager()
+        self.thread = None
+
+    def is_alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=f"browser-worker-{self.index}", daemon=True)
+        self.thread.start()
+        logger.debug(f"Browser worker {self.index} started. Thread ID: {self.thread.ident}")
+
+    def run(self):
+        _local.worker = self
+        logger.info(f"Browser worker {self.index} thread started.")
+        if POOL_PREWARM:
+            self.manager.prewarm()
+        while True:
             try:
-                task_queue.task_done()
-            except ValueError:
-                # task_done() called too many times, ignore
-                pass
-    logger.info("Browser worker thread stopped.")
+                # 使用 timeout 以便空闲时维护浏览器池；有客户端观看实时画面时缩短等待，及时处理画面帧
+                task = scheduler.next_task(self.index, timeout=LIVEVIEW_PUMP_INTERVAL if live_view.active else 1)
+            except StopIteration:
+                logger.info(f"Stop signal received in browser worker {self.index}.")
+                break
+            if task is None:
+                # 空闲时顺便维护浏览器池（只处理本线程的会话）
+                if live_view.active:
+                    self.manager.pump_events(live_view.session_ids())
+                self.manager.maintain()
+                continue
+            self.execute(task)
+        # Playwright 对象只能在创建它们的线程中关闭
+        try:
+            self.manager.shutdown()
+        except Exception as e:
+            logger.warning(f"Browser worker {self.index} shutdown failed: {e}", exc_info=True)
+        logger.info(f"Browser worker {self.index} thread stopped.")
+
+    def execute(self, task):
+        # 任务在队列中的等待时间（排在其他会话的任务之后）
+        observe("queue.wait", time.perf_counter() - task.enqueued_at)
+        name = task_name(task.func)
+        try:
+            logger.debug(f"Executing task {name} for session {task.session_id} on worker {self.index}")
+            with span(f"queue.task.{name}"):
+                result = task.func(*task.args, **task.kwargs)
+            if task.callback:
+                logger.debug("Calling success callback.")
+                task.callback(result, None)
+        except Exception as e:
+            logger.error(f"Error executing task: {e}", exc_info=True)
+            if task.callback:
+                logger.debug("Calling error callback.")
+                task.callback(None, e)
+        finally:
+            # 会话不再占用本线程的浏览器时解除亲和，之后的任务可由任意工作线程接手
+            scheduler.task_done(task, release=not self.manager.is_browser_running(task.session_id))
+            logger.debug("Task done.")
+
+
+workers = [BrowserWorker(index) for index in range(max(SCHEDULER_WORKERS, 1))]
+browser_thread_running = False
+_workers_lock = threading.Lock()
 
 
 def start_browser_thread():
-    """启动浏览器工作线程"""
-    global browser_thread, browser_thread_running
-    # *** 关键修复 ***
-    # 检查线程是否真的可以启动：
-    # 1. 标志位为 False
-    # 2. 线程引用为 None (从未启动或已清理)
-    # 3. 线程引用不为 None 但线程已死 (异常退出)
-    # 只要满足以上任一条件，就认为需要/可以启动新线程
-    if not browser_thread_running or browser_thread is None or not browser_thread.is_alive():
-        logger.info("Starting browser worker thread.")
+    """启动浏览器工作线程（已在运行的不重复启动，异常退出的重新启动）"""
+    global browser_thread_running
+    with _workers_lock:
+        if browser_thread_running and all(worker.is_alive() for worker in workers):
+            logger.debug("Browser worker threads are already running.")
+            return
+        logger.info(f"Starting {len(workers)} browser worker threads.")
         browser_thread_running = True
-        # 总是创建一个新的 Thread 对象，确保状态干净
-        browser_thread = threading.Thread(target=browser_worker, daemon=True)
-        browser_thread.start()
-        logger.debug(f"New browser thread started. Thread ID: {browser_thread.ident}")
-    else:
-        logger.debug("Browser worker thread is already running.")
+        scheduler.start()
+        for worker in workers:
+            if not worker.is_alive():
+                worker.start()
 
 
 def stop_browser_thread():
-    """停止浏览器工作线程"""
-    global browser_thread, browser_thread_running
-    if browser_thread_running:
-        logger.info("Stopping browser worker thread.")
+    """停止浏览器工作线程：已提交的任务执行完后，各线程关闭自己的浏览器并退出"""
+    global browser_thread_running
+    with _workers_lock:
+        if not browser_thread_running:
+            logger.debug("Browser worker threads were not running or already stopped.")
+            return
+        logger.info("Stopping browser worker threads.")
         browser_thread_running = False
-        task_queue.put(None)  # 发送停止信号
-        if browser_thread:
-            logger.debug(f"Joining browser thread (ID: {browser_thread.ident})...")
-            browser_thread.join(timeout=5) # 等待线程结束，最多等待5秒
-            if browser_thread.is_alive():
-                logger.warning("Browser worker thread did not stop gracefully within timeout.")
-            else:
-                logger.info("Browser worker thread joined successfully.")
-            # *** 关键修复点：清理线程引用 ***
-            # 这是允许 start_browser_thread 在下次需要时创建一个全新线程的关键
-            browser_thread = None
-            logger.debug("Browser thread reference cleared.")
-    else:
-        logger.debug("Browser worker thread was not running or already stopped.")
-
-
-def execute_in_browser_thread(func, *args, callback=None, **kwargs):
-    """在浏览器线程中执行任务"""
-    logger.debug(f"execute_in_browser_thread called for function: {getattr(func, '__name__', 'unknown')}")
+        scheduler.stop()
+        for worker in workers:
+            if worker.thread is None:
+                continue
+            worker.thread.join(timeout=5)  # 每个线程最多等待5秒
+            if worker.thread.is_alive():
+                logger.warning(f"Browser worker {worker.index} did not stop gracefully within timeout.")
+            worker.thread = None
+
+
+def execute_in_browser_thread(func, *args, callback=None, session_id=DEFAULT_SESSION, bounded=True, **kwargs):
+    """在浏览器线程中执行任务：按 session_id 排队，公平调度到该会话所在的工作线程。
+
+    返回排队信息 {"position", "eta_s", "pending"}；bounded=True 且队列已满时抛出 SchedulerBusy，
+    关闭浏览器等清理任务应传 bounded=False。
+    """
+    logger.debug(f"execute_in_browser_thread called for function: {task_name(func)}")
     # 确保浏览器线程正在运行
-    start_browser_thread() # 这个函数现在能正确处理重启
-    # 将任务放入队列
-    task_queue.put((func, args, kwargs, callback))
-    logger.debug("Task put into queue.")
+    start_browser_thread()
+    info = scheduler.submit(session_id, func, args, kwargs, callback=callback, bounded=bounded)
+    logger.debug(f"Task queued for session {session_id}: {info}")
+    return info
+
+
+def current_manager(session_id=DEFAULT_SESSION):
+    """当前线程对应的 BrowserManager：工作线程中为它自己的管理器，其他线程按会话亲和查找"""
+    worker = getattr(_local, "worker", None)
+    if worker is not None:
+        return worker.manager
+    index = scheduler.worker_of(session_id)
+    return workers[index if index is not None else 0].manager
 
 
 # --- 全局函数接口 ---
-# 这些函数是外部调用的主要入口，它们内部会调用 browser_manager 的方法
+# 这些函数是外部调用的主要入口，它们内部会调用当前工作线程的 BrowserManager
+# session_id 通常为 Socket.IO 的 sid 或任务 id，缺省时使用共享的默认会话
 
-def start_browser(url):
+def start_browser(url, session_id=DEFAULT_SESSION, profile=None):
     """全局函数接口：启动浏览器"""
     logger.info(f"Global start_browser() called with URL: {url}")
-    return browser_manager.start_browser(url)
+    return current_manager(session_id).start_browser(url, session_id, profile)
 
 
-def get_operator():
+def get_operator(session_id=DEFAULT_SESSION):
     """全局函数接口：获取浏览器操作器"""
     # logger.debug("Global get_operator() called.") # 调用频繁，可按需开启
-    return browser_manager.get_operator()
+    return current_manager(session_id).get_operator(session_id)
 
 
-def close_operator():
+def close_operator(session_id=DEFAULT_SESSION):
     """全局函数接口：关闭浏览器"""
     logger.info("Global close_operator() called.")
-    browser_manager.close_operator()
+    current_manager(session_id).close_operator(session_id)
+
+
+def save_storage_state(session_id=DEFAULT_SESSION):
+    """全局函数接口：保存会话的登录状态"""
+    return current_manager(session_id).save_storage_state(session_id)
 
 
-def is_browser_running():
+def is_browser_running(session_id=DEFAULT_SESSION):
     """全局函数接口：检查浏览器是否运行"""
     # logger.debug("Global is_browser_running() called.") # 调用频繁，可按需开启
-    return browser_manager.is_browser_running()
+    return current_manager(session_id).is_browser_running(session_id)
+
+
+def shutdown_browsers():
+    """全局函数接口：关闭当前工作线程的所有会话和它的浏览器（需在浏览器线程中执行）。
+
+    stop_browser_thread() 时每个工作线程都会自行关闭，不必再为每个线程提交该任务。
+    """
+    logger.info("Global shutdown_browsers() called.")
+    current_manager().shutdown()
 
 # --- 全局函数接口结束 ---
@@ -0,0 +1,92 @@
+# image_encoding.py
+# 发送给模型的截图编码档位：无损 PNG、不同质量的 JPEG / WebP、灰度、降低分辨率。
+# 档位越低，上传体积与模型视觉 token 越少，但定位精度可能下降；用 benchmarks/bench_image_tiers.py 对比。
+# 模型返回的像素坐标是相对于编码后图像的，actions.compile_action 按编码尺寸把它们换算回视口归一化坐标，
+# 之后照常经 norm_to_pixel 得到点击位置。
+import base64
+import io
+import logging
+import struct
+from collections import namedtuple
+
+try:
+    from PIL import Image
+except ImportError:  # 没有 Pillow 时只能发送原始 PNG
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# format: png / jpeg / webp；quality 只对有损格式有效；scale 为相对视口的缩放比例
+EncodingTier = namedtuple("EncodingTier", ["name", "format", "quality", "scale", "grayscale"])
+
+TIERS = {tier.name: tier for tier in [
+    EncodingTier("png", "png", None, 1.0, False),
+    EncodingTier("png_gray", "png", None, 1.0, True),
+    EncodingTier("jpeg90", "jpeg", 90, 1.0, False),
+    EncodingTier("jpeg75", "jpeg", 75, 1.0, False),
+    EncodingTier("webp80", "webp", 80, 1.0, False),
+    EncodingTier("webp60", "webp", 60, 1.0, False),
+    EncodingTier("webp80_075", "webp", 80, 0.75, False),
+    EncodingTier("jpeg75_050", "jpeg", 75, 0.5, False),
+    EncodingTier("webp60_gray_050", "webp", 60, 0.5, True),
+]}
+
+MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+# data: 编码后的字节；width / height: 编码后图像的尺寸（写入提示词，并用于坐标换算）
+EncodedImage = namedtuple("EncodedImage", ["data", "mime", "width", "height", "tier"])
+
+
+def get_tier(tier):
+    """接受档位名或 EncodingTier；未知名称时报错"""
+    if isinstance(tier, EncodingTier):
+        return tier
+    if tier not in TIERS:
+        raise ValueError(f"未知的图像编码档位: {tier}，可选: {', '.join(TIERS)}")
+    return TIERS[tier]
+
+
+def png_size(png_bytes):
+    """从 PNG 的 IHDR 块读取 (宽, 高)，无需解码图像"""
+    return struct.unpack(">II", png_bytes[16:24])
+
+
+def _is_passthrough(tier):
+    return (tier.format == "png" and tier.scale == 1.0 and not tier.grayscale) or Image is None
+
+
+def encoded_size(png_bytes, tier):
+    """编码后图像的 (宽, 高)，不实际编码；用于在查询缓存前构造提示词"""
+    tier = get_tier(tier)
+    width, height = png_size(png_bytes)
+    if _is_passthrough(tier) or tier.scale == 1.0:
+        return width, height
+    return max(1, round(width * tier.scale)), max(1, round(height * tier.scale))
+
+
+def encode_image(png_bytes, tier):
+    """按档位编码截图，返回 EncodedImage"""
+    tier = get_tier(tier)
+    width, height = encoded_size(png_bytes, tier)
+    if _is_passthrough(tier):
+        if tier.name != "png":
+            logger.warning(f"Pillow is not installed, sending lossless PNG instead of tier {tier.name}.")
+        return EncodedImage(png_bytes, MIME_TYPES["png"], width, height, tier.name)
+
+    with Image.open(io.BytesIO(png_bytes)) as img:
+        if img.size != (width, height):
+            img = img.resize((width, height), Image.LANCZOS)
+        if tier.grayscale:
+            img = img.convert("L")
+        elif tier.format == "jpeg" or img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGB")
+        buffer = io.BytesIO()
+        if tier.format == "png":
+            img.save(buffer, format="PNG", optimize=True)
+        else:
+            img.save(buffer, format=tier.format.upper(), quality=tier.quality)
+    return EncodedImage(buffer.getvalue(), MIME_TYPES[tier.format], width, height, tier.name)
+
+
+def to_data_url(encoded):
+    return f"data:{encoded.mime};base64,{base64.b64encode(encoded.data).decode('utf-8')}"
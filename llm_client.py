@@ -0,0 +1,411 @@
+# llm_client.py
+# 长生命周期的模型客户端：
+#   - 提供方（provider）可插拔：智谱 ZhipuAI，或任意 OpenAI 兼容接口（包括本地桩服务）
+#   - HTTP 连接池复用，不再每一步新建客户端和连接
+#   - 全局与按租户（会话）的并发信号量；租户信号量只在有请求占用时存在，会话结束后自动回收
+#   - 令牌桶限流
+#   - 限流 / 临时错误时按指数退避 + 随机抖动重试
+#   - 可选截止时间（deadline）：单次请求超时不超过剩余时间，来不及重试时直接失败
+import abc
+import json
+import logging
+import random
+import threading
+import time
+import weakref
+from collections import namedtuple
+
+import httpx
+
+from config import (
+    LLM_PROVIDER,
+    LLM_BASE_URL,
+    LLM_API_KEY,
+    LLM_TIMEOUT,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_CONCURRENCY,
+    LLM_TENANT_CONCURRENCY,
+    LLM_RATE_PER_SEC,
+    LLM_BURST,
+    LLM_MAX_RETRIES,
+    LLM_BACKOFF_BASE,
+    LLM_BACKOFF_MAX,
+)
+
+logger = logging.getLogger(__name__)
+
+# usage 为 {"prompt_tokens", "completion_tokens", "total_tokens"}，提供方未返回时为空字典
+LLMResponse = namedtuple("LLMResponse", ["content", "usage", "model"])
+# 流式响应的一个片段；usage 只在最后一个片段中出现（如果提供方返回）
+StreamChunk = namedtuple("StreamChunk", ["content", "usage"])
+
+
+class LLMError(Exception):
+    """模型调用失败（不可重试）"""
+
+
+class TransientLLMError(LLMError):
+    """临时错误（超时、连接失败、5xx），可重试"""
+
+
+class DeadlineExceededError(LLMError):
+    """调用方给出的截止时间已到（不再重试）"""
+
+
+class RateLimitedError(TransientLLMError):
+    """被服务端限流（429），retry_after 为服务端建议的等待秒数"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _http_client(timeout):
+    return httpx.Client(
+        timeout=timeout,
+        limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                            max_keepalive_connections=LLM_MAX_CONNECTIONS),
+    )
+
+
+class LLMProvider(abc.ABC):
+    """提供方接口：子类实现 chat()，把各自的异常转换为 LLMError 体系"""
+
+    name = "base"
+
+    @abc.abstractmethod
+    def chat(self, model, messages, **kwargs):
+        """一次性对话，返回 LLMResponse"""
+
+    def chat_stream(self, model, messages, **kwargs):
+        """流式对话，逐个产出 StreamChunk；默认退化为一次性返回"""
+        response = self.chat(model, messages, **kwargs)
+        yield StreamChunk(response.content, response.usage)
+
+    def close(self):
+        pass
+
+
+class ZhipuProvider(LLMProvider):
+    name = "zhipu"
+
+    def __init__(self, api_key=LLM_API_KEY, base_url=None, timeout=LLM_TIMEOUT):
+        from zhipuai import ZhipuAI
+        # 关闭 SDK 自带重试，统一由 LLMClient 处理；传入共享的 httpx 连接池
+        self.client = ZhipuAI(api_key=api_key, base_url=base_url, timeout=timeout,
+                              max_retries=0, http_client=_http_client(timeout))
+
+    @staticmethod
+    def _usage(usage):
+        if not usage:
+            return {}
+        return {
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+            "total_tokens": getattr(usage, "total_tokens", 0) or 0,
+        }
+
+    @staticmethod
+    def _translate_errors(call):
+        """执行 SDK 调用并把 zhipuai 异常转换为 LLMError 体系"""
+        import zhipuai
+        try:
+            return call()
+        except (zhipuai.APIReachLimitError, zhipuai.APIServerFlowExceedError) as e:
+            raise RateLimitedError(str(e)) from e
+        except (zhipuai.APITimeoutError, zhipuai.APIConnectionError, zhipuai.APIInternalError) as e:
+            raise TransientLLMError(str(e)) from e
+        except zhipuai.ZhipuAIError as e:
+            raise LLMError(str(e)) from e
+
+    def chat(self, model, messages, **kwargs):
+        response = self._translate_errors(
+            lambda: self.client.chat.completions.create(model=model, messages=messages, **kwargs))
+        return LLMResponse(
+            content=response.choices[0].message.content,
+            usage=self._usage(getattr(response, "usage", None)),
+            model=model,
+        )
+
+    def chat_stream(self, model, messages, **kwargs):
+        stream = self._translate_errors(
+            lambda: self.client.chat.completions.create(model=model, messages=messages, stream=True, **kwargs))
+        iterator = iter(stream)
+        while True:
+            chunk = self._translate_errors(lambda: next(iterator, None))
+            if chunk is None:
+                return
+            delta = chunk.choices[0].delta if chunk.choices else None
+            content = getattr(delta, "content", None) or ""
+            usage = self._usage(getattr(chunk, "usage", None))
+            if content or usage:
+                yield StreamChunk(content, usage)
+
+    def close(self):
+        self.client.close()
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    """OpenAI 兼容的 /chat/completions 接口，例如 vLLM、Ollama 或 benchmarks/stub_llm_server.py"""
+
+    name = "openai"
+
+    def __init__(self, base_url=LLM_BASE_URL, api_key=LLM_API_KEY, timeout=LLM_TIMEOUT):
+        if not base_url:
+            raise ValueError("OpenAI 兼容提供方需要配置 LLM_BASE_URL")
+        self.base_url = base_url.rstrip("/")
+        self.client = _http_client(timeout)
+        self.client.headers["Authorization"] = f"Bearer {api_key}"
+
+    @staticmethod
+    def _check_status(response):
+        if response.status_code == 429:
+            retry_after = response.headers.get("Retry-After")
+            raise RateLimitedError(response.text, float(retry_after) if retry_after else None)
+        if response.status_code >= 500:
+            raise TransientLLMError(f"HTTP {response.status_code}: {response.text[:200]}")
+        if response.status_code >= 400:
+            raise LLMError(f"HTTP {response.status_code}: {response.text[:200]}")
+
+    def chat(self, model, messages, timeout=httpx.USE_CLIENT_DEFAULT, **kwargs):
+        try:
+            response = self.client.post(f"{self.base_url}/chat/completions",
+                                        json={"model": model, "messages": messages, **kwargs}, timeout=timeout)
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            raise TransientLLMError(str(e)) from e
+        self._check_status(response)
+        body = response.json()
+        return LLMResponse(
+            content=body["choices"][0]["message"]["content"],
+            usage=body.get("usage") or {},
+            model=body.get("model", model),
+        )
+
+    def chat_stream(self, model, messages, timeout=httpx.USE_CLIENT_DEFAULT, **kwargs):
+        """解析 SSE：每行 "data: {json}"，以 "data: [DONE]" 结束"""
+        payload = {"model": model, "messages": messages, "stream": True, **kwargs}
+        try:
+            with self.client.stream("POST", f"{self.base_url}/chat/completions", json=payload,
+                                    timeout=timeout) as response:
+                if response.status_code >= 400:
+                    response.read()
+                    self._check_status(response)
+                for line in response.iter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        return
+                    event = json.loads(data)
+                    choices = event.get("choices") or []
+                    content = ((choices[0].get("delta") or {}).get("content") or "") if choices else ""
+                    usage = event.get("usage") or {}
+                    if content or usage:
+                        yield StreamChunk(content, usage)
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            raise TransientLLMError(str(e)) from e
+
+    def close(self):
+        self.client.close()
+
+
+PROVIDERS = {
+    ZhipuProvider.name: ZhipuProvider,
+    OpenAICompatibleProvider.name: OpenAICompatibleProvider,
+}
+
+
+def register_provider(name, factory):
+    """注册自定义提供方，factory 为无参可调用对象，返回 LLMProvider 实例"""
+    PROVIDERS[name] = factory
+
+
+class TokenBucket:
+    """线程安全的令牌桶：rate 为每秒补充的令牌数，capacity 为桶容量"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """取一个令牌，不足时阻塞等待；返回等待的秒数"""
+        if not self.rate:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class LLMClient:
+    def __init__(self, provider, max_concurrency=LLM_MAX_CONCURRENCY,
+                 tenant_concurrency=LLM_TENANT_CONCURRENCY, rate_per_sec=LLM_RATE_PER_SEC,
+                 burst=LLM_BURST, max_retries=LLM_MAX_RETRIES,
+                 backoff_base=LLM_BACKOFF_BASE, backoff_max=LLM_BACKOFF_MAX):
+        self.provider = provider
+        self.global_slots = threading.BoundedSemaphore(max_concurrency)
+        self.tenant_concurrency = tenant_concurrency
+        # 弱引用：信号量只被进行中的请求持有，租户（会话）没有请求时自动移除，不随会话数增长
+        self.tenant_slots = weakref.WeakValueDictionary()
+        self.tenant_lock = threading.Lock()
+        self.bucket = TokenBucket(rate_per_sec, burst)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0, "failures": 0}
+        self.stats_lock = threading.Lock()
+
+    def _count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def _tenant_semaphore(self, tenant):
+        with self.tenant_lock:
+            semaphore = self.tenant_slots.get(tenant)
+            if semaphore is None:
+                semaphore = self.tenant_slots[tenant] = threading.BoundedSemaphore(self.tenant_concurrency)
+            return semaphore
+
+    def _backoff(self, attempt, error):
+        """full jitter 指数退避；服务端给出 Retry-After 时以其为下限"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after:
+            delay = max(delay, retry_after)
+        return delay
+
+    @staticmethod
+    def _attempt_timeout(deadline):
+        """本次请求的超时（秒）：不超过距截止时间的剩余时间；已到截止时间时抛出 DeadlineExceededError"""
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceededError("已到截止时间")
+        return min(remaining, LLM_TIMEOUT)
+
+    @staticmethod
+    def _check_retry_deadline(deadline, delay, error):
+        """退避结束时已过截止时间则不再重试"""
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            raise DeadlineExceededError(f"截止时间前无法完成重试: {error}") from error
+
+    def chat(self, messages, model, tenant=None, deadline=None, **kwargs):
+        """发送对话请求，返回 LLMResponse；重试耗尽或遇到不可重试错误时抛出 LLMError。
+
+        deadline 为 time.monotonic() 时间点，给出时每次请求的超时不超过剩余时间。
+        """
+        tenant_semaphore = self._tenant_semaphore(tenant) if tenant is not None else None
+        attempt = 0
+        while True:
+            timeout = self._attempt_timeout(deadline)
+            if timeout is not None:
+                kwargs["timeout"] = timeout
+            self.bucket.acquire()
+            if tenant_semaphore:
+                tenant_semaphore.acquire()
+            try:
+                with self.global_slots:
+                    self._count("requests")
+                    return self.provider.chat(model, messages, **kwargs)
+            except TransientLLMError as e:
+                if isinstance(e, RateLimitedError):
+                    self._count("rate_limited")
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                delay = self._backoff(attempt, e)
+                self._check_retry_deadline(deadline, delay, e)
+                logger.warning(f"LLM call failed ({e.__class__.__name__}: {e}), retry {attempt + 1} in {delay:.1f}s")
+                self._count("retries")
+                attempt += 1
+            except LLMError:
+                self._count("failures")
+                raise
+            finally:
+                if tenant_semaphore:
+                    tenant_semaphore.release()
+            # 退避期间不占用并发名额
+            time.sleep(delay)
+
+    def chat_stream(self, messages, model, tenant=None, deadline=None, **kwargs):
+        """流式对话，逐个产出 StreamChunk。
+
+        并发名额在整个流期间保持占用；只有在收到第一个片段之前失败才会重试，
+        已经产出内容后出错直接抛出，避免调用方收到重复内容。
+        给出 deadline 时，截止时间到达后在下一个片段处抛出 DeadlineExceededError 并关闭连接。
+        """
+        tenant_semaphore = self._tenant_semaphore(tenant) if tenant is not None else None
+        attempt = 0
+        while True:
+            timeout = self._attempt_timeout(deadline)
+            if timeout is not None:
+                kwargs["timeout"] = timeout
+            self.bucket.acquire()
+            if tenant_semaphore:
+                tenant_semaphore.acquire()
+            received = False
+            try:
+                with self.global_slots:
+                    self._count("requests")
+                    for chunk in self.provider.chat_stream(model, messages, **kwargs):
+                        received = True
+                        if deadline is not None and time.monotonic() >= deadline:
+                            raise DeadlineExceededError("流式响应未在截止时间前结束")
+                        yield chunk
+                    return
+            except TransientLLMError as e:
+                if isinstance(e, RateLimitedError):
+                    self._count("rate_limited")
+                if received or attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                delay = self._backoff(attempt, e)
+                self._check_retry_deadline(deadline, delay, e)
+                logger.warning(f"LLM stream failed ({e.__class__.__name__}: {e}), retry {attempt + 1} in {delay:.1f}s")
+                self._count("retries")
+                attempt += 1
+            except LLMError:
+                self._count("failures")
+                raise
+            finally:
+                if tenant_semaphore:
+                    tenant_semaphore.release()
+            time.sleep(delay)
+
+    def close(self):
+        self.provider.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    """获取全局模型客户端（首次调用时按 config.LLM_PROVIDER 创建）"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            if LLM_PROVIDER not in PROVIDERS:
+                raise ValueError(f"未知的模型提供方: {LLM_PROVIDER}")
+            _client = LLMClient(PROVIDERS[LLM_PROVIDER]())
+        return _client
+
+
+def set_llm_client(client):
+    """替换全局客户端（测试和基准中用于接入桩服务），返回旧的客户端"""
+    global _client
+    with _client_lock:
+        previous, _client = _client, client
+        return previous
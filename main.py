@@ -1,66 +1,172 @@
-from utils import generate_screenshot_name, ensure_dir
-from ai_handler import call_ai
+from screenshot_store import screenshot_store
+from tracing import span, start_trace
+from ai_handler import call_ai, call_ai_stream
+from conversation import ConversationHistory
+from config import AI_STREAMING, DOM_GROUNDING_ENABLED, CAPTURE_POLICY, TASK_MAX_STEPS
+from capture import CapturePolicy
+from effect_verifier import EffectVerifier
+from replay_cache import begin_plan_session
+from task_control import TaskControl, TaskCancelled
 from ui_operator import UIOperator
+from step_actions import StepActions
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
 import os
+import time
 
-def main(task_desc):
-    ensure_dir()
-    operator = UIOperator()
-    max_steps = 6
-    messages = []  # 用于记录与 AI 的对话上下文
-
-    for step_num in range(max_steps):
-        # 初始截图用于 AI 判断
-        img_path = generate_screenshot_name(task_desc, suffix=f"_step{step_num+1}_input")
-        operator.screenshot(img_path)
-        print(f"[步骤 {step_num + 1}] 已截图：{img_path}")
-
-        ai_result = call_ai(img_path, task_desc, messages)
-        print(f"[步骤 {step_num + 1}] AI 返回：\n{ai_result}")
-        messages = [{
-            "role": "assistant",
-            "content": f"[步骤 {step_num + 1}] AI 返回：\n{ai_result}"
-        }]
-
-        if ai_result["status"] == "done":
-            print(f"✅ 任务完成：{task_desc}")
-            break
-
-        elif ai_result["status"] == "action":
-            actions = ai_result["data"]
-            if isinstance(actions, list):
-                for substep_idx, action in enumerate(actions):
-                    print(f"👉 执行第 {substep_idx+1} 子步骤操作：{action}")
-                    operator.execute_action(action)
-
-                    # 对每个子步骤后截图
-                    sub_img_path = generate_screenshot_name(
-                        task_desc, suffix=f"_step{step_num+1}_{substep_idx+1}"
-                    )
-                    operator.screenshot(sub_img_path)
-                    print(f"📸 已保存操作后截图：{sub_img_path}")
-
-            elif isinstance(actions, dict):
-                operator.execute_action(actions)
-                sub_img_path = generate_screenshot_name(
-                    task_desc, suffix=f"_step{step_num+1}_1"
-                )
-                operator.screenshot(sub_img_path)
-                print(f"📸 已保存操作后截图：{sub_img_path}")
-
-            else:
-                print("[错误] 无法识别的操作数据格式：", actions)
-                break
-
-        elif ai_result["status"] == "error":
-            print(f"❌ AI 解析失败：{ai_result['error']}")
-            print(f"🔎 原始返回内容：{ai_result['raw']}")
-            break
-
-    else:
-        print("⚠️ 已达到最大步骤数，任务可能未完成。")
-
-    operator.close()
+def _elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 1)
+
+def _capture(operator, capture, run, step_num, substep_idx, last=False):
+    """按截图策略截取操作后的画面并保存（画面未变化时丢弃）"""
+    data = operator.screenshot(settle=capture.settle(last))
+    if capture.accept(data):
+        sub_img_path = run.save(data, f"step{step_num+1}_{substep_idx+1}")
+        print(f"📸 已保存操作后截图：{sub_img_path}")
+
+def _run_batch(operator, step_actions, run, capture, verifier, batch):
+    """执行一组子步骤操作（流式输出的单个操作，或批量执行时中间不逐个截图与等待），校验效果并按截图策略截图"""
+    label = step_actions.label(batch)
+    print(f"👉 执行{label}：{batch[0] if len(batch) == 1 else batch}")
+    # 效果校验与本地重试使用执行前的元素列表
+    elements = step_actions.elements
+    if step_actions.record(batch, operator.execute_actions(batch, elements)):
+        effect = verifier.verify(batch, lambda: operator.screenshot(settle=False, overlay=False),
+                                 lambda action: operator.execute_action(action, elements),
+                                 step_actions.history, step_actions.step, label)
+        print(f"🔍 {label}的效果：{effect.kind}（局部 {effect.local_ratio:.2%}，整体 {effect.global_ratio:.2%}）")
+    step_actions.advance(batch)
+
+    if capture.wants(step_actions.last):
+        _capture(operator, capture, run, step_actions.step - 1, step_actions.substep_idx, step_actions.last)
+
+def main(task_desc, operator=None, max_steps=TASK_MAX_STEPS, capture_policy=CAPTURE_POLICY, control=None):
+    """执行一个任务。
+
+    operator 为空时自行创建浏览器并在结束后关闭；传入时复用（例如批量执行的工作进程）。
+    capture_policy 为操作后截图策略（见 capture.CAPTURE_POLICIES）。
+    control 为 task_control.TaskControl（时间、步数与 token 预算），为空时按 max_steps 与默认预算创建。
+    返回结果字典：status 为 done / max_steps / error / cancelled / budget_exceeded，steps 为每一步的耗时明细。
+    """
+    control = control or TaskControl(max_steps=max_steps)
+    # 同步执行，截图无法放到后台：async 策略直接报错（见 capture.policy_error）
+    capture = CapturePolicy(capture_policy, background=False)
+    verifier = EffectVerifier()  # 操作前后逐像素比较，本地判断操作是否生效
+    owns_operator = operator is None
+    if owns_operator:
+        operator = UIOperator()
+    history = ConversationHistory()  # 与 AI 的对话上下文：历史步骤的操作摘要
+    plan_session = begin_plan_session(operator.page.url, task_desc)
+    run = screenshot_store.begin_run(task_desc)
+    trace = start_trace("task", task=task_desc, run_id=run.run_id)
+    success = False
+    result = {"task": task_desc, "status": "max_steps", "error": None, "steps": []}
+    task_started = time.perf_counter()
+
+    try:
+        for step_num in range(control.max_steps):
+            with span("step", step=step_num + 1):
+                control.check()
+                # 本步中截图、导航等浏览器调用的超时不超过剩余时间
+                operator.set_call_timeout(control.timeout_ms())
+                step_started = time.perf_counter()
+                timing = {"step": step_num + 1}
+                result["steps"].append(timing)
+
+                # 初始截图用于 AI 判断
+                img_bytes = operator.screenshot()
+                img_path = run.save(img_bytes, f"step{step_num+1}_input")
+                # 与截图同一时刻的可交互元素列表：随截图发送给模型，并用于执行前的坐标吸附
+                elements = operator.element_map() if DOM_GROUNDING_ENABLED else None
+                capture.seed(img_bytes)
+                # 效果校验的基准帧不含坐标标记（输入截图中的标记本身会被当成操作点附近的变化）
+                if verifier.enabled:
+                    verifier.seed(operator.screenshot(settle=False, overlay=False))
+                timing["screenshot_ms"] = _elapsed_ms(step_started)
+                print(f"[步骤 {step_num + 1}] 已截图：{img_path}")
+
+                ai_started = time.perf_counter()
+                # 本步操作的执行进度（流式阶段边生成边执行的操作不会重复执行）
+                step_actions = StepActions(step_num, history, plan_session, verifier, elements)
+                ai_result = plan_session.next_result(img_bytes) if plan_session else None
+                timing["replayed"] = ai_result is not None
+                if ai_result is not None:
+                    print(f"[步骤 {step_num + 1}] 画面与录制一致，回放录制的操作序列")
+                elif AI_STREAMING:
+                    # 模型每输出一个完整操作就立即执行；ai_ms 包含期间执行操作的时间
+                    for ai_result in call_ai_stream(img_path, task_desc, history.messages(), img_bytes=img_bytes,
+                                                    elements=elements, control=control,
+                                                    escalate=history.previous_step_had_no_effect(img_bytes)):
+                        if ai_result["status"] == "partial":
+                            control.check()
+                            if step_actions.executed == 0:
+                                timing["first_action_ms"] = _elapsed_ms(ai_started)
+                            _run_batch(operator, step_actions, run, capture, verifier, [ai_result["data"]])
+                else:
+                    ai_result = call_ai(img_path, task_desc, history.messages(), img_bytes=img_bytes,
+                                        elements=elements, control=control,
+                                        escalate=history.previous_step_had_no_effect(img_bytes))
+                timing["ai_ms"] = _elapsed_ms(ai_started)
+                # 模型调用期间可能已用完预算（此时的调用失败是截止时间导致的）
+                control.check()
+                if plan_session:
+                    plan_session.record(ai_result)
+                print(f"[步骤 {step_num + 1}] AI 返回：\n{ai_result}")
+                history.add_step(step_num + 1, ai_result, img_bytes)
+
+                if ai_result["status"] == "done":
+                    print(f"✅ 任务完成：{task_desc}")
+                    success = True
+                    result["status"] = "done"
+                    timing["total_ms"] = _elapsed_ms(step_started)
+                    break
+
+                elif ai_result["status"] == "action":
+                    actions_started = time.perf_counter()
+                    actions = ai_result["data"]
+                    # 跳过流式阶段已经执行过的操作；剩余多个操作时按配置批量执行
+                    for batch in step_actions.batches(actions):
+                        control.check()
+                        _run_batch(operator, step_actions, run, capture, verifier, batch)
+                    # 流式执行时最后一个操作执行时还不知道它是最后一个，按策略补一张最终截图
+                    if capture.finish():
+                        _capture(operator, capture, run, step_num, len(actions) - 1, last=True)
+                    timing["actions_ms"] = _elapsed_ms(actions_started)
+
+                elif ai_result["status"] == "error":
+                    print(f"❌ AI 解析失败：{ai_result['error']}")
+                    print(f"🔎 原始返回内容：{ai_result['raw']}")
+                    result.update(status="error", error=ai_result["error"])
+                    break
+
+                timing["total_ms"] = _elapsed_ms(step_started)
+
+        else:
+            print("⚠️ 已达到最大步骤数，任务可能未完成。")
+    except Exception as e:
+        # 时间预算用完时浏览器调用的超时由截止时间导致，按超出预算处理
+        if isinstance(e, PlaywrightTimeoutError) and control.timed_out():
+            e = control.error()
+        if not isinstance(e, TaskCancelled):
+            result.update(status="error", error=str(e))
+            raise
+        print(f"⏹️ 任务停止：{e}")
+        result.update(status=e.status, error=str(e))
+    finally:
+        # 出现异常时同样收尾：保存录制、截图清单与追踪文件，关闭自行创建的浏览器
+        operator.set_call_timeout()
+        if plan_session:
+            plan_session.finish(success)
+        result["manifest"] = run.close(result["status"])
+        result["trace"] = trace.finish(result["status"])
+        print(f"⏱️ 页面稳定等待统计：{operator.settle.stats()}")
+        print(f"🗂️ 截图存储统计：{screenshot_store.stats()}")
+        print(f"📷 操作后截图统计：{capture.stats()}")
+        print(f"🔍 操作效果校验统计：{verifier.stats()}")
+        if owns_operator:
+            operator.close()
+
+    result["duration_ms"] = _elapsed_ms(task_started)
+    return result
 
 if __name__ == "__main__":
     main("使用 Lewis1:Lewis123! 登录")
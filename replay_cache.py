@@ -0,0 +1,181 @@
+# replay_cache.py
+# 操作计划的录制与回放：任务成功完成后，把每一步的输入截图哈希和模型给出的操作序列
+# 按 (URL 模式, 任务描述) 保存下来。之后再执行相同任务时，只要当前截图与录制时的截图足够相似，
+# 就直接回放录制的操作，不再调用模型；一旦校验失败就回退到模型，并在成功后更新录制结果。
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+from actions import ActionParseError, result_from_json, result_to_json
+from ai_cache import image_hash, hash_distance
+from config import PLAN_CACHE_ENABLED, PLAN_CACHE_DIR, PLAN_CACHE_HASH_SIZE, PLAN_CACHE_MAX_DISTANCE
+
+logger = logging.getLogger(__name__)
+
+_ID_SEGMENT = re.compile(r"^(\d+|[0-9a-fA-F]{8,}|[0-9a-fA-F-]{36})$")
+
+
+def url_pattern(url):
+    """把 URL 归一化为模式：去掉查询参数和锚点，数字/哈希类路径段替换为 *"""
+    if not url:
+        return ""
+    parts = urlsplit(url)
+    segments = ["*" if _ID_SEGMENT.match(seg) else seg for seg in parts.path.split("/")]
+    return f"{parts.scheme}://{parts.netloc}{'/'.join(segments)}"
+
+
+def plan_key(url, task_desc):
+    raw = f"{url_pattern(url)}\0{task_desc.strip()}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class PlanStore:
+    """录制结果的持久化存储，每个 (URL 模式, 任务) 一个 JSON 文件"""
+
+    def __init__(self, directory=PLAN_CACHE_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._memory = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def load(self, key):
+        with self._lock:
+            if key in self._memory:
+                return self._memory[key]
+            try:
+                with open(self._path(key), "r", encoding="utf-8") as f:
+                    plan = json.load(f)
+            except (OSError, ValueError):
+                plan = None
+            self._memory[key] = plan
+            return plan
+
+    def save(self, key, plan):
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with self._lock:
+            self._memory[key] = plan
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(plan, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"Failed to save recorded plan {key}: {e}")
+
+    def delete(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+
+class PlanSession:
+    """一次任务执行中的录制/回放状态。
+
+    用法：每一步先调用 next_result(img_bytes)，返回 None 时再调用模型；
+    拿到结果后调用 record(result)；操作执行失败时调用 action_failed()；
+    任务完成时调用 finish(success)。
+    """
+
+    def __init__(self, store, url, task_desc, hash_size=PLAN_CACHE_HASH_SIZE,
+                 max_distance=PLAN_CACHE_MAX_DISTANCE):
+        self.store = store
+        self.key = plan_key(url, task_desc)
+        self.url = url
+        self.task_desc = task_desc
+        self.hash_size = hash_size
+        self.max_distance = max_distance
+        self.plan = store.load(self.key)
+        # 哈希网格大小变化后旧录制无法比较，只能重新录制
+        self.replaying = bool(self.plan and self.plan.get("steps")
+                              and self.plan.get("hash_size") == hash_size)
+        self.steps = []          # 本次执行录制的步骤
+        self.final_hash = None
+        self.replayed_steps = 0
+        self.failed = False
+        self._current_hash = None
+
+    def next_result(self, img_bytes):
+        """如果当前画面与录制时一致，返回录制的结果（格式同 call_ai），否则返回 None"""
+        self._current_hash = image_hash(img_bytes, self.hash_size)
+        if not self.replaying:
+            return None
+        step_index = len(self.steps)
+        recorded_steps = self.plan["steps"]
+        if step_index < len(recorded_steps):
+            recorded = recorded_steps[step_index]
+        else:
+            # 录制的操作已全部回放，校验画面是否与录制时的完成画面一致
+            recorded = {"frame_hash": self.plan.get("final_hash"), "result": {"status": "done"}}
+        distance = hash_distance(self._current_hash, recorded["frame_hash"] or "")
+        if distance > self.max_distance:
+            logger.info(f"Replay check failed at step {step_index + 1} (distance {distance}), falling back to model.")
+            self.replaying = False
+            return None
+        try:
+            result = result_from_json(recorded["result"])
+        except ActionParseError as e:
+            logger.info(f"Recorded step {step_index + 1} no longer matches the action format ({e}), falling back to model.")
+            self.replaying = False
+            return None
+        self.replayed_steps += 1
+        return result
+
+    def record(self, result):
+        """记录本步骤的输入画面与结果；完成（done）时保存为最终画面"""
+        if result.get("status") == "action":
+            self.steps.append({"frame_hash": self._current_hash, "result": result_to_json(result)})
+        elif result.get("status") == "done":
+            self.final_hash = self._current_hash
+
+    def action_failed(self):
+        self.failed = True
+        self.replaying = False
+
+    def finish(self, success):
+        """任务结束：成功且操作均执行成功时保存录制结果；回放后失败则删除旧录制"""
+        if not success or self.failed:
+            if self.replayed_steps and self.plan:
+                logger.info(f"Recorded plan for '{self.task_desc}' failed after replay, discarding it.")
+                self.store.delete(self.key)
+            return
+        if self.plan and self.replayed_steps == len(self.plan["steps"]) + 1:
+            # 完整回放成功，只更新统计信息
+            self.plan["replays"] = self.plan.get("replays", 0) + 1
+            self.store.save(self.key, self.plan)
+            return
+        self.store.save(self.key, {
+            "url_pattern": url_pattern(self.url),
+            "task_desc": self.task_desc,
+            "hash_size": self.hash_size,
+            "steps": self.steps,
+            "final_hash": self.final_hash,
+            "recorded_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "replays": 0,
+        })
+        logger.info(f"Recorded plan with {len(self.steps)} steps for '{self.task_desc}'.")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def begin_plan_session(url, task_desc):
+    """开始一次任务的录制/回放；未启用时返回 None"""
+    global _store
+    if not PLAN_CACHE_ENABLED:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = PlanStore()
+    return PlanSession(_store, url, task_desc)
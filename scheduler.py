@@ -0,0 +1,232 @@
+# scheduler.py
+# 多租户公平调度：每个会话一个待执行队列，多个工作线程按轮询（可加权）从各会话取任务，
+# 一个用户的长任务不会让其他用户一直排队。
+#   - 会话亲和：同步 Playwright 对象只能在创建它的线程中使用，会话的第一个任务被某个工作线程取走后，
+#     该会话之后的任务都交给同一个线程，直到会话的浏览器关闭（release）
+#   - 同一会话的任务串行执行，不同会话在各自的工作线程上并行
+#   - 队列上限：单个会话与全局的待执行任务数都有上限，超出时 submit 抛出 SchedulerBusy
+#   - 排队位置与预计等待时间：按轮询顺序估算排在前面的任务，以各类任务的平均耗时求和
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+from config import (
+    SCHEDULER_WORKERS,
+    SCHEDULER_MAX_PENDING_PER_SESSION,
+    SCHEDULER_MAX_PENDING,
+    SCHEDULER_DEFAULT_TASK_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+ScheduledTask = namedtuple("ScheduledTask", ["session_id", "func", "args", "kwargs", "callback", "enqueued_at"])
+
+
+class SchedulerBusy(Exception):
+    """队列已满，任务未被接受"""
+
+
+def task_name(func):
+    return getattr(func, "__name__", "anonymous")
+
+
+class FairScheduler:
+    def __init__(self, workers=SCHEDULER_WORKERS, max_pending_per_session=SCHEDULER_MAX_PENDING_PER_SESSION,
+                 max_pending=SCHEDULER_MAX_PENDING, default_task_seconds=SCHEDULER_DEFAULT_TASK_SECONDS):
+        self.workers = workers
+        self.max_pending_per_session = max_pending_per_session
+        self.max_pending = max_pending
+        self.default_task_seconds = default_task_seconds
+        self.cond = threading.Condition()
+        self.queues = {}        # session_id -> deque[ScheduledTask]
+        self.ring = deque()     # 有待执行任务的会话，按轮询顺序
+        self.affinity = {}      # session_id -> 工作线程编号
+        self.running = {}       # session_id -> (ScheduledTask, 开始时间)
+        self.weights = {}       # session_id -> 每轮可连续执行的任务数（默认 1）
+        self.turns = {}         # session_id -> 本轮已执行的任务数
+        self.durations = {}     # 任务函数名 -> 平均耗时（秒，指数移动平均）
+        self.stopped = False
+        self.stats_counters = {"submitted": 0, "rejected": 0, "completed": 0}
+        # on_queue_update(session_id, info)：排队位置变化时回调（在锁外调用），例如推送给前端
+        self.on_queue_update = None
+
+    # --- 提交 ---
+
+    def pending(self):
+        return sum(len(q) for q in self.queues.values())
+
+    def submit(self, session_id, func, args=(), kwargs=None, callback=None, bounded=True):
+        """提交任务，返回排队信息；bounded=True 且队列已满时抛出 SchedulerBusy。
+
+        关闭浏览器、断开连接等清理任务应以 bounded=False 提交，保证不会被拒绝。
+        """
+        task = ScheduledTask(session_id, func, args, kwargs or {}, callback, time.perf_counter())
+        with self.cond:
+            queue = self.queues.setdefault(session_id, deque())
+            if bounded:
+                if len(queue) >= self.max_pending_per_session:
+                    self.stats_counters["rejected"] += 1
+                    raise SchedulerBusy(f"该会话已有 {len(queue)} 个任务在排队，请稍后再试")
+                if self.pending() >= self.max_pending:
+                    self.stats_counters["rejected"] += 1
+                    raise SchedulerBusy("服务繁忙，排队任务已达上限，请稍后再试")
+            queue.append(task)
+            if session_id not in self.ring:
+                self.ring.append(session_id)
+            self.stats_counters["submitted"] += 1
+            info = self._queue_info(session_id)
+            self.cond.notify_all()
+        return info
+
+    def discard(self, session_id, predicate=None):
+        """移除会话中尚未开始执行的任务（predicate 为空时全部移除），返回移除的数量"""
+        with self.cond:
+            queue = self.queues.get(session_id)
+            if not queue:
+                return 0
+            kept = deque(task for task in queue if predicate is not None and not predicate(task))
+            removed = len(queue) - len(kept)
+            self.queues[session_id] = kept
+        if removed:
+            self._notify_waiting(session_id)
+        return removed
+
+    def set_weight(self, session_id, weight):
+        """设置会话的调度权重：每轮可连续执行 weight 个任务"""
+        with self.cond:
+            self.weights[session_id] = max(1, int(weight))
+
+    # --- 工作线程 ---
+
+    def next_task(self, worker_id, timeout=None):
+        """取下一个可在该工作线程执行的任务；超时返回 None。
+
+        调度器停止后仍会先取完已提交的任务（例如关闭浏览器），没有可取的任务时抛出 StopIteration。
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while True:
+                task = self._pick(worker_id)
+                if task is not None:
+                    break
+                if self.stopped:
+                    raise StopIteration
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+        self._notify_waiting(task.session_id)
+        return task
+
+    def _pick(self, worker_id):
+        """轮询：从环首开始找第一个可执行的会话（未在执行、亲和的是本线程或尚未分配）"""
+        for _ in range(len(self.ring)):
+            session_id = self.ring[0]
+            queue = self.queues.get(session_id)
+            if not queue:
+                self.ring.popleft()
+                self.turns.pop(session_id, None)
+                continue
+            owner = self.affinity.get(session_id)
+            if session_id in self.running or owner not in (None, worker_id):
+                self.ring.rotate(-1)
+                continue
+            task = queue.popleft()
+            self.affinity[session_id] = worker_id
+            self.running[session_id] = (task, time.perf_counter())
+            # 加权轮询：用完本轮配额后移到环尾
+            self.turns[session_id] = self.turns.get(session_id, 0) + 1
+            if not queue or self.turns[session_id] >= self.weights.get(session_id, 1):
+                self.turns[session_id] = 0
+                self.ring.rotate(-1)
+            return task
+        return None
+
+    def task_done(self, task, release=False):
+        """任务执行完毕；release=True 表示该会话已不再占用本线程的浏览器，可以解除亲和"""
+        with self.cond:
+            _, started = self.running.pop(task.session_id, (None, time.perf_counter()))
+            elapsed = time.perf_counter() - started
+            name = task_name(task.func)
+            previous = self.durations.get(name)
+            self.durations[name] = elapsed if previous is None else previous * 0.8 + elapsed * 0.2
+            self.stats_counters["completed"] += 1
+            if release and not self.queues.get(task.session_id):
+                self.affinity.pop(task.session_id, None)
+                self.queues.pop(task.session_id, None)
+                self.weights.pop(task.session_id, None)
+            self.cond.notify_all()
+        self._notify_waiting()
+
+    def worker_of(self, session_id):
+        """会话亲和的工作线程编号，未分配时返回 None"""
+        with self.cond:
+            return self.affinity.get(session_id)
+
+    def start(self):
+        with self.cond:
+            self.stopped = False
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    # --- 排队信息 ---
+
+    def _estimate(self, task):
+        return self.durations.get(task_name(task.func), self.default_task_seconds)
+
+    def _queue_info(self, session_id):
+        """估算会话下一个任务的排队位置与等待时间（需持有锁）"""
+        queue = self.queues.get(session_id)
+        if not queue:
+            return {"position": 0, "eta_s": 0.0, "pending": 0}
+        owner = self.affinity.get(session_id)
+        ahead = []
+        # 同一工作线程（或任意线程，若尚未分配）上正在执行的任务，按平均耗时减去已执行时间估算
+        now = time.perf_counter()
+        running_s = 0.0
+        for sid, (task, started) in self.running.items():
+            if owner is None or self.affinity.get(sid) == owner:
+                running_s += max(self._estimate(task) - (now - started), 0.0)
+        if session_id in self.running:
+            ahead.append(self.running[session_id][0])
+        # 轮询顺序中排在前面的其他会话，每个会话本轮最多执行 weight 个任务
+        for sid in self.ring:
+            if sid == session_id:
+                break
+            if owner is not None and self.affinity.get(sid) not in (None, owner):
+                continue
+            ahead.extend(list(self.queues.get(sid, ()))[:self.weights.get(sid, 1)])
+        parallel = 1 if owner is not None else max(self.workers, 1)
+        eta = (running_s + sum(self._estimate(task) for task in ahead)) / parallel
+        return {"position": len(ahead) + 1, "eta_s": round(eta, 1), "pending": len(queue)}
+
+    def queue_info(self, session_id):
+        with self.cond:
+            return self._queue_info(session_id)
+
+    def _notify_waiting(self, started=None):
+        """向仍在排队的会话推送最新位置；started 为刚开始执行任务的会话（队列已空时位置为 0）"""
+        callback = self.on_queue_update
+        if callback is None:
+            return
+        with self.cond:
+            updates = [(sid, self._queue_info(sid)) for sid, queue in self.queues.items()
+                       if queue or sid == started]
+        for session_id, info in updates:
+            try:
+                callback(session_id, info)
+            except Exception as e:
+                logger.warning(f"Queue update callback failed for {session_id}: {e}")
+
+    def stats(self):
+        with self.cond:
+            return {
+                "pending": self.pending(),
+                "running": len(self.running),
+                "sessions": len(self.affinity),
+                **self.stats_counters,
+            }
@@ -0,0 +1,147 @@
+# screencast.py
+# 实时画面：通过 CDP 的 Page.startScreencast 获取 Chromium 合成好的 JPEG 帧，
+# 以二进制 Socket.IO 消息直接推送给前端，不落盘，前端也不必再发 HTTP 请求取图。
+# 每个客户端一个发送线程和一个只保存最新一帧的“信箱”：
+#   - 帧率上限：两次发送的间隔不小于 1 / LIVEVIEW_MAX_FPS
+#   - 背压：上一帧未被客户端确认（渲染完成）前不发送下一帧；期间到达的帧只保留最新一帧，其余丢弃
+# 慢客户端因此只会少收帧，不会拖慢浏览器线程或其他客户端。
+import logging
+import threading
+import time
+from collections import Counter
+
+from config import (
+    LIVEVIEW_MAX_FPS,
+    LIVEVIEW_QUALITY,
+    LIVEVIEW_MAX_WIDTH,
+    LIVEVIEW_EVERY_NTH_FRAME,
+    LIVEVIEW_ACK_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+LIVE_FRAME_EVENT = "live_frame"
+
+
+def screencast_params():
+    """Page.startScreencast 的参数"""
+    return {
+        "format": "jpeg",
+        "quality": LIVEVIEW_QUALITY,
+        "maxWidth": LIVEVIEW_MAX_WIDTH,
+        "maxHeight": LIVEVIEW_MAX_WIDTH,
+        "everyNthFrame": LIVEVIEW_EVERY_NTH_FRAME,
+    }
+
+
+class LiveStream:
+    """一个客户端的实时画面发送通道（只保留最新一帧）"""
+
+    def __init__(self, socketio, sid, max_fps=LIVEVIEW_MAX_FPS, ack_timeout=LIVEVIEW_ACK_TIMEOUT):
+        self.socketio = socketio
+        self.sid = sid
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.ack_timeout = ack_timeout
+        self.counters = Counter()
+        self._cond = threading.Condition()
+        self._frame = None
+        self._running = True
+        self._acked = threading.Event()
+        self._acked.set()
+        socketio.start_background_task(self._sender)
+
+    def offer(self, data, metadata=None):
+        """收到一帧（在浏览器线程或事件循环中调用，不阻塞）；未发出的旧帧直接被替换"""
+        with self._cond:
+            if not self._running:
+                return
+            self.counters["received"] += 1
+            if self._frame is not None:
+                self.counters["dropped"] += 1
+            self._frame = (data, metadata or {})
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._frame = None
+            self._cond.notify()
+        self._acked.set()
+
+    def _on_ack(self, *args):
+        self._acked.set()
+
+    def _next_frame(self):
+        with self._cond:
+            while self._running and self._frame is None:
+                self._cond.wait()
+            return self._running
+
+    def _sender(self):
+        last_sent = 0.0
+        while self._next_frame():
+            # 帧率上限：等待期间到达的新帧会替换旧帧
+            delay = last_sent + self.min_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            # 背压：客户端确认上一帧之前不再发送；超时则视为确认丢失，继续发送
+            if not self._acked.wait(self.ack_timeout):
+                self.counters["ack_timeouts"] += 1
+            with self._cond:
+                if not self._running:
+                    return
+                frame, self._frame = self._frame, None
+            self._acked.clear()
+            try:
+                data, metadata = frame
+                self.socketio.emit(LIVE_FRAME_EVENT, (data, metadata), to=self.sid, callback=self._on_ack)
+                self.counters["sent"] += 1
+                self.counters["bytes"] += len(data)
+            except Exception as e:
+                logger.warning(f"Live frame emit to {self.sid} failed: {e}")
+                self._acked.set()
+            last_sent = time.monotonic()
+
+
+class LiveViewHub:
+    """按会话管理实时画面通道"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.streams = {}  # sid -> LiveStream
+
+    @property
+    def active(self):
+        return bool(self.streams)
+
+    def session_ids(self):
+        with self.lock:
+            return list(self.streams)
+
+    def open(self, socketio, sid):
+        """为客户端创建发送通道，返回其 offer 方法（即 operator.start_screencast 的帧回调）"""
+        with self.lock:
+            previous = self.streams.pop(sid, None)
+            stream = self.streams[sid] = LiveStream(socketio, sid)
+        if previous is not None:
+            previous.close()
+        return stream.offer
+
+    def close(self, sid):
+        with self.lock:
+            stream = self.streams.pop(sid, None)
+        if stream is not None:
+            stream.close()
+            logger.info(f"Live view closed for {sid}: {dict(stream.counters)}")
+        return stream is not None
+
+    def stats(self):
+        totals = Counter()
+        with self.lock:
+            for stream in self.streams.values():
+                totals.update(stream.counters)
+            return {"streams": len(self.streams), **totals}
+
+
+# 全局实时画面管理器
+live_view = LiveViewHub()
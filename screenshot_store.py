@@ -0,0 +1,301 @@
+# screenshot_store.py
+# 按内容寻址的截图存储：文件名为截图字节的 SHA-256，相同画面只保存一份。
+#   <root>/objects/<前两位>/<sha256>.<ext>   截图文件，按哈希前缀分目录，单个目录的文件数保持有限
+#   <root>/runs/<日期>/<run_id>.json         每次任务执行的清单：各步骤截图的标签与路径
+# 可选地把 PNG 转为 WebP / JPEG 以节省空间（需要 Pillow）。编码与写盘在后台线程中按顺序执行；
+# 需要把路径发给前端时传入 on_written，在文件写好之后才回调，前端不会请求到尚未写入的文件。
+# 同一线程中定期回收超过保存时间的截图与清单，并在总大小超过上限时删除最久未使用的截图。
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (
+    SCREENSHOT_DIR,
+    SCREENSHOT_FORMAT,
+    SCREENSHOT_QUALITY,
+    SCREENSHOT_MAX_BYTES,
+    SCREENSHOT_MAX_AGE,
+    SCREENSHOT_GC_INTERVAL,
+)
+
+try:
+    from PIL import Image
+except ImportError:  # 没有 Pillow 时只能保存原始 PNG
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {"png": "png", "webp": "webp", "jpeg": "jpg"}
+# 最近这段时间内被引用过的截图不会被回收，避免删掉刚返回给前端的文件
+GC_GRACE_SECONDS = 60
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.warning(f"Screenshot store task failed: {future.exception()}")
+
+
+class ScreenshotStore:
+    def __init__(self, root=SCREENSHOT_DIR, fmt=SCREENSHOT_FORMAT, quality=SCREENSHOT_QUALITY,
+                 max_bytes=SCREENSHOT_MAX_BYTES, max_age=SCREENSHOT_MAX_AGE, gc_interval=SCREENSHOT_GC_INTERVAL):
+        if fmt not in EXTENSIONS:
+            raise ValueError(f"不支持的截图格式: {fmt}")
+        if fmt != "png" and Image is None:
+            logger.warning(f"Pillow is not installed, storing screenshots as PNG instead of {fmt}.")
+            fmt = "png"
+        self.root = root
+        self.fmt = fmt
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.gc_interval = gc_interval
+        self.objects_dir = f"{root}/objects"
+        self.runs_dir = f"{root}/runs"
+
+        self._lock = threading.Lock()
+        self._index = None        # sha256 -> {"path", "size", "last_used"}，首次使用时从磁盘加载
+        self._total_bytes = 0
+        self._last_gc = time.time()
+        self._gc_pending = False
+        # 单线程执行写盘与回收，两者天然串行，不会删除正在写入的文件
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="screenshot-store")
+        self.counters = {"puts": 0, "dedup_hits": 0, "writes": 0, "bytes_written": 0,
+                         "gc_runs": 0, "gc_removed": 0, "gc_bytes": 0}
+
+    def _load_index(self):
+        """扫描已有截图建立索引（只在首次使用时执行一次），last_used 取文件修改时间"""
+        index = {}
+        total = 0
+        if os.path.isdir(self.objects_dir):
+            for shard in os.scandir(self.objects_dir):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    digest, _, ext = entry.name.partition(".")
+                    if ext.endswith("tmp") or not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    index[digest] = {"path": f"{self.objects_dir}/{shard.name}/{entry.name}",
+                                     "size": stat.st_size, "last_used": stat.st_mtime}
+                    total += stat.st_size
+        self._index = index
+        self._total_bytes = total
+
+    def _object_path(self, digest):
+        return f"{self.objects_dir}/{digest[:2]}/{digest}.{EXTENSIONS[self.fmt]}"
+
+    def put(self, data, on_written=None):
+        """保存截图字节，返回文件路径（可直接作为前端图片地址）。
+
+        路径在返回时即已确定，实际写盘在后台完成；相同内容只写一次。
+        on_written(path) 在文件写入磁盘后于写盘线程中调用（写入失败时不调用），用于通知前端。
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        now = time.time()
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            self.counters["puts"] += 1
+            entry = self._index.get(digest)
+            if entry is not None:
+                self.counters["dedup_hits"] += 1
+                touch = now - entry["last_used"] > GC_GRACE_SECONDS
+                entry["last_used"] = now
+                path = entry["path"]
+            else:
+                touch = False
+                path = self._object_path(digest)
+                self._index[digest] = {"path": path, "size": len(data), "last_used": now}
+                self._total_bytes += len(data)
+            run_gc = self._gc_due(now)
+        if entry is None:
+            self._submit(self._write, digest, path, data)
+        elif touch:
+            # 更新修改时间，重启后重新加载索引时仍能反映最近使用时间
+            self._submit(self._touch, path)
+        if on_written is not None:
+            # 写盘线程按提交顺序执行：此时这份内容之前提交的写入（包括其他调用方的）都已完成
+            self._submit(self._notify, path, on_written)
+        if run_gc:
+            self._submit(self.gc)
+        return path
+
+    @staticmethod
+    def _notify(path, on_written):
+        if os.path.exists(path):
+            on_written(path)
+
+    def _gc_due(self, now):
+        if self._gc_pending:
+            return False
+        since_last = now - self._last_gc
+        over_budget = self.max_bytes and self._total_bytes > self.max_bytes
+        # 超出上限时提前回收，但受保护期限制，避免在全部截图都刚被使用过时反复空转
+        if since_last >= self.gc_interval or (over_budget and since_last >= min(self.gc_interval, GC_GRACE_SECONDS)):
+            self._gc_pending = True
+            return True
+        return False
+
+    def _submit(self, fn, *args):
+        future = self._writer.submit(fn, *args)
+        future.add_done_callback(_log_failure)
+        return future
+
+    def _encode(self, data):
+        if self.fmt == "png":
+            return data
+        with Image.open(io.BytesIO(data)) as img:
+            buffer = io.BytesIO()
+            if self.fmt == "jpeg":
+                img.convert("RGB").save(buffer, format="JPEG", quality=self.quality)
+            else:
+                img.save(buffer, format="WEBP", quality=self.quality)
+        return buffer.getvalue()
+
+    def _write(self, digest, path, data):
+        if os.path.exists(path):
+            return
+        encoded = self._encode(data)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(encoded)
+        os.replace(tmp_path, path)
+        with self._lock:
+            entry = self._index.get(digest)
+            if entry is not None:
+                self._total_bytes += len(encoded) - entry["size"]
+                entry["size"] = len(encoded)
+            self.counters["writes"] += 1
+            self.counters["bytes_written"] += len(encoded)
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def write_manifest(self, run_id, manifest):
+        """在后台写入运行清单，返回清单路径"""
+        path = f"{self.runs_dir}/{run_id[:8]}/{run_id}.json"
+        self._submit(self._write_json, path, manifest)
+        return path
+
+    @staticmethod
+    def _write_json(path, payload):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def gc(self):
+        """回收截图与清单：先删除超过保存时间的，再按最久未使用删除到总大小低于上限"""
+        now = time.time()
+        victims = []
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            protected_after = now - GC_GRACE_SECONDS
+            if self.max_age:
+                expired_before = now - self.max_age
+                victims = [d for d, e in self._index.items() if e["last_used"] < min(expired_before, protected_after)]
+            remaining = self._total_bytes - sum(self._index[d]["size"] for d in victims)
+            if self.max_bytes and remaining > self.max_bytes:
+                chosen = set(victims)
+                for digest, entry in sorted(self._index.items(), key=lambda item: item[1]["last_used"]):
+                    if remaining <= self.max_bytes or entry["last_used"] >= protected_after:
+                        break
+                    if digest not in chosen:
+                        victims.append(digest)
+                        remaining -= entry["size"]
+            removed = [self._index.pop(d) for d in victims]
+            self._total_bytes -= sum(e["size"] for e in removed)
+            self._last_gc = now
+            self._gc_pending = False
+
+        freed = 0
+        for entry in removed:
+            try:
+                os.remove(entry["path"])
+                freed += entry["size"]
+            except OSError:
+                pass
+        self._gc_manifests(now)
+        with self._lock:
+            self.counters["gc_runs"] += 1
+            self.counters["gc_removed"] += len(removed)
+            self.counters["gc_bytes"] += freed
+        if removed:
+            logger.info(f"Screenshot GC removed {len(removed)} files ({freed / 1024 / 1024:.1f} MiB).")
+        return len(removed)
+
+    def _gc_manifests(self, now):
+        """删除超过保存时间的运行清单；按日期分目录，过期的整个目录一起删除"""
+        if not self.max_age or not os.path.isdir(self.runs_dir):
+            return
+        expired_before = now - self.max_age
+        for day in os.scandir(self.runs_dir):
+            if not day.is_dir() or day.stat().st_mtime >= expired_before:
+                continue
+            for entry in os.scandir(day.path):
+                if entry.stat().st_mtime < expired_before:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+            try:
+                os.rmdir(day.path)
+            except OSError:
+                pass  # 目录中还有未过期的清单
+
+    def flush(self):
+        """等待此前提交的写盘与回收全部完成"""
+        self._submit(lambda: None).result()
+
+    def begin_run(self, task_desc):
+        return ScreenshotRun(self, task_desc)
+
+    def stats(self):
+        with self._lock:
+            files = len(self._index) if self._index is not None else 0
+            return {"files": files, "total_bytes": self._total_bytes, "format": self.fmt, **self.counters}
+
+
+class ScreenshotRun:
+    """一次任务执行的截图记录：save() 保存截图并记入清单，close() 写出清单"""
+
+    def __init__(self, store, task_desc):
+        self.store = store
+        self.task_desc = task_desc
+        self.run_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        self.started_at = time.time()
+        self.entries = []
+        self.manifest_path = None
+
+    def save(self, data, label, on_written=None):
+        """保存截图并记入清单，返回路径；on_written 见 ScreenshotStore.put"""
+        path = self.store.put(data, on_written)
+        self.entries.append({"label": label, "path": path, "time": round(time.time() - self.started_at, 3)})
+        return path
+
+    def close(self, status=None):
+        self.manifest_path = self.store.write_manifest(self.run_id, {
+            "run_id": self.run_id,
+            "task_desc": self.task_desc,
+            "status": status,
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at)),
+            "duration_s": round(time.time() - self.started_at, 3),
+            "screenshots": self.entries,
+        })
+        return self.manifest_path
+
+
+screenshot_store = ScreenshotStore()
@@ -0,0 +1,189 @@
+# settle.py
+# 自适应页面稳定检测：代替操作后的固定 sleep。
+# 满足以下条件即认为页面稳定（或达到上限时间后放弃等待）：
+#   - DOM 在 quiet_ms 内没有变化（MutationObserver）
+#   - 没有进行中的 fetch / XHR 请求
+#   - 没有正在运行的有限时长动画
+#   - 可选：连续两帧截图完全相同
+# 每次等待的耗时按标签（click、type、screenshot 等）记录，便于调参。
+import statistics
+import time
+from collections import defaultdict, deque
+
+from tracing import span
+from config import SETTLE_TIMEOUT_MS, SETTLE_QUIET_MS, SETTLE_POLL_MS, SETTLE_CHECK_FRAMES
+
+# 通过 context.add_init_script 注入，在页面脚本之前记录 DOM 变化与请求数
+SETTLE_INIT_SCRIPT = """
+(() => {
+    if (window.__a2iSettle) return;
+    const state = { inflight: 0, lastMutation: performance.now() };
+    window.__a2iSettle = state;
+
+    const observe = () => {
+        new MutationObserver(() => { state.lastMutation = performance.now(); })
+            .observe(document, { subtree: true, childList: true, attributes: true, characterData: true });
+    };
+    if (document.documentElement) observe();
+    else document.addEventListener("readystatechange", observe, { once: true });
+
+    const origFetch = window.fetch;
+    if (origFetch) {
+        window.fetch = function (...args) {
+            state.inflight++;
+            return origFetch.apply(this, args).finally(() => { state.inflight--; });
+        };
+    }
+    const origSend = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function (...args) {
+        state.inflight++;
+        this.addEventListener("loadend", () => { state.inflight--; }, { once: true });
+        return origSend.apply(this, args);
+    };
+})();
+"""
+
+# 在页面内轮询直到稳定或超时，整个等待只需要一次 evaluate 往返
+SETTLE_PROBE_JS = """
+async ({ quietMs, timeoutMs, pollMs }) => {
+    const start = performance.now();
+    const state = window.__a2iSettle;
+    let localLast = start;
+    let observer = null;
+    if (!state) {
+        // 未注入初始化脚本（例如 about:blank）时，从现在开始观察 DOM
+        observer = new MutationObserver(() => { localLast = performance.now(); });
+        observer.observe(document, { subtree: true, childList: true, attributes: true, characterData: true });
+    }
+    const runningAnimations = () => {
+        if (!document.getAnimations) return 0;
+        return document.getAnimations().filter(a => {
+            if (a.playState !== "running") return false;
+            const timing = a.effect && a.effect.getComputedTiming();
+            return !timing || timing.iterations !== Infinity;
+        }).length;
+    };
+    try {
+        while (true) {
+            const now = performance.now();
+            const lastMutation = state ? state.lastMutation : localLast;
+            const inflight = state ? Math.max(state.inflight, 0) : 0;
+            const animations = runningAnimations();
+            const settled = document.readyState !== "loading"
+                && now - lastMutation >= quietMs && inflight === 0 && animations === 0;
+            if (settled || now - start >= timeoutMs) {
+                return { settled, inflight, animations };
+            }
+            await new Promise(resolve => setTimeout(resolve, pollMs));
+        }
+    } finally {
+        if (observer) observer.disconnect();
+    }
+}
+"""
+
+
+class SettleDetector:
+    def __init__(self, timeout_ms=SETTLE_TIMEOUT_MS, quiet_ms=SETTLE_QUIET_MS,
+                 poll_ms=SETTLE_POLL_MS, check_frames=SETTLE_CHECK_FRAMES, history=1000):
+        self.timeout_ms = timeout_ms
+        self.quiet_ms = quiet_ms
+        self.poll_ms = poll_ms
+        self.check_frames = check_frames
+        # label -> 最近若干次 (耗时毫秒, 是否稳定)
+        self.records = defaultdict(lambda: deque(maxlen=history))
+
+    def _probe_args(self, remaining_ms):
+        return {"quietMs": self.quiet_ms, "timeoutMs": remaining_ms, "pollMs": self.poll_ms}
+
+    def _record(self, label, started, settled):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.records[label].append((elapsed_ms, settled))
+        return elapsed_ms
+
+    @staticmethod
+    def _remaining_ms(deadline):
+        return int((deadline - time.perf_counter()) * 1000)
+
+    def wait(self, page, label="action"):
+        """等待页面稳定，返回实际等待的毫秒数"""
+        with span(f"settle.{label}"):
+            return self._wait(page, label)
+
+    def _wait(self, page, label):
+        started = time.perf_counter()
+        deadline = started + self.timeout_ms / 1000
+        settled = False
+        while self._remaining_ms(deadline) > 0:
+            try:
+                settled = page.evaluate(SETTLE_PROBE_JS, self._probe_args(self._remaining_ms(deadline)))["settled"]
+                break
+            except Exception:
+                # 等待过程中页面发生跳转（执行上下文被销毁），等新文档加载后继续检测
+                try:
+                    page.wait_for_load_state("domcontentloaded", timeout=max(self._remaining_ms(deadline), 1))
+                except Exception:
+                    break
+        if settled and self.check_frames:
+            settled = self._frames_stable(page, deadline)
+        return self._record(label, started, settled)
+
+    def _frames_stable(self, page, deadline):
+        previous = page.screenshot(type="jpeg", quality=30)
+        while self._remaining_ms(deadline) > 0:
+            page.wait_for_timeout(self.poll_ms)
+            current = page.screenshot(type="jpeg", quality=30)
+            if current == previous:
+                return True
+            previous = current
+        return False
+
+    async def wait_async(self, page, label="action"):
+        """wait() 的异步版本，供 AsyncUIOperator 使用"""
+        with span(f"settle.{label}"):
+            return await self._wait_async(page, label)
+
+    async def _wait_async(self, page, label):
+        started = time.perf_counter()
+        deadline = started + self.timeout_ms / 1000
+        settled = False
+        while self._remaining_ms(deadline) > 0:
+            try:
+                result = await page.evaluate(SETTLE_PROBE_JS, self._probe_args(self._remaining_ms(deadline)))
+                settled = result["settled"]
+                break
+            except Exception:
+                try:
+                    await page.wait_for_load_state("domcontentloaded", timeout=max(self._remaining_ms(deadline), 1))
+                except Exception:
+                    break
+        if settled and self.check_frames:
+            settled = await self._frames_stable_async(page, deadline)
+        return self._record(label, started, settled)
+
+    async def _frames_stable_async(self, page, deadline):
+        previous = await page.screenshot(type="jpeg", quality=30)
+        while self._remaining_ms(deadline) > 0:
+            await page.wait_for_timeout(self.poll_ms)
+            current = await page.screenshot(type="jpeg", quality=30)
+            if current == previous:
+                return True
+            previous = current
+        return False
+
+    def stats(self):
+        """按标签汇总等待耗时：次数、均值、p50、p95、最大值、超时次数"""
+        summary = {}
+        for label, records in self.records.items():
+            times = sorted(ms for ms, _ in records)
+            if not times:
+                continue
+            summary[label] = {
+                "count": len(times),
+                "mean_ms": round(statistics.mean(times), 1),
+                "p50_ms": round(times[len(times) // 2], 1),
+                "p95_ms": round(times[min(len(times) - 1, int(len(times) * 0.95))], 1),
+                "max_ms": round(times[-1], 1),
+                "timeouts": sum(1 for _, settled in records if not settled),
+            }
+        return summary
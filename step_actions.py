@@ -0,0 +1,65 @@
+# step_actions.py
+# 一步中模型给出的操作如何执行：三个任务循环（app.run_task_logic、main.main、async_engine._run_steps）共用，
+# 流式执行、批量分组、失败说明、效果校验的条件与截图时机在各入口保持一致；
+# 各入口只负责实际的浏览器调用（同步或异步）、截图保存与事件推送。
+from config import ACTION_BATCHING
+from ui_operator import elements_after
+
+
+class StepActions:
+    """一步内操作的执行进度。
+
+    流式输出的每个操作作为单独一组执行；完整结果返回后按 batches(actions) 执行剩余的操作。每组操作：
+      label(batch)            执行前取得写入历史与日志的描述（"第 2 个操作"、"第 2-4 个操作"）
+      record(batch, results)  记录执行结果，为真时校验效果（重新执行时使用执行前的 elements）
+      advance(batch)          更新进度与可用于吸附的元素列表
+    之后按 capture.wants(last) 截图，截图序号为 substep_idx。
+    """
+
+    def __init__(self, step_num, history, plan_session=None, verifier=None, elements=None, batching=ACTION_BATCHING):
+        self.step = step_num + 1  # 从 1 开始的步骤号
+        self.history = history
+        self.plan_session = plan_session
+        self.verifier = verifier
+        self.elements = elements  # 本步截图时的元素列表，页面可能已变化后为 None（见 elements_after）
+        self.batching = batching
+        self.executed = 0         # 已执行的操作数（包括流式阶段执行的）
+        self.total = None         # 本步的操作总数，完整结果返回前未知
+
+    def batches(self, actions):
+        """完整结果中尚未执行的操作的分组：开启批量执行且剩余多个操作时为一组，否则每个操作一组"""
+        self.total = len(actions)
+        remaining = list(actions[self.executed:])
+        if self.batching and len(remaining) > 1:
+            return [remaining]
+        return [[action] for action in remaining]
+
+    def label(self, batch):
+        first = self.executed + 1
+        return f"第 {first} 个操作" if len(batch) == 1 else f"第 {first}-{self.executed + len(batch)} 个操作"
+
+    def record(self, batch, results):
+        """记录一组操作的执行结果（未能执行的记入对话历史并告知录制回放），返回是否需要校验效果"""
+        for substep, ok in enumerate(results, self.executed + 1):
+            if not ok:
+                self.history.note_failure(self.step, f"第 {substep} 个操作未能执行")
+                if self.plan_session:
+                    self.plan_session.action_failed()
+        # 全部未能执行时画面本来就不会变化，不必再截图比较
+        return any(results) and self.verifier is not None and self.verifier.wants(batch)
+
+    def advance(self, batch):
+        for action in batch:
+            # 页面可能已变化时，后续操作不再按截图时的元素列表吸附
+            self.elements = elements_after(action, self.elements)
+        self.executed += len(batch)
+
+    @property
+    def last(self):
+        """刚执行的是不是本步最后一个操作（流式阶段总数未知，视为不是）"""
+        return self.executed == self.total
+
+    @property
+    def substep_idx(self):
+        """刚执行的最后一个操作的序号（从 0 开始）"""
+        return self.executed - 1
@@ -0,0 +1,121 @@
+# storage_state.py
+# 登录状态持久化：任务成功完成后保存会话的 storage state（cookie 与 localStorage），
+# 按 (站点 origin, 凭据档案) 存为一个 JSON 文件。之后在同一站点、同一档案下启动会话时，
+# 新 context 直接带上这些状态，页面打开即已登录，不必再花几步模型调用重新登录。
+# 文件中包含会话 cookie，等同于登录凭据：以 0600 权限写入，过期（STORAGE_STATE_TTL）后不再使用。
+# 档案必须由服务端显式配置（STORAGE_STATE_PROFILES），客户端凭访问密钥使用；没有档案的会话不保存也不恢复，
+# 多个租户即使打开同一站点也不会共用登录状态。
+import hmac
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+from config import STORAGE_STATE_ENABLED, STORAGE_STATE_DIR, STORAGE_STATE_TTL, STORAGE_STATE_PROFILES
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_profile(name, key, profiles=None):
+    """客户端请求的凭据档案：档案已在服务端配置且访问密钥匹配时返回档案名，否则返回 None（不保存、不恢复）"""
+    profiles = STORAGE_STATE_PROFILES if profiles is None else profiles
+    expected = profiles.get(name) if isinstance(name, str) else None
+    if not expected or not isinstance(key, str):
+        return None
+    return name if hmac.compare_digest(expected.encode("utf-8"), key.encode("utf-8")) else None
+
+
+def site_origin(url):
+    """URL 的 origin（scheme://host:port），作为登录状态的站点维度"""
+    parts = urlsplit(url or "")
+    return f"{parts.scheme}://{parts.netloc}" if parts.netloc else ""
+
+
+def state_key(url, profile):
+    raw = f"{site_origin(url)}\0{profile}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class StorageStateStore:
+    """登录状态的持久化存储，每个 (站点, 档案) 一个 JSON 文件"""
+
+    def __init__(self, directory=STORAGE_STATE_DIR, ttl=STORAGE_STATE_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.counters = Counter()
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def load(self, url, profile):
+        """返回可直接传给 new_context(storage_state=...) 的字典；没有档案、没有保存或已过期时返回 None"""
+        if not profile or not site_origin(url):
+            return None
+        path = self._path(state_key(url, profile))
+        with self._lock:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                self.counters["misses"] += 1
+                return None
+            if self.ttl and time.time() - record.get("saved_at", 0) > self.ttl:
+                self.counters["expired"] += 1
+                return None
+            self.counters["hits"] += 1
+            return record.get("state")
+
+    def save(self, url, profile, state):
+        origin = site_origin(url)
+        if not profile or not origin or not state:
+            return
+        key = state_key(url, profile)
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        record = {"origin": origin, "profile": profile, "saved_at": time.time(), "state": state}
+        with self._lock:
+            try:
+                # 先以 0600 创建再写入，文件在任何时刻都不会对其他用户可读
+                fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(record, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+                self.counters["saved"] += 1
+            except OSError as e:
+                logger.warning(f"Failed to save storage state for {origin}: {e}")
+
+    def delete(self, url, profile):
+        with self._lock:
+            try:
+                os.remove(self._path(state_key(url, profile)))
+            except OSError:
+                pass
+
+    def stats(self):
+        return dict(self.counters)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_state_store():
+    """全局登录状态存储；未启用时返回 None"""
+    global _store
+    if not STORAGE_STATE_ENABLED:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = StorageStateStore()
+    return _store
+
+
+def storage_state_stats():
+    store = get_state_store()
+    return store.stats() if store else {}
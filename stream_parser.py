@@ -0,0 +1,115 @@
+# stream_parser.py
+# 流式模型输出的增量解析：逐块喂入文本，每当 JSON 数组中的一个操作对象闭合就立即产出，
+# 使调用方可以在模型仍在生成后续操作时就开始执行第一个操作。
+import json
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+class IncrementalActionParser:
+    """从流式文本中增量提取 JSON 操作数组的元素。
+
+    - 只把紧跟 '{' 的 '[' 视为操作数组的开始，推理文字中的 "[步骤1]" 之类不会误触发
+    - <think>...</think> 中的推理内容被忽略
+    - 字符串中的括号和转义字符不会影响层级计数
+    用法：for action in parser.feed(chunk): ...；结束后读取 parser.actions / parser.errors / parser.done_marker_seen
+    """
+
+    def __init__(self, done_marker="目标完成"):
+        self.done_marker = done_marker
+        self.text = ""          # 已收到的全部文本（思考内容除外）
+        self._pending = ""      # 尚未确定是否属于思考标签的尾部文本
+        self.raw = ""           # 已收到的全部原始文本
+        self.pos = 0            # 下一个待扫描字符的位置
+        self.in_think = False
+        self.in_array = False
+        self.array_closed = False
+        self.depth = 0          # 数组内的层级：1 表示位于数组顶层
+        self.in_string = False
+        self.escape = False
+        self.object_start = None
+        self.actions = []
+        self.errors = []
+        self.done_marker_seen = False
+
+    def _strip_thinking(self, chunk):
+        """去掉思考内容，返回可见文本；标签跨块时保留尾部等待下一块"""
+        visible = []
+        self._pending += chunk
+        while self._pending:
+            tag = THINK_CLOSE if self.in_think else THINK_OPEN
+            index = self._pending.find(tag)
+            if index == -1:
+                # 保留可能是标签前缀的尾部
+                keep = 0
+                for n in range(min(len(tag) - 1, len(self._pending)), 0, -1):
+                    if tag.startswith(self._pending[-n:]):
+                        keep = n
+                        break
+                body = self._pending[:len(self._pending) - keep]
+                if not self.in_think:
+                    visible.append(body)
+                self._pending = self._pending[len(self._pending) - keep:]
+                break
+            if not self.in_think:
+                visible.append(self._pending[:index])
+            self._pending = self._pending[index + len(tag):]
+            self.in_think = not self.in_think
+        return "".join(visible)
+
+    def feed(self, chunk):
+        """喂入一段文本，返回本次新闭合的操作对象列表"""
+        self.raw += chunk
+        self.text += self._strip_thinking(chunk)
+        if not self.in_array and self.done_marker and self.done_marker in self.text:
+            self.done_marker_seen = True
+        completed = []
+        text = self.text
+        while self.pos < len(text) and not self.array_closed:
+            ch = text[self.pos]
+            if not self.in_array:
+                if ch == "[":
+                    # 需要看到下一个非空白字符才能判断是否为操作数组
+                    rest = text[self.pos + 1:].lstrip()
+                    if not rest:
+                        break
+                    if rest[0] == "{":
+                        self.in_array = True
+                        self.depth = 1
+                self.pos += 1
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "[{":
+                if ch == "{" and self.depth == 1:
+                    self.object_start = self.pos
+                self.depth += 1
+            elif ch in "]}":
+                self.depth -= 1
+                if ch == "}" and self.depth == 1 and self.object_start is not None:
+                    fragment = text[self.object_start:self.pos + 1]
+                    self.object_start = None
+                    try:
+                        action = json.loads(fragment)
+                        self.actions.append(action)
+                        completed.append(action)
+                    except json.JSONDecodeError as e:
+                        self.errors.append(f"无法解析的操作对象: {e}: {fragment[:120]}")
+                elif self.depth == 0:
+                    self.array_closed = True
+            self.pos += 1
+        return completed
+
+    @property
+    def finished(self):
+        """操作数组已完整闭合"""
+        return self.array_closed
@@ -0,0 +1,137 @@
+# task_control.py
+# 任务取消与预算：每次运行一个 TaskControl，记录墙钟时间、步数与模型 token 的上限。
+#   - 协作式取消：cancel() 只设置标志，任务在每一步开始、每个操作执行前与流式响应的每个片段之间检查，
+#     检查时抛出 TaskCancelled，由任务循环统一收尾（保存截图清单、追踪文件）
+#   - 阻塞调用的超时：模型请求以剩余时间为截止时间（见 llm_client），浏览器调用的默认超时不超过剩余时间，
+#     卡住的调用最迟在预算用完时返回，工作线程随之释放；此时抛出的超时异常经 timed_out() 判断后按超出预算处理
+import threading
+import time
+
+from config import TASK_MAX_SECONDS, TASK_MAX_STEPS, TASK_MAX_TOKENS, BROWSER_CALL_TIMEOUT_MS
+from conversation import estimate_tokens
+
+
+class TaskCancelled(Exception):
+    """任务被取消；status 写入运行结果，str(e) 为给用户看的原因"""
+
+    status = "cancelled"
+
+
+class BudgetExceeded(TaskCancelled):
+    """任务超出时间或 token 预算"""
+
+    status = "budget_exceeded"
+
+
+class TaskControl:
+    """一次任务运行的取消标志与预算；时间与 token 上限为 0 或 None 时不限制"""
+
+    def __init__(self, max_seconds=TASK_MAX_SECONDS, max_steps=TASK_MAX_STEPS, max_tokens=TASK_MAX_TOKENS):
+        self.max_seconds = max_seconds
+        self.max_steps = max_steps
+        self.max_tokens = max_tokens
+        self.started = time.monotonic()
+        self.deadline = self.started + max_seconds if max_seconds else None
+        self.tokens = 0
+        self.reason = None
+        self._budget = False
+        self._cancelled = threading.Event()
+
+    def cancel(self, reason="任务已取消", budget=False):
+        """设置取消标志（可在任意线程调用）；budget=True 表示因超出预算而取消"""
+        if self.cancelled:
+            return
+        self.reason = reason
+        self._budget = budget
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def remaining(self):
+        """剩余的墙钟时间（秒），不限时返回 None"""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def timeout_ms(self, default_ms=BROWSER_CALL_TIMEOUT_MS):
+        """单次阻塞调用的超时：默认值与剩余时间中较小者（至少 1 毫秒）"""
+        remaining = self.remaining()
+        if remaining is None:
+            return default_ms
+        return max(min(default_ms, int(remaining * 1000)), 1)
+
+    def add_usage(self, usage, content=""):
+        """累计模型 token 用量；提供方未返回 usage 时按回复文本粗略估算"""
+        usage = usage or {}
+        tokens = usage.get("total_tokens") or (usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0))
+        self.tokens += tokens or estimate_tokens(content)
+
+    def timed_out(self):
+        """时间预算已用完时设置取消标志并返回 True：此时浏览器调用的超时异常由截止时间导致"""
+        if self.remaining() != 0:
+            return False
+        self.cancel(f"超出时间预算（{self.max_seconds} 秒）", budget=True)
+        return True
+
+    def error(self):
+        """已取消时对应的异常实例"""
+        return (BudgetExceeded if self._budget else TaskCancelled)(self.reason)
+
+    def check(self):
+        """已取消或超出时间 / token 预算时抛出异常"""
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel(f"超出时间预算（{self.max_seconds} 秒）", budget=True)
+        if self.max_tokens and self.tokens >= self.max_tokens:
+            self.cancel(f"超出 token 预算（已用 {self.tokens} / {self.max_tokens}）", budget=True)
+        if self.cancelled:
+            raise self.error()
+
+    def stats(self):
+        return {"elapsed_s": round(time.monotonic() - self.started, 1), "tokens": self.tokens}
+
+
+class TaskRegistry:
+    """按会话登记正在运行的任务，供 cancel_task 事件在其他线程中取消"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.controls = {}  # session_id -> TaskControl
+
+    def register(self, session_id, control):
+        with self.lock:
+            self.controls[session_id] = control
+        return control
+
+    def unregister(self, session_id, control):
+        with self.lock:
+            if self.controls.get(session_id) is control:
+                del self.controls[session_id]
+
+    def cancel(self, session_id, reason="任务已取消"):
+        """取消会话正在运行的任务，没有运行中的任务时返回 False"""
+        with self.lock:
+            control = self.controls.get(session_id)
+        if control is None:
+            return False
+        control.cancel(reason)
+        return True
+
+
+def budget_from_request(data):
+    """从 run_task 事件读取本次任务的预算；客户端只能在配置的上限内调低，无效值忽略"""
+    limits = {"max_seconds": TASK_MAX_SECONDS, "max_steps": TASK_MAX_STEPS, "max_tokens": TASK_MAX_TOKENS}
+    budget = dict(limits)
+    for key, limit in limits.items():
+        value = (data or {}).get(key)
+        # 步数只接受整数（0.5 不应截断为 0 步，2.9 也不应悄悄变成 2 步）
+        types = int if key == "max_steps" else (int, float)
+        if isinstance(value, bool) or not isinstance(value, types) or value <= 0:
+            continue
+        budget[key] = min(value, limit) if limit else value
+    return budget
+
+
+# 全局运行中任务登记表
+running_tasks = TaskRegistry()
@@ -0,0 +1,6 @@
+# tests/conftest.py
+# 模块都位于仓库根目录（没有包结构），测试时把根目录加入 sys.path。
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,106 @@
+# tests/test_actions.py
+# actions.py：从模型回复中宽松地找出操作数组，并严格校验格式。
+import pytest
+
+from actions import (
+    Action,
+    ActionParseError,
+    compile_action,
+    compile_actions,
+    find_action_array,
+    parse_reply,
+    result_from_json,
+    result_to_json,
+)
+
+
+def test_find_array_ignores_surrounding_prose_and_brackets():
+    text = '分析：[步骤1] 先点击登录按钮。\n```json\n[{"action": "click", "coordinate": {"x": 0.5, "y": 0.4}}]\n```\n完毕 [注]'
+    assert find_action_array(text) == [{"action": "click", "coordinate": {"x": 0.5, "y": 0.4}}]
+
+
+def test_find_array_skips_unparseable_candidate():
+    text = '草稿 [{"action": "click", 写错了} 正式：[{"action": "wait"}]'
+    assert find_action_array(text) == [{"action": "wait"}]
+
+
+def test_find_array_accepts_single_object():
+    assert find_action_array('好的 {"action": "press_key", "key": "Enter"} 。') == {"action": "press_key", "key": "Enter"}
+
+
+def test_find_array_reports_json_syntax_error():
+    with pytest.raises(ActionParseError, match="JSON 语法错误"):
+        find_action_array('[{"action": "click", "coordinate": {"x": 0.5, "y": }}]')
+
+
+def test_find_array_without_json():
+    with pytest.raises(ActionParseError, match="没有找到"):
+        find_action_array("我无法判断下一步。")
+
+
+def test_parse_reply_done_marker_and_thinking():
+    assert parse_reply("<think>还没有 [{\"action\": \"wait\"}]</think>目标完成") is None
+    # 思考内容中的数组不会被当成操作
+    actions = parse_reply('<think>[{"action": "wait"}]</think>[{"action": "press_key", "key": " Enter "}]')
+    assert actions == (Action("press_key", (), None, "Enter", None, None, None),)
+
+
+def test_compile_normalizes_pixel_coordinates_with_image_size():
+    action = compile_action({"action": "click", "coordinate": {"x": 99.5, "y": 0.25}}, size=(200, 100))
+    assert action.points == ((0.5, 0.25),)
+
+
+@pytest.mark.parametrize("coordinate", [{"x": 1.5, "y": 0.5}, {"x": -0.1, "y": 0.5}])
+def test_compile_rejects_out_of_range_coordinates_without_size(coordinate):
+    with pytest.raises(ActionParseError, match="超出范围"):
+        compile_action({"action": "click", "coordinate": coordinate})
+
+
+def test_compile_clamps_pixel_coordinates_beyond_image():
+    action = compile_action({"action": "click", "coordinate": {"x": 500, "y": 10}}, size=(200, 100))
+    assert action.points[0][0] == 1.0
+
+
+@pytest.mark.parametrize("data, message", [
+    ({"action": "jump"}, "action 无效"),
+    ({"action": "click"}, "缺少 coordinate"),
+    ({"action": "click", "coordinate": {"x": "0.5", "y": 0.5}}, "缺少数值字段 x"),
+    ({"action": "type", "coordinate": {"x": 0.5, "y": 0.5}, "text": ""}, "缺少非空的 text"),
+    ({"action": "press_key"}, "缺少 key"),
+    ({"action": "wait", "duration": -1}, "duration"),
+    ({"action": "click", "coordinate": {"x": 0.5, "y": 0.5}, "element": True}, "element"),
+    ({"action": "click", "coordinate": {"x": 0.5, "y": 0.5}, "confidence": 1.2}, "confidence"),
+    ("click", "不是 JSON 对象"),
+])
+def test_compile_rejects_bad_schema(data, message):
+    with pytest.raises(ActionParseError, match=message):
+        compile_action(data)
+
+
+def test_compile_actions_collects_every_error_with_position():
+    with pytest.raises(ActionParseError) as info:
+        compile_actions([{"action": "press_key"}, {"action": "wait"}, {"action": "type", "coordinate": {"x": 0, "y": 0}}])
+    assert len(info.value.errors) == 2
+    assert info.value.errors[0].startswith("第 1 个操作（press_key）")
+    assert info.value.errors[1].startswith("第 3 个操作（type）")
+
+
+def test_compile_actions_rejects_empty():
+    with pytest.raises(ActionParseError, match="为空"):
+        compile_actions([])
+
+
+def test_compile_accepts_nested_coordinate_and_string_element():
+    action = compile_action({"action": "swipe", "coordinate": {"swipe": {"x1": 0, "y1": 0.1, "x2": 1, "y2": 0.9}}})
+    assert action.points == ((0.0, 0.1), (1.0, 0.9))
+    assert compile_action({"action": "hover", "coordinate": {"x": 0.1, "y": 0.1}, "element": " 7 "}).element == 7
+
+
+def test_result_json_round_trip():
+    actions = compile_actions([{"action": "type", "coordinate": {"x": 0.12345, "y": 0.5}, "text": 42},
+                               {"action": "wait"}])
+    result = {"status": "action", "data": actions}
+    restored = result_from_json(result_to_json(result))
+    assert restored["data"][0] == actions[0]._replace(points=((0.1235, 0.5),))
+    assert restored["data"][0].text == "42"
+    assert restored["data"][1].duration == 1000
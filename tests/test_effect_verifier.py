@@ -0,0 +1,104 @@
+# tests/test_effect_verifier.py
+# effect_verifier.py：用合成的灰度数组校验变化判定（视口 400x300，局部区域 128x128）
+import io
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from effect_verifier import LOCAL, NAVIGATION, NO_EFFECT, EffectVerifier, changed_mask, classify, local_ratio
+from actions import Action
+
+WIDTH, HEIGHT = 400, 300
+
+
+def blank(value=200):
+    return np.full((HEIGHT, WIDTH), value, dtype=np.uint8)
+
+
+def painted(x, y, size, value=20):
+    """在 (x, y) 处画一个 size x size 的深色方块"""
+    frame = blank()
+    frame[y:y + size, x:x + size] = value
+    return frame
+
+
+def test_identical_frames_have_no_effect():
+    effect = classify(blank(), blank(), [(0.5, 0.5)])
+    assert effect == (NO_EFFECT, 0.0, 0.0)
+
+
+def test_small_differences_below_threshold_are_ignored():
+    after = blank() + 10  # 抗锯齿级别的灰度差
+    assert classify(blank(), after, [(0.5, 0.5)]).kind == NO_EFFECT
+
+
+def test_change_near_point_is_local():
+    # 20x20 = 400 像素：全局比例不足 0.005，但占局部区域 128x128 的 2.4%
+    after = painted(190, 140, 20)
+    effect = classify(blank(), after, [(0.5, 0.5)])
+    assert effect.kind == LOCAL
+    assert effect.local_ratio == pytest.approx(400 / 128 ** 2, abs=1e-4)
+    assert effect.global_ratio < 0.005
+
+
+def test_same_change_away_from_point_has_no_effect():
+    after = painted(190, 140, 20)
+    assert classify(blank(), after, [(0.05, 0.05)]).kind == NO_EFFECT
+    assert classify(blank(), after).kind == NO_EFFECT
+
+
+def test_any_point_can_match():
+    after = painted(190, 140, 20)
+    assert classify(blank(), after, [(0.05, 0.05), (0.5, 0.5)]).kind == LOCAL
+
+
+def test_change_elsewhere_in_viewport_is_local():
+    # 30x30 = 900 像素，全局比例 0.0075，操作点附近没有变化（如页面角落的提示）
+    after = painted(0, 0, 30)
+    effect = classify(blank(), after, [(0.9, 0.9)])
+    assert effect.kind == LOCAL and effect.local_ratio == 0.0
+
+
+def test_large_change_is_navigation():
+    after = blank()
+    after[:200] = 20  # 三分之二的视口
+    assert classify(blank(), after, [(0.5, 0.5)]).kind == NAVIGATION
+
+
+def test_shape_mismatch_is_navigation():
+    assert classify(blank(), np.zeros((HEIGHT, WIDTH + 1), dtype=np.uint8)) == (NAVIGATION, 1.0, 1.0)
+
+
+def test_changed_mask_does_not_wrap_around():
+    before = np.array([[10, 250]], dtype=np.uint8)
+    after = np.array([[250, 10]], dtype=np.uint8)
+    assert changed_mask(before, after).tolist() == [[True, True]]
+    # 差值为 1 的像素在 uint8 相减时会回绕成 255
+    assert not changed_mask(np.array([[1]], dtype=np.uint8), np.array([[0]], dtype=np.uint8)).any()
+
+
+def test_local_ratio_clips_region_at_edges():
+    mask = np.zeros((HEIGHT, WIDTH), dtype=bool)
+    mask[:64, :64] = True
+    assert local_ratio(mask, (0.0, 0.0)) == 1.0
+    assert local_ratio(mask, (1.0, 1.0)) == 0.0
+
+
+def png(frame):
+    Image = pytest.importorskip("PIL.Image")
+    buffer = io.BytesIO()
+    Image.fromarray(frame).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_verifier_compares_against_latest_frame():
+    verifier = EffectVerifier(enabled=True, retries=1)
+    click = [Action("click", ((0.5, 0.5),), None, None, None, None, None)]
+    verifier.seed(png(blank()))
+    assert verifier.wants(click)
+    changed = png(painted(190, 140, 20))
+    assert verifier.check(click, changed).kind == LOCAL
+    # 基准已更新为上一帧，同一画面再次比较没有变化
+    assert verifier.check(click, changed).kind == NO_EFFECT
+    assert verifier.counters[LOCAL] == 1 and verifier.counters[NO_EFFECT] == 1
@@ -0,0 +1,154 @@
+# tests/test_llm_client.py
+# llm_client.py：令牌桶、退避重试与截止时间。用假时钟代替 time 模块，不真正等待，也不发起网络请求。
+import pytest
+
+import llm_client
+from llm_client import (
+    DeadlineExceededError,
+    LLMClient,
+    LLMError,
+    LLMProvider,
+    LLMResponse,
+    RateLimitedError,
+    StreamChunk,
+    TokenBucket,
+    TransientLLMError,
+)
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 3))
+        self.now += seconds
+
+
+class ScriptedProvider(LLMProvider):
+    """按顺序返回预设结果：异常实例抛出，其余作为回复内容"""
+
+    name = "scripted"
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def chat(self, model, messages, **kwargs):
+        self.calls.append(kwargs)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return LLMResponse(outcome, {}, model)
+
+    def chat_stream(self, model, messages, **kwargs):
+        self.calls.append(kwargs)
+        outcome = self.outcomes.pop(0)
+        for part in outcome:
+            if isinstance(part, Exception):
+                raise part
+            yield StreamChunk(part, None)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(llm_client, "time", fake)
+    # full jitter 取上限，退避时间确定
+    monkeypatch.setattr(llm_client.random, "uniform", lambda low, high: high)
+    return fake
+
+
+def make_client(outcomes, **kwargs):
+    options = {"rate_per_sec": 0, "max_retries": 2, "backoff_base": 1.0, "backoff_max": 3.0}
+    options.update(kwargs)
+    return LLMClient(ScriptedProvider(outcomes), **options)
+
+
+def test_token_bucket_allows_burst_then_paces(clock):
+    bucket = TokenBucket(rate=2, capacity=2)
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == pytest.approx(0.5)
+    clock.now += 10  # 长时间空闲后最多补满容量
+    assert [bucket.acquire() for _ in range(2)] == [0.0, 0.0]
+    assert bucket.acquire() == pytest.approx(0.5)
+
+
+def test_token_bucket_disabled_without_rate(clock):
+    bucket = TokenBucket(rate=0, capacity=1)
+    assert [bucket.acquire() for _ in range(5)] == [0.0] * 5
+    assert clock.sleeps == []
+
+
+def test_retries_transient_errors_with_exponential_backoff(clock):
+    client = make_client([TransientLLMError("502"), TransientLLMError("timeout"), "ok"])
+    assert client.chat([], model="m").content == "ok"
+    assert clock.sleeps == [1.0, 2.0]
+    assert client.stats == {"requests": 3, "retries": 2, "rate_limited": 0, "failures": 0}
+
+
+def test_backoff_is_capped_and_respects_retry_after(clock):
+    client = make_client([RateLimitedError("429", retry_after=5), TransientLLMError("x"), TransientLLMError("x"),
+                          TransientLLMError("x"), "ok"], max_retries=4)
+    assert client.chat([], model="m").content == "ok"
+    # 第一次以 Retry-After 为下限；之后 1、2、4 -> 上限 3
+    assert clock.sleeps == [5.0, 2.0, 3.0, 3.0]
+    assert client.stats["rate_limited"] == 1
+
+
+def test_gives_up_after_max_retries(clock):
+    client = make_client([TransientLLMError("x")] * 3)
+    with pytest.raises(TransientLLMError):
+        client.chat([], model="m")
+    assert client.stats["retries"] == 2 and client.stats["failures"] == 1
+
+
+def test_non_retryable_error_fails_immediately(clock):
+    client = make_client([LLMError("400"), "unused"])
+    with pytest.raises(LLMError):
+        client.chat([], model="m")
+    assert clock.sleeps == []
+    assert client.stats["failures"] == 1
+
+
+def test_deadline_limits_attempt_timeout_and_stops_retries(clock):
+    client = make_client([TransientLLMError("x"), "unused"])
+    with pytest.raises(DeadlineExceededError):
+        client.chat([], model="m", deadline=clock.now + 0.5)
+    # 本次请求的超时不超过剩余时间；退避 1 秒会越过截止时间，不再重试
+    assert client.provider.calls[0]["timeout"] == pytest.approx(0.5)
+    assert clock.sleeps == []
+
+
+def test_expired_deadline_raises_before_request(clock):
+    client = make_client(["unused"])
+    with pytest.raises(DeadlineExceededError):
+        client.chat([], model="m", deadline=clock.now)
+    assert client.provider.calls == []
+
+
+def test_stream_retries_only_before_first_chunk(clock):
+    client = make_client([[TransientLLMError("x")], ["a", "b"]])
+    assert [chunk.content for chunk in client.chat_stream([], model="m")] == ["a", "b"]
+    assert client.stats["retries"] == 1
+
+    client = make_client([["a", TransientLLMError("x")], ["a", "b"]])
+    received = []
+    with pytest.raises(TransientLLMError):
+        for chunk in client.chat_stream([], model="m"):
+            received.append(chunk.content)
+    assert received == ["a"]
+    assert client.stats["retries"] == 0
+
+
+def test_tenant_slot_released_after_failure(clock):
+    client = make_client([LLMError("400")], tenant_concurrency=1)
+    with pytest.raises(LLMError):
+        client.chat([], model="m", tenant="s1")
+    client.provider.outcomes.append("ok")
+    assert client.chat([], model="m", tenant="s1").content == "ok"
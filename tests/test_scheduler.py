@@ -0,0 +1,133 @@
+# tests/test_scheduler.py
+# scheduler.py：直接调用 next_task / task_done 模拟工作线程，不启动线程，结果确定。
+import pytest
+
+from scheduler import FairScheduler, SchedulerBusy
+
+
+def job():
+    pass
+
+
+def make(**kwargs):
+    options = {"workers": 2, "max_pending_per_session": 4, "max_pending": 8, "default_task_seconds": 2.0}
+    options.update(kwargs)
+    return FairScheduler(**options)
+
+
+def run_next(scheduler, worker_id=0):
+    """取出并立即完成一个任务，返回其会话与参数"""
+    task = scheduler.next_task(worker_id, timeout=0)
+    assert task is not None
+    scheduler.task_done(task)
+    return task.session_id, task.args
+
+
+def test_round_robin_across_sessions():
+    scheduler = make()
+    for n in range(3):
+        scheduler.submit("a", job, (n,))
+    scheduler.submit("b", job, (0,))
+    scheduler.submit("c", job, (0,))
+    order = [run_next(scheduler) for _ in range(5)]
+    assert order == [("a", (0,)), ("b", (0,)), ("c", (0,)), ("a", (1,)), ("a", (2,))]
+    assert scheduler.next_task(0, timeout=0) is None
+
+
+def test_weight_allows_consecutive_tasks():
+    scheduler = make()
+    scheduler.set_weight("a", 2)
+    for n in range(3):
+        scheduler.submit("a", job, (n,))
+    scheduler.submit("b", job)
+    assert [run_next(scheduler)[0] for _ in range(4)] == ["a", "a", "b", "a"]
+
+
+def test_same_session_runs_serially_and_sticks_to_its_worker():
+    scheduler = make()
+    scheduler.submit("a", job, (0,))
+    scheduler.submit("a", job, (1,))
+    first = scheduler.next_task(0, timeout=0)
+    # a 正在执行：其他线程和本线程都取不到 a 的下一个任务
+    assert scheduler.next_task(1, timeout=0) is None
+    scheduler.task_done(first)
+    # 亲和：a 已绑定线程 0
+    assert scheduler.next_task(1, timeout=0) is None
+    assert scheduler.next_task(0, timeout=0).args == (1,)
+    assert scheduler.worker_of("a") == 0
+
+
+def test_release_clears_affinity():
+    scheduler = make()
+    scheduler.submit("a", job)
+    scheduler.task_done(scheduler.next_task(0, timeout=0), release=True)
+    assert scheduler.worker_of("a") is None
+    scheduler.submit("a", job)
+    assert scheduler.next_task(1, timeout=0) is not None
+
+
+def test_per_session_limit_raises_busy():
+    scheduler = make(max_pending_per_session=2)
+    scheduler.submit("a", job)
+    scheduler.submit("a", job)
+    with pytest.raises(SchedulerBusy):
+        scheduler.submit("a", job)
+    # 清理任务不受上限限制
+    scheduler.submit("a", job, bounded=False)
+    assert scheduler.stats()["rejected"] == 1
+    assert scheduler.stats()["pending"] == 3
+
+
+def test_global_limit_raises_busy():
+    scheduler = make(max_pending=3)
+    for session_id in ("a", "b", "c"):
+        scheduler.submit(session_id, job)
+    with pytest.raises(SchedulerBusy):
+        scheduler.submit("d", job)
+
+
+def test_discard_removes_only_pending_matching_tasks():
+    scheduler = make()
+    scheduler.submit("a", job, ("keep",))
+    scheduler.submit("a", job, ("drop",))
+    scheduler.submit("a", job, ("drop",))
+    running = scheduler.next_task(0, timeout=0)
+    assert scheduler.discard("a", lambda task: task.args == ("drop",)) == 2
+    scheduler.task_done(running)
+    assert scheduler.next_task(0, timeout=0) is None
+    scheduler.submit("a", job)
+    assert scheduler.discard("a") == 1
+    assert scheduler.discard("missing") == 0
+
+
+def test_queue_position_notifications():
+    scheduler = make(workers=1)
+    updates = []
+    scheduler.on_queue_update = lambda session_id, info: updates.append((session_id, info["position"]))
+    info = scheduler.submit("a", job)
+    assert info == {"position": 1, "eta_s": 0.0, "pending": 1}
+    # 排在前面的任务按默认耗时估算等待时间
+    assert scheduler.submit("b", job) == {"position": 2, "eta_s": 2.0, "pending": 1}
+    assert scheduler.submit("c", job)["position"] == 3
+
+    task = scheduler.next_task(0, timeout=0)
+    # a 开始执行（队列已空，位置 0）；b、c 各前进一位
+    assert sorted(updates) == [("a", 0), ("b", 1), ("c", 2)]
+
+    updates.clear()
+    scheduler.discard("b")
+    # 被清空的会话收到位置 0，后面的会话前进一位
+    assert updates == [("b", 0), ("c", 1)]
+
+    updates.clear()
+    scheduler.task_done(task)
+    assert updates == [("c", 1)]
+
+
+def test_stop_drains_submitted_tasks_then_stops():
+    scheduler = make()
+    scheduler.submit("a", job)
+    scheduler.stop()
+    scheduler.task_done(scheduler.next_task(0, timeout=0))
+    with pytest.raises(StopIteration):
+        scheduler.next_task(0, timeout=0)
@@ -0,0 +1,98 @@
+# tests/test_screenshot_store.py
+# screenshot_store.py：内容寻址去重、写盘后回调，以及按保存时间 / 总大小回收（受保护期限制）。
+import os
+import time
+
+from screenshot_store import GC_GRACE_SECONDS, ScreenshotStore
+
+
+def make(tmp_path, **kwargs):
+    # gc_interval 足够大，回收只在测试显式调用 gc() 时发生
+    options = {"root": str(tmp_path / "shots"), "fmt": "png", "max_bytes": 0, "max_age": 0, "gc_interval": 10 ** 9}
+    options.update(kwargs)
+    return ScreenshotStore(**options)
+
+
+def age(store, path, seconds):
+    """把截图的最近使用时间调到 seconds 秒之前"""
+    entry = next(e for e in store._index.values() if e["path"] == path)
+    entry["last_used"] = time.time() - seconds
+
+
+def test_put_deduplicates_and_notifies_after_write(tmp_path):
+    store = make(tmp_path)
+    written = []
+    first = store.put(b"frame-1", lambda path: written.append((path, os.path.exists(path))))
+    second = store.put(b"frame-1", lambda path: written.append((path, os.path.exists(path))))
+    store.flush()
+    assert first == second
+    assert written == [(first, True), (first, True)]
+    assert store.stats()["writes"] == 1 and store.stats()["dedup_hits"] == 1
+    with open(first, "rb") as f:
+        assert f.read() == b"frame-1"
+
+
+def test_gc_removes_expired_but_keeps_grace_period(tmp_path):
+    store = make(tmp_path, max_age=10)
+    old = store.put(b"old")
+    recent = store.put(b"recent")
+    store.flush()
+    age(store, old, GC_GRACE_SECONDS + 100)
+    # 超过保存时间但仍在保护期内（刚返回给前端）的不回收
+    age(store, recent, GC_GRACE_SECONDS / 2)
+    assert store.gc() == 1
+    assert not os.path.exists(old)
+    assert os.path.exists(recent)
+
+
+def test_gc_evicts_least_recently_used_down_to_budget(tmp_path):
+    store = make(tmp_path, max_bytes=10)
+    paths = [store.put(bytes([n]) * 4) for n in range(4)]  # 共 16 字节
+    store.flush()
+    for n, path in enumerate(paths):
+        age(store, path, GC_GRACE_SECONDS + 100 - n)    # paths[0] 最久未使用
+    assert store.gc() == 2
+    assert [os.path.exists(p) for p in paths] == [False, False, True, True]
+    assert store.stats()["total_bytes"] == 8
+
+
+def test_gc_over_budget_never_removes_files_in_grace_period(tmp_path):
+    store = make(tmp_path, max_bytes=4)
+    paths = [store.put(bytes([n]) * 4) for n in range(3)]
+    store.flush()
+    age(store, paths[0], GC_GRACE_SECONDS + 100)
+    assert store.gc() == 1
+    assert [os.path.exists(p) for p in paths] == [False, True, True]
+
+
+def test_early_gc_when_over_budget_waits_for_grace_period(tmp_path):
+    store = make(tmp_path, max_bytes=4)
+    store.put(b"12345")
+    assert not store._gc_due(time.time())
+    store._last_gc -= GC_GRACE_SECONDS
+    assert store._gc_due(time.time())
+    assert not store._gc_due(time.time())  # 已排队的回收完成前不重复提交
+
+
+def test_index_is_rebuilt_from_disk(tmp_path):
+    store = make(tmp_path)
+    path = store.put(b"persisted")
+    store.flush()
+    reopened = make(tmp_path)
+    assert reopened.put(b"persisted") == path
+    assert reopened.stats()["dedup_hits"] == 1
+    assert reopened.stats()["total_bytes"] == len(b"persisted")
+
+
+def test_gc_removes_expired_manifests(tmp_path):
+    store = make(tmp_path, max_age=10)
+    run = store.begin_run("task")
+    run.save(b"frame", "step1_input")
+    manifest = run.close("done")
+    store.flush()
+    day = os.path.dirname(manifest)
+    past = time.time() - 100
+    os.utime(manifest, (past, past))
+    os.utime(day, (past, past))
+    store.gc()
+    assert not os.path.exists(day)
@@ -0,0 +1,85 @@
+# tests/test_step_actions.py
+# step_actions.py：三个任务循环共用的分组、失败说明、校验条件与截图时机
+import pytest
+
+from actions import compile_actions
+from step_actions import StepActions
+
+
+class History:
+    def __init__(self):
+        self.failures = []
+
+    def note_failure(self, step, note):
+        self.failures.append((step, note))
+
+
+class Verifier:
+    def wants(self, actions):
+        return True
+
+
+ACTIONS = compile_actions([
+    {"action": "type", "coordinate": {"x": 0.1, "y": 0.1}, "text": "a"},
+    {"action": "click", "coordinate": {"x": 0.5, "y": 0.5}},
+    {"action": "press_key", "key": "Tab"},
+])
+
+
+def run(step, batches, results=None):
+    """按顺序执行各组，返回每组的 (label, 是否校验, last, substep_idx)"""
+    trace = []
+    for batch in batches:
+        label = step.label(batch)
+        verify = step.record(batch, results.pop(0) if results else [True] * len(batch))
+        step.advance(batch)
+        trace.append((label, verify, step.last, step.substep_idx))
+    return trace
+
+
+@pytest.mark.parametrize("batching, expected", [
+    (True, [("第 1-3 个操作", True, True, 2)]),
+    (False, [("第 1 个操作", True, False, 0), ("第 2 个操作", True, False, 1), ("第 3 个操作", True, True, 2)]),
+])
+def test_batches_without_streaming(batching, expected):
+    step = StepActions(0, History(), verifier=Verifier(), batching=batching)
+    assert run(step, step.batches(ACTIONS)) == expected
+
+
+def test_streamed_actions_are_not_repeated():
+    step = StepActions(0, History(), verifier=Verifier(), batching=True)
+    # 流式阶段总数未知，都不算最后一个操作
+    assert run(step, [[ACTIONS[0]]]) == [("第 1 个操作", True, False, 0)]
+    assert run(step, step.batches(ACTIONS)) == [("第 2-3 个操作", True, True, 2)]
+    # 全部已在流式阶段执行时没有剩余分组，由 capture.finish() 补最终截图
+    step = StepActions(0, History(), batching=True)
+    run(step, [[action] for action in ACTIONS])
+    assert step.batches(ACTIONS) == [] and step.executed == 3
+
+
+def test_failures_are_noted_and_skip_verification():
+    class Plan:
+        failed = 0
+
+        def action_failed(self):
+            self.failed += 1
+
+    history, plan = History(), Plan()
+    step = StepActions(1, history, plan, Verifier(), batching=True)
+    assert run(step, step.batches(ACTIONS), [[True, False, False]])[0][1] is True
+    assert history.failures == [(2, "第 2 个操作未能执行"), (2, "第 3 个操作未能执行")]
+    assert plan.failed == 2
+    # 整组都未能执行时画面不会变化，不校验
+    step = StepActions(1, History(), verifier=Verifier(), batching=False)
+    assert [verify for _, verify, _, _ in run(step, step.batches(ACTIONS), [[False], [True], [False]])] == \
+        [False, True, False]
+
+
+def test_elements_dropped_after_page_may_change():
+    elements = [{"id": 1}]
+    step = StepActions(0, History(), elements=elements, batching=False)
+    batches = step.batches(ACTIONS)
+    run(step, batches[:1])
+    assert step.elements is elements  # 输入之后页面不会跳转，仍按截图时的元素吸附
+    run(step, batches[1:2])
+    assert step.elements is None
@@ -0,0 +1,72 @@
+# tests/test_stream_parser.py
+# stream_parser.py：流式输出逐块喂入，操作对象一闭合就产出，结果与分块方式无关。
+import pytest
+
+from actions import find_action_array
+from stream_parser import IncrementalActionParser
+
+REPLY = ('<think>先看看 [页面] 再说 {"x": 1}</think>我会点击"提交]"按钮：\n'
+         '[{"action": "type", "coordinate": {"x": 0.2, "y": 0.3}, "text": "a \\"quoted\\" [text] {x}"},\n'
+         ' {"action": "click", "coordinate": {"x": 0.5, "y": 0.6}}]\n之后 [{"action": "wait"}]')
+
+
+def feed_all(chunks):
+    parser = IncrementalActionParser()
+    produced = []
+    for chunk in chunks:
+        produced.append(parser.feed(chunk))
+    return parser, produced
+
+
+def split(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 64, len(REPLY)])
+def test_result_independent_of_chunk_boundaries(size):
+    parser, _ = feed_all(split(REPLY, size))
+    assert parser.finished
+    assert parser.errors == []
+    # 只取第一个操作数组，与完整回复的解析结果一致；思考内容与推理文字中的括号不影响
+    assert parser.actions == find_action_array(REPLY.split("</think>", 1)[1])
+
+
+def test_actions_are_yielded_as_soon_as_they_close():
+    first = '[{"action": "click", "coordinate": {"x": 0.1, "y": 0.1}}'
+    parser, produced = feed_all([first, ', {"action": "wait"', "}]"])
+    assert produced == [[{"action": "click", "coordinate": {"x": 0.1, "y": 0.1}}], [], [{"action": "wait"}]]
+
+
+def test_bracket_at_chunk_end_waits_for_next_character():
+    parser, produced = feed_all(["步骤 [", "1] 然后 [", "  ", '{"action": "wait"}]'])
+    assert produced[-1] == [{"action": "wait"}]
+    assert parser.finished
+
+
+def test_think_tag_split_across_chunks_is_ignored():
+    parser, _ = feed_all(["<thi", 'nk>[{"action": "click"}]</th', 'ink>[{"action": "wait"}]'])
+    assert parser.actions == [{"action": "wait"}]
+
+
+def test_escape_split_across_chunks():
+    parser, _ = feed_all(['[{"action": "type", "text": "a\\', '"}"}]'])
+    assert parser.actions == [{"action": "type", "text": 'a"}'}]
+
+
+def test_malformed_object_is_reported_and_parsing_continues():
+    parser, _ = feed_all(['[{"action": "click", "coordinate": {"x": .5}}, {"action": "wait"}]'])
+    assert parser.actions == [{"action": "wait"}]
+    assert len(parser.errors) == 1 and "无法解析的操作对象" in parser.errors[0]
+
+
+def test_unterminated_array_is_not_finished():
+    parser, _ = feed_all(['[{"action": "wait"}, {"action": "cli'])
+    assert not parser.finished
+    assert parser.actions == [{"action": "wait"}]
+
+
+def test_done_marker_outside_thinking():
+    parser, _ = feed_all(["<think>目标完成了吗？</think>", "目标", "完成"])
+    assert parser.done_marker_seen
+    parser, _ = feed_all(["<think>目标完成了吗？</think>", "还没有"])
+    assert not parser.done_marker_seen
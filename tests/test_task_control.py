@@ -0,0 +1,29 @@
+# tests/test_task_control.py
+# task_control.budget_from_request：客户端只能在配置的上限内调低预算，无效值忽略
+import pytest
+
+from config import TASK_MAX_SECONDS, TASK_MAX_STEPS, TASK_MAX_TOKENS
+from task_control import budget_from_request
+
+DEFAULTS = {"max_seconds": TASK_MAX_SECONDS, "max_steps": TASK_MAX_STEPS, "max_tokens": TASK_MAX_TOKENS}
+
+
+def test_defaults_without_overrides():
+    assert budget_from_request({}) == DEFAULTS
+    assert budget_from_request(None) == DEFAULTS
+
+
+def test_lower_values_are_accepted_and_higher_ones_clamped():
+    budget = budget_from_request({"max_seconds": 1.5, "max_steps": 1, "max_tokens": TASK_MAX_TOKENS * 10})
+    assert budget == {"max_seconds": 1.5, "max_steps": 1, "max_tokens": TASK_MAX_TOKENS}
+
+
+@pytest.mark.parametrize("value", [0, -1, 0.5, 2.9, True, "3", None])
+def test_invalid_max_steps_is_ignored(value):
+    assert budget_from_request({"max_steps": value})["max_steps"] == TASK_MAX_STEPS
+
+
+@pytest.mark.parametrize("key", ["max_seconds", "max_tokens"])
+@pytest.mark.parametrize("value", [0, -5, False, "10"])
+def test_invalid_limits_are_ignored(key, value):
+    assert budget_from_request({key: value})[key] == DEFAULTS[key]
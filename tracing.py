@@ -0,0 +1,241 @@
+# tracing.py
+# 分段耗时追踪：任务执行中的每个阶段（截图、页面稳定等待、编码、模型调用、解析、操作执行、队列等待）
+# 记录为一个 span。所有 span 的耗时汇总为 Prometheus 直方图（见 app.py 的 /metrics），
+# 属于某次任务的 span 另外按树形结构写入该任务的 JSON 追踪文件。
+# TRACING_ENABLED=False 时 span() 返回共享的空上下文管理器，开销只有一次函数调用。
+#
+# 用法:
+#   with start_trace("task", task=task_desc) as trace:
+#       with span("step", step=1):
+#           with span("llm.request"):
+#               ...
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from config import TRACING_ENABLED, TRACE_DIR
+
+logger = logging.getLogger(__name__)
+
+# 直方图分桶（秒）：覆盖从毫秒级的页面操作到数十秒的模型调用
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current_trace = contextvars.ContextVar("a2i_trace", default=None)
+_current_span = contextvars.ContextVar("a2i_span", default=None)
+
+
+class MetricsRegistry:
+    """线程安全的直方图与计数器，按 Prometheus 文本格式导出"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}   # span 名称 -> [各桶计数..., count, sum]
+        self._counters = defaultdict(float)
+        self._collectors = []
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def register_collector(self, collector):
+        """注册在导出时调用的函数，返回 {指标名: 数值}，作为 gauge 导出（例如连接池状态）"""
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = ["# HELP a2i_span_duration_seconds Duration of traced spans.",
+                 "# TYPE a2i_span_duration_seconds histogram"]
+        with self._lock:
+            histograms = {name: list(values) for name, values in self._histograms.items()}
+            counters = dict(self._counters)
+        for name in sorted(histograms):
+            values = histograms[name]
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'a2i_span_duration_seconds_bucket{{span="{name}",le="{bound}"}} {count}')
+            lines.append(f'a2i_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {values[-2]}')
+            lines.append(f'a2i_span_duration_seconds_count{{span="{name}"}} {values[-2]}')
+            lines.append(f'a2i_span_duration_seconds_sum{{span="{name}"}} {values[-1]:.6f}')
+        for name in sorted(counters):
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {counters[name]:g}")
+        for collector in self._collectors:
+            try:
+                gauges = collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+                continue
+            for name, value in sorted(gauges.items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"# TYPE {name} gauge")
+                    lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+class Trace:
+    """一次任务执行的追踪记录；结束时写入 TRACE_DIR/<日期>/<trace_id>.json"""
+
+    def __init__(self, name, **attrs):
+        self.trace_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        self.name = name
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+        self._token = None
+        self.path = None
+
+    def add(self, record):
+        with self._lock:
+            self.spans.append(record)
+
+    def offset_ms(self, perf_time):
+        return round((perf_time - self.started) * 1000, 3)
+
+    def to_dict(self, status=None):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start_ms"])
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "attrs": self.attrs,
+            "status": status,
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at)),
+            "duration_ms": self.offset_ms(time.perf_counter()),
+            "spans": spans,
+        }
+
+    def finish(self, status=None):
+        """结束追踪，返回写入的文件路径（未启用追踪或未配置 TRACE_DIR 时为 None）"""
+        if not TRACING_ENABLED:
+            return None
+        metrics.observe(self.name, time.perf_counter() - self.started)
+        if self._token is not None:
+            _current_trace.reset(self._token)
+            self._token = None
+        if not TRACE_DIR:
+            return None
+        directory = os.path.join(TRACE_DIR, self.trace_id[:8])
+        self.path = os.path.join(directory, f"{self.trace_id}.json")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.to_dict(status), f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            logger.warning(f"Failed to write trace {self.trace_id}: {e}")
+            self.path = None
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish("error" if exc_type else None)
+        return False
+
+
+class _Span:
+    __slots__ = ("name", "attrs", "started", "span_id", "_token")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """在 span 结束前补充属性，例如模型返回的 token 数"""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.span_id = uuid.uuid4().hex[:8]
+        self._token = _current_span.set(self.span_id)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        ended = time.perf_counter()
+        _current_span.reset(self._token)
+        parent = _current_span.get()
+        metrics.observe(self.name, ended - self.started)
+        trace = _current_trace.get()
+        if trace is not None:
+            record = {"name": self.name, "span_id": self.span_id, "parent": parent,
+                      "start_ms": trace.offset_ms(self.started),
+                      "duration_ms": round((ended - self.started) * 1000, 3)}
+            if self.attrs:
+                record["attrs"] = self.attrs
+            if exc_type is not None:
+                record["error"] = f"{exc_type.__name__}: {exc}"
+            trace.add(record)
+        return False
+
+
+class _NoopSpan:
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name, **attrs):
+    """记录一个阶段的耗时；未启用追踪时返回空操作"""
+    if not TRACING_ENABLED:
+        return _NOOP_SPAN
+    return _Span(name, attrs)
+
+
+def start_trace(name, **attrs):
+    """开始一次任务的追踪，之后在同一线程（或 asyncio 任务）中创建的 span 都归入该追踪"""
+    trace = Trace(name, **attrs)
+    if TRACING_ENABLED:
+        trace._token = _current_trace.set(trace)
+    return trace
+
+
+def record_span(name, started, **attrs):
+    """记录一个从 started（time.perf_counter()）到现在的阶段，不改变当前 span。
+
+    用于无法用 with 包住的阶段，例如跨越多次 yield 的流式响应。
+    """
+    if not TRACING_ENABLED:
+        return
+    ended = time.perf_counter()
+    metrics.observe(name, ended - started)
+    trace = _current_trace.get()
+    if trace is not None:
+        record = {"name": name, "span_id": uuid.uuid4().hex[:8], "parent": _current_span.get(),
+                  "start_ms": trace.offset_ms(started), "duration_ms": round((ended - started) * 1000, 3)}
+        if attrs:
+            record["attrs"] = attrs
+        trace.add(record)
+
+
+def observe(name, seconds):
+    """记录在 span 之外测得的耗时，例如任务在队列中的等待时间"""
+    if TRACING_ENABLED:
+        metrics.observe(name, seconds)
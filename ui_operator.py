@@ -1,139 +1,261 @@
+import base64
+from collections import namedtuple
+
 from playwright.sync_api import sync_playwright
-from config import TARGET_URL
+from config import (TARGET_URL, DOM_GROUNDING_MAX_ELEMENTS, HIGHLIGHT_ENABLED, HIGHLIGHT_DURATION_MS, TYPE_FAST_FILL,
+                    BROWSER_CALL_TIMEOUT_MS)
+from settle import SettleDetector, SETTLE_INIT_SCRIPT
+from tracing import span
+from dom_grounding import ELEMENT_MAP_JS, parse_elements, snap_action
+from actions import Action, ActionParseError, compile_action
+
+VIEWPORT = {"width": 1280, "height": 720}
+
+# 解析后的操作：points 为像素坐标列表（swipe 有起点和终点两个点）
+ResolvedAction = namedtuple("ResolvedAction", ["action", "points", "text", "key", "duration"])
+
+
+# 坐标标记：通过 context.add_init_script 常驻每个页面，只创建一次节点。
+# 标记放在封闭的 shadow root 中，更新它不会被页面稳定检测的 MutationObserver 看到；
+# Playwright 的 mouse.click / move 会先派发 mousemove，标记直接随鼠标事件移动，执行操作时无需额外的 evaluate。
+HIGHLIGHT_INIT_SCRIPT = """
+(() => {
+    if (window.__a2iHighlight) return;
+    let dot = null, label = null, timer = null;
+    const install = () => {
+        if (dot) return true;
+        if (!document.documentElement) return false;
+        const host = document.createElement("a2i-overlay");
+        host.style.cssText = "position: fixed; left: 0; top: 0; width: 0; height: 0; z-index: 2147483647; pointer-events: none;";
+        const root = host.attachShadow({ mode: "closed" });
+        root.innerHTML = `
+            <div id="dot" style="position: fixed; left: 0; top: 0; width: 6px; height: 6px; border-radius: 50%;
+                background: red; display: none;"></div>
+            <div id="label" style="position: fixed; left: 0; top: 0; font: 10px sans-serif; background: rgba(0,0,0,0.7);
+                color: white; padding: 1px 4px; border-radius: 3px; display: none;"></div>`;
+        dot = root.getElementById("dot");
+        label = root.getElementById("label");
+        document.documentElement.appendChild(host);
+        return true;
+    };
+    const show = (x, y, duration) => {
+        if (!install()) return;
+        dot.style.transform = `translate(${x - 3}px, ${y - 3}px)`;
+        label.style.transform = `translate(${x + 8}px, ${y - 6}px)`;
+        label.textContent = `(${x},${y})`;
+        dot.style.display = label.style.display = "block";
+        clearTimeout(timer);
+        timer = setTimeout(() => { dot.style.display = label.style.display = "none"; }, duration);
+    };
+    window.__a2iHighlight = show;
+    const onMouse = e => show(Math.round(e.clientX), Math.round(e.clientY), HIGHLIGHT_MS);
+    window.addEventListener("mousemove", onMouse, { capture: true, passive: true });
+    window.addEventListener("mousedown", onMouse, { capture: true, passive: true });
+})();
+""".replace("HIGHLIGHT_MS", str(HIGHLIGHT_DURATION_MS))
+
+# 截图时隐藏坐标标记（操作效果校验用的截图，见 effect_verifier）
+HIDE_OVERLAY_CSS = "a2i-overlay { display: none !important; }"
+
+# 手动标记某个坐标（例如非鼠标操作）；脚本固定不变，只传参数
+HIGHLIGHT_CALL_JS = "([x, y, duration]) => window.__a2iHighlight && window.__a2iHighlight(x, y, duration)"
+
+SCROLL_JS = "([x, y]) => window.scrollTo(x, y)"
+
+# 批量执行时，这些操作之后不等待页面稳定（不会引起导航或大范围的 DOM 变化）
+BATCH_NO_SETTLE = ("type", "hover", "wait")
+
+
+def init_scripts():
+    """新建 context 时需要注入的初始化脚本（同步/异步 operator 共用）"""
+    return [SETTLE_INIT_SCRIPT, HIGHLIGHT_INIT_SCRIPT] if HIGHLIGHT_ENABLED else [SETTLE_INIT_SCRIPT]
+
+
+def settles_after(action, last=False):
+    """批量执行中该操作之后是否需要等待页面稳定；最后一个操作之后总是等待"""
+    kind = action_type(action)
+    if last or kind not in BATCH_NO_SETTLE + ("press_key",):
+        return True
+    return kind == "press_key" and action.key == "Enter"
+
+
+def elements_after(action, elements):
+    """执行 action 之后仍可用于坐标吸附的元素列表。
+
+    元素列表来自本步截图时的页面；可能引起导航或大范围 DOM 变化的操作（需要等待页面稳定的操作，见 settles_after）
+    之后位置可能已经改变，返回 None，后续操作按模型给出的坐标执行，不再吸附到过时的元素上。
+    """
+    return elements if elements and not settles_after(action) else None
+
+
+def norm_to_pixel(x_norm, y_norm):
+    width, height = VIEWPORT["width"], VIEWPORT["height"]
+    return int(x_norm * width), int(y_norm * height)
+
+
+def action_type(action):
+    """操作类型（用于日志与追踪），不是 Action 时为 None"""
+    return action.kind if isinstance(action, Action) else None
+
+
+def to_action(action):
+    """执行前确保是编译好的 Action（调用方也可能直接传入操作字典，像素坐标按视口换算）；不符合格式时打印错误并返回 None"""
+    if isinstance(action, Action):
+        return action
+    try:
+        return compile_action(action, size=(VIEWPORT["width"], VIEWPORT["height"]))
+    except ActionParseError as e:
+        print("[错误] 操作参数无效:", e)
+        return None
+
+
+def snap_to_elements(action, elements):
+    """按截图时的元素列表修正操作坐标（同步/异步 operator 共用），发生吸附时打印说明"""
+    snapped, element = snap_action(action, elements, VIEWPORT["width"], VIEWPORT["height"])
+    if element is not None:
+        print(f"[定位] 坐标吸附到元素 [{element.id}] {element.role} \"{element.label}\": "
+              f"{action.points[0]} -> {snapped.points[0]}")
+    return snapped
+
+
+def resolve_action(action, to_pixel=norm_to_pixel):
+    """把操作换算为像素坐标的 ResolvedAction；参数不符合格式时打印错误并返回 None"""
+    action = to_action(action)
+    if action is None:
+        return None
+    return ResolvedAction(action.kind, [to_pixel(x, y) for x, y in action.points], action.text, action.key,
+                          action.duration)
+
 
 class UIOperator:
-    def __init__(self, target_url=TARGET_URL, headless=True):
-        self.playwright = sync_playwright().start()
-        self.browser = self.playwright.chromium.launch(headless=headless)
+    def __init__(self, target_url=TARGET_URL, headless=True, browser=None, settle=None, storage_state=None):
+        # 传入 browser 时复用已有的 Chromium 进程（浏览器池），只新建一个隔离的 context；
+        # storage_state 为保存的登录状态（cookie 与 localStorage，见 storage_state.py）
+        self._owns_browser = browser is None
+        if self._owns_browser:
+            self.playwright = sync_playwright().start()
+            self.browser = self.playwright.chromium.launch(headless=headless)
+        else:
+            self.playwright = None
+            self.browser = browser
         # 关键改动在这里：设置 viewport 和 device_scale_factor
-        self.page = self.browser.new_page(
-            viewport={"width": 1280, "height": 720},
-            device_scale_factor=1  # 强制设置为 1
+        self.context = self.browser.new_context(
+            viewport=VIEWPORT,
+            device_scale_factor=1,  # 强制设置为 1
+            storage_state=storage_state,
         )
+        # 页面稳定检测与坐标标记脚本需在任何页面脚本之前注入
+        for script in init_scripts():
+            self.context.add_init_script(script)
+        self.settle = settle or SettleDetector()
+        self.page = self.context.new_page()
+        self._screencast = None  # 实时画面的 CDP 会话（见 start_screencast）
+        self.set_call_timeout()
         if target_url:
-            self.page.goto(target_url)
-            self.page.wait_for_timeout(1000)
+            self.navigate_to(target_url)
+
+    def set_call_timeout(self, timeout_ms=BROWSER_CALL_TIMEOUT_MS):
+        """设置截图、导航与等待类调用的默认超时；任务执行时按剩余预算调低（见 task_control）"""
+        self.page.set_default_timeout(timeout_ms)
+        self.page.set_default_navigation_timeout(timeout_ms)
 
     def navigate_to(self, url):
         """导航到指定URL"""
         if not url:
             raise ValueError("URL不能为空")
-        self.page.goto(url)
-        self.page.wait_for_timeout(1000)
-
-    def screenshot(self, path):
-        self.page.wait_for_load_state("networkidle")  # 等待网络静止
-        self.page.wait_for_timeout(500)               # 额外等待动画结束
-        self.page.screenshot(path=path, full_page=False)
-
-    def highlight_point(self, x, y, duration=1500):
-        js = f"""
-        const dot = document.createElement("div");
-        dot.style.cssText = `
-            position: fixed;
-            left: {x - 3}px;
-            top: {y - 3}px;
-            width: 6px;
-            height: 6px;
-            border-radius: 50%;
-            background: red;
-            z-index: 99999;
-            pointer-events: none;
-        `;
-
-        const label = document.createElement("div");
-        label.textContent = "({x},{y})";
-        label.style.cssText = `
-            position: fixed;
-            left: {x + 8}px;
-            top: {y - 6}px;
-            font-size: 10px;
-            background: rgba(0,0,0,0.7);
-            color: white;
-            padding: 1px 4px;
-            border-radius: 3px;
-            z-index: 99999;
-            pointer-events: none;
-        `;
-
-        document.body.append(dot);
-        document.body.append(label);
-
-        setTimeout(() => {{
-            requestAnimationFrame(() => {{
-                dot.remove();
-                label.remove();
-            }});
-        }}, {duration});
+        with span("page.goto"):
+            self.page.goto(url)
+        self.settle.wait(self.page, "navigate")
+
+    def screenshot(self, settle=True, overlay=True):
+        """截图并返回 PNG 字节，可直接交给 call_ai(img_bytes=...)；落盘统一交给 screenshot_store。
+
+        settle=False 时不等待页面稳定，立即截图（见 capture.CapturePolicy）；overlay=False 时截图中不含坐标标记。
         """
-        self.page.evaluate(js)
+        if settle:
+            self.settle.wait(self.page, "screenshot")  # 等待 DOM、网络与动画稳定
+        with span("screenshot.capture"):
+            data = self.page.screenshot(full_page=False, style=None if overlay else HIDE_OVERLAY_CSS)
+        return data
+
+    def highlight_point(self, x, y, duration=HIGHLIGHT_DURATION_MS):
+        if HIGHLIGHT_ENABLED:
+            self.page.evaluate(HIGHLIGHT_CALL_JS, [x, y, duration])
 
     def norm_to_pixel(self, x_norm, y_norm):
-        width, height = 1280, 720
-        return int(x_norm * width), int(y_norm * height)
-    
-    def execute_action(self, action_json):
-        if not isinstance(action_json, dict):
-            print("[错误] execute_action 参数不是字典类型:", action_json)
-            return
+        return norm_to_pixel(x_norm, y_norm)
+
+    def element_map(self):
+        """收集视口内可见的可交互元素（一次 page.evaluate），返回 dom_grounding.Element 列表"""
+        with span("dom.element_map") as map_span:
+            try:
+                elements = parse_elements(self.page.evaluate(ELEMENT_MAP_JS, DOM_GROUNDING_MAX_ELEMENTS))
+            except Exception as e:
+                print("[定位] 收集页面元素失败:", e)
+                elements = []
+            map_span.set(elements=len(elements))
+        return elements
+
+    def execute_action(self, action, elements=None, settle=True):
+        """执行一个操作（actions.Action，或操作字典），成功返回 True，参数无效或执行出错返回 False。
+
+        elements 为截图时的元素列表（见 element_map），给出时先把坐标吸附到最近的匹配元素；
+        settle=False 时执行后不等待页面稳定（批量执行的中间操作）。
+        """
+        action = to_action(action)
+        if action is None:
+            return False
+        if elements:
+            action = snap_to_elements(action, elements)
+        with span("action.execute", action=action.kind) as action_span:
+            ok = self._execute_action(action, settle)
+            action_span.set(ok=ok)
+        return ok
+
+    def execute_actions(self, actions, elements=None):
+        """连续执行一组操作，返回每个操作是否成功。
+
+        中间的输入、悬停等操作之后不等待页面稳定（见 settles_after），整组执行完再等待一次，
+        减少与浏览器之间的往返；某个操作失败时继续执行后面的操作，与逐个执行一致。
+        elements 只用于页面发生变化之前的操作（见 elements_after）。
+        """
+        results = []
+        with span("action.batch", count=len(actions)):
+            for index, action in enumerate(actions):
+                action = to_action(action)
+                settle = settles_after(action, last=index == len(actions) - 1)
+                results.append(self.execute_action(action, elements, settle))
+                elements = elements_after(action, elements)
+        return results
 
-        action = action_json.get("action")
-        coordinate = action_json.get("coordinate", {})
+    def _type_text(self, text):
+        # 一次 insert_text 填入全部文字；含换行、制表符时仍逐键输入，保留回车提交等按键语义
+        if TYPE_FAST_FILL and "\n" not in text and "\t" not in text:
+            self.page.keyboard.insert_text(text)
+        else:
+            self.page.keyboard.type(text)
 
-        def resolve_xy(coordinate_dict, keys=("x", "y")):
-            x_norm = coordinate_dict.get(keys[0])
-            y_norm = coordinate_dict.get(keys[1])
-            if isinstance(x_norm, float) and isinstance(y_norm, float):
-                return self.norm_to_pixel(x_norm, y_norm)
-            return x_norm, y_norm  # 若非归一化，按原样处理
+    def _execute_action(self, action, settle=True):
+        resolved = resolve_action(action, self.norm_to_pixel)
+        if resolved is None:
+            return False
 
+        action, points = resolved.action, resolved.points
         try:
             if action == "click":
-                if "x" in coordinate and "y" in coordinate:
-                    x, y = resolve_xy(coordinate)
-                elif "click" in coordinate:
-                    x, y = resolve_xy(coordinate["click"])
-                else:
-                    print("[错误] click 操作缺少坐标:", coordinate)
-                    return
-
+                x, y = points[0]
                 print(f"[操作] 点击坐标: ({x}, {y})")
-                self.highlight_point(x, y)
                 self.page.mouse.click(x, y)
 
             elif action == "type":
-                if "x" in coordinate and "y" in coordinate:
-                    x, y = resolve_xy(coordinate)
-                elif "type" in coordinate:
-                    x, y = resolve_xy(coordinate["type"])
-                else:
-                    print("[错误] type 操作缺少坐标:", coordinate)
-                    return
-
-                text = action_json.get("text", "")
-                if not text:
-                    print("[错误] type 操作缺少 text 字段")
-                    return
-
-                print(f"[操作] 输入坐标: ({x}, {y}), 文字: {text}")
-                self.highlight_point(x, y)
+                x, y = points[0]
+                print(f"[操作] 输入坐标: ({x}, {y}), 文字: {resolved.text}")
                 self.page.mouse.click(x, y)
-                self.page.keyboard.type(text)
+                self._type_text(resolved.text)
 
             elif action == "swipe":
-                if all(k in coordinate for k in ("x1", "y1", "x2", "y2")):
-                    x1, y1 = resolve_xy(coordinate, ("x1", "y1"))
-                    x2, y2 = resolve_xy(coordinate, ("x2", "y2"))
-                elif "swipe" in coordinate:
-                    swipe = coordinate["swipe"]
-                    x1, y1 = resolve_xy(swipe, ("x1", "y1"))
-                    x2, y2 = resolve_xy(swipe, ("x2", "y2"))
-                else:
-                    print("[错误] swipe 操作缺少完整坐标:", coordinate)
-                    return
-
+                (x1, y1), (x2, y2) = points
                 print(f"[操作] 滑动坐标: ({x1}, {y1}) -> ({x2}, {y2})")
-                self.highlight_point(x1, y1)
                 self.page.mouse.move(x1, y1)
                 self.page.mouse.down()
                 self.page.wait_for_timeout(100)
@@ -144,51 +266,85 @@ class UIOperator:
                 self.page.mouse.up()
 
             elif action == "hover":
-                x, y = resolve_xy(coordinate)
+                x, y = points[0]
                 print(f"[操作] 鼠标悬停坐标: ({x}, {y})")
-                self.highlight_point(x, y)
                 self.page.mouse.move(x, y)
 
             elif action == "double_click":
-                x, y = resolve_xy(coordinate)
+                x, y = points[0]
                 print(f"[操作] 双击坐标: ({x}, {y})")
-                self.highlight_point(x, y)
                 self.page.mouse.dblclick(x, y)
 
             elif action == "right_click":
-                x, y = resolve_xy(coordinate)
+                x, y = points[0]
                 print(f"[操作] 右键点击坐标: ({x}, {y})")
-                self.highlight_point(x, y)
                 self.page.mouse.click(x, y, button="right")
 
             elif action == "press_key":
-                key = action_json.get("key")
-                if not key:
-                    print("[错误] press_key 操作缺少 key 字段")
-                    return
-                print(f"[操作] 按键: {key}")
-                self.page.keyboard.press(key)
+                print(f"[操作] 按键: {resolved.key}")
+                self.page.keyboard.press(resolved.key)
 
             elif action == "wait":
-                duration = action_json.get("duration", 1000)
-                print(f"[操作] 等待 {duration} 毫秒")
-                self.page.wait_for_timeout(duration)
+                print(f"[操作] 等待 {resolved.duration} 毫秒")
+                self.page.wait_for_timeout(resolved.duration)
 
             elif action == "scroll_to":
-                x, y = resolve_xy(coordinate)
+                x, y = points[0]
                 print(f"[操作] 页面滚动到: ({x}, {y})")
-                js_scroll = f"window.scrollTo({x}, {y});"
-                self.page.evaluate(js_scroll)
+                self.page.evaluate(SCROLL_JS, [x, y])
 
-            else:
-                print(f"[错误] 未知 action 类型: {action}")
-                return
-
-            self.page.wait_for_timeout(1200)
+            # 按页面实际稳定情况等待，而不是固定 sleep
+            if settle:
+                self.settle.wait(self.page, action)
+            return True
 
         except Exception as e:
             print("[异常] 执行操作时出错:", e)
+            return False
+
+    def start_screencast(self, on_frame, params):
+        """通过 CDP 开始推送画面帧，on_frame(jpeg_bytes, metadata) 在浏览器线程中被调用。
+
+        同步 API 只在 Playwright 调用期间分发事件，浏览器线程空闲时需定期处理事件（见 global_operator）。
+        """
+        self.stop_screencast()
+        cdp = self.context.new_cdp_session(self.page)
+
+        def handle_frame(event):
+            # 先确认，Chromium 收到确认后才会发送下一帧
+            try:
+                cdp.send("Page.screencastFrameAck", {"sessionId": event["sessionId"]})
+            except Exception:
+                return
+            on_frame(base64.b64decode(event["data"]), event.get("metadata"))
+
+        cdp.on("Page.screencastFrame", handle_frame)
+        cdp.send("Page.startScreencast", params)
+        self._screencast = cdp
+
+    def stop_screencast(self):
+        cdp, self._screencast = self._screencast, None
+        if cdp is None:
+            return
+        try:
+            cdp.send("Page.stopScreencast")
+            cdp.detach()
+        except Exception:
+            pass  # 页面或 context 已关闭
+
+    def is_healthy(self):
+        """健康检查：浏览器连接正常且页面可以执行脚本"""
+        try:
+            if not self.browser.is_connected() or self.page.is_closed():
+                return False
+            return self.page.evaluate("1 + 1") == 2
+        except Exception:
+            return False
 
     def close(self):
-        self.browser.close()
-        self.playwright.stop()
\ No newline at end of file
+        try:
+            self.context.close()
+        finally:
+            if self._owns_browser:
+                self.browser.close()
+                self.playwright.stop()